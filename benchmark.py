@@ -0,0 +1,281 @@
+"""Benchmark suite measuring throughput, memory and latency of trip generation.
+
+Each case runs in a fresh process, so peak memory is measured per case. Results are saved as JSON and can be
+compared against an earlier run to catch performance regressions, e.g.
+
+    python benchmark.py --quick --output bench_new.json --compare bench_old.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from holiday_calendar import HolidayCalendar
+from population import create_population_data
+from sweep import iter_sweep, scenario_grid
+from trip_creation import create_synthetic_data, iter_synthetic_data
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+START_DATE = datetime(year=2000, month=1, day=1)
+
+# flags of creation, varied by sweep cases
+FLAG_NAMES = ("location_scatter", "departure_time_scatter", "travel_time_scatter", "monthly_trip", "seasonal_trip")
+
+
+class BenchmarkCase(NamedTuple):
+    """Parameters of a single benchmark run."""
+    name: str
+    mode: str                       # "loop", "vectorized", "streaming", "population" or "sweep"
+    months: int                     # length of simulated time range
+    location_scatter: bool
+    departure_time_scatter: bool
+    travel_time_scatter: bool
+    n_locations: int                # size of location catalog, at least the sample locations
+    n_agents: int = 1
+
+
+def _end_date(months: int) -> datetime:
+    """Day after time range of given number of months starting at `START_DATE`."""
+    months = START_DATE.month - 1 + months
+    return datetime(year=START_DATE.year + months // 12, month=months % 12 + 1, day=1)
+
+
+def _location_catalog(n_locations: int) -> tuple:
+    """Sample locations and travel times, extended by synthetic points of interest around home.
+
+    Returns:
+        Tuple of known locations and travel time dict.
+    """
+    with open(os.path.join(DATA_DIRECTORY, "known_locations.json"), "r") as f:
+        known_locations = json.load(f)["data"]
+    with open(os.path.join(DATA_DIRECTORY, "travel_times.json"), "r") as f:
+        travel_time_dict = json.load(f)
+
+    home = next(e for e in known_locations if e["name"] == "home")
+    rng = np.random.default_rng(0)
+    for i in range(max(n_locations - len(known_locations), 0)):
+        name = f"poi_{i}"
+        lat, lon = home["gps_lat"] + rng.normal(0, 0.1), home["gps_lon"] + rng.normal(0, 0.1)
+        known_locations.append({"gps_lat": lat, "gps_lon": lon, "name": name})
+        # about 50 km/h on the direct line, 1 degree is about 111 km
+        seconds = float(np.hypot(lat - home["gps_lat"], lon - home["gps_lon"]) * 111e3 / 50 * 3.6)
+        travel_time_dict["home"][name] = seconds
+        travel_time_dict[name] = {"home": seconds}
+    return known_locations, travel_time_dict
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of current process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_case(case: BenchmarkCase) -> dict:
+    """Run single benchmark case, meant to be executed in a fresh process."""
+    known_locations, travel_time_dict = _location_catalog(case.n_locations)
+    holidays = HolidayCalendar.from_file(os.path.join(DATA_DIRECTORY, "holidays.json"))
+    kwargs = dict(known_locations=known_locations,
+                  travel_time_dict=travel_time_dict,
+                  location_scatter=case.location_scatter,
+                  departure_time_scatter=case.departure_time_scatter,
+                  travel_time_scatter=case.travel_time_scatter,
+                  monthly_trip=True,
+                  seasonal_trip=True,
+                  additional_holidays=holidays,
+                  start_date=START_DATE,
+                  end_date=_end_date(case.months))
+
+    # warm up one-time work like loading the default schedule on a single week
+    create_synthetic_data(vectorized=case.mode != "loop",
+                          **dict(kwargs, end_date=datetime(year=START_DATE.year, month=START_DATE.month, day=8)))
+    rss_before = _peak_rss_bytes()
+
+    base_seconds = None
+    if case.mode == "sweep":
+        # single run of all flags as reference of the cost of a sweep
+        start = time.perf_counter()
+        create_synthetic_data(vectorized=True, rng=np.random.default_rng(0), **kwargs)
+        base_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    time_to_first_row = None
+    if case.mode == "streaming":
+        n_trips = 0
+        for df in iter_synthetic_data(rng=np.random.default_rng(0), **kwargs):
+            if time_to_first_row is None and len(df):
+                time_to_first_row = time.perf_counter() - start
+            n_trips += len(df)
+    elif case.mode == "sweep":
+        # full grid of flags of a single seed, i.e. four trip sets with eight combinations of scatter each
+        n_trips = 0
+        sweep_kwargs = {name: value for name, value in kwargs.items() if name not in FLAG_NAMES}
+        for _, columns in iter_sweep(scenarios=scenario_grid(seeds=(0,)), **sweep_kwargs):
+            if time_to_first_row is None and len(columns["t_start"]):
+                time_to_first_row = time.perf_counter() - start
+            n_trips += len(columns["t_start"])
+    elif case.mode == "population":
+        n_trips = len(create_population_data(n_agents=case.n_agents,
+                                             master_seed=0,
+                                             n_workers=1,
+                                             **kwargs))
+    else:
+        n_trips = len(create_synthetic_data(vectorized=case.mode == "vectorized",
+                                            rng=np.random.default_rng(0),
+                                            **kwargs))
+    seconds = time.perf_counter() - start
+
+    return {**case._asdict(),
+            "trips": n_trips,
+            "seconds": seconds,
+            "trips_per_second": n_trips / seconds if seconds > 0 else float("inf"),
+            "time_to_first_row": seconds if time_to_first_row is None else time_to_first_row,
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "baseline_rss_bytes": rss_before,
+            "base_seconds": base_seconds}
+
+
+def benchmark_cases(quick: bool = False) -> List[BenchmarkCase]:
+    """Default grid of benchmark cases, reduced to short runs if `quick`."""
+    all_scatter = (True, True, True)
+    no_scatter = (False, False, False)
+    ranges = (1, 12) if quick else (1, 12, 60, 240)
+
+    cases = []
+    for months in ranges:
+        for scatter in (all_scatter, no_scatter):
+            label = "scatter" if scatter == all_scatter else "no_scatter"
+            for mode in ("vectorized", "streaming"):
+                cases.append(BenchmarkCase(f"{mode}_{months}m_{label}", mode, months, *scatter, n_locations=8))
+        # day loop is the reference implementation, only measured on shorter ranges
+        if months <= 60:
+            cases.append(BenchmarkCase(f"loop_{months}m_scatter", "loop", months, *all_scatter, n_locations=8))
+
+    for scatter in ((True, False, False), (False, True, False), (False, False, True)):
+        name = "_".join(n for n, s in zip(("location", "departure", "travel"), scatter) if s)
+        cases.append(BenchmarkCase(f"vectorized_12m_{name}_scatter", "vectorized", 12, *scatter, n_locations=8))
+
+    for n_locations in ((100, 1000) if quick else (100, 1000, 10000)):
+        cases.append(BenchmarkCase(f"vectorized_12m_{n_locations}_locations", "vectorized", 12, *all_scatter,
+                                   n_locations=n_locations))
+
+    # sweep of all 32 combinations of flags, compared against a single run by `base_seconds`
+    for months in ((12,) if quick else (12, 60)):
+        cases.append(BenchmarkCase(f"sweep_{months}m_32_scenarios", "sweep", months, *all_scatter, n_locations=8))
+
+    for n_agents in ((10,) if quick else (10, 100, 1000)):
+        cases.append(BenchmarkCase(f"population_12m_{n_agents}_agents", "population", 12, *all_scatter,
+                                   n_locations=8, n_agents=n_agents))
+    return cases
+
+
+def _environment() -> dict:
+    """Description of environment the benchmark runs in."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()}
+
+
+def run_benchmarks(cases: List[BenchmarkCase],
+                   repeat: int = 1) -> dict:
+    """Run each case in a fresh process, keeping the fastest of `repeat` runs.
+
+    Args:
+        cases:      Benchmark cases to run
+        repeat:     Number of runs per case
+
+    Returns:
+        Dict with description of environment and list of results per case.
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(_run_case, case).result())
+        best = min(runs, key=lambda r: r["seconds"])
+        sweep_cost = f" {best['seconds'] / best['base_seconds']:>6.1f} base runs" if best["base_seconds"] else ""
+        print(f"{case.name:45s} {best['trips']:>10d} trips {best['trips_per_second']:>14,.0f} trips/s "
+              f"{best['time_to_first_row'] * 1e3:>10.1f} ms to first row "
+              f"{best['peak_rss_bytes'] / 2 ** 20:>8.1f} MiB peak RSS{sweep_cost}", flush=True)
+        results.append(best)
+    return {"environment": _environment(),
+            "results": results}
+
+
+def compare_results(results: dict,
+                    baseline: dict,
+                    tolerance: float = 0.2) -> List[str]:
+    """Compare throughput of cases present in both runs.
+
+    Args:
+        results:    Results of current run
+        baseline:   Results of earlier run
+        tolerance:  Tolerated relative drop of throughput
+
+    Returns:
+        Descriptions of regressions, empty if there are none.
+    """
+    baseline_results = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        reference = baseline_results.get(result["name"])
+        if reference is None:
+            continue
+        ratio = result["trips_per_second"] / reference["trips_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result['name']}: {ratio:.2f}x throughput of baseline")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="only run short cases")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, fastest run is kept")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this string")
+    parser.add_argument("--output", default="benchmark_results.json", help="path of JSON file to save results to")
+    parser.add_argument("--compare", help="path of JSON file of earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="tolerated relative drop of throughput")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat requires at least one run per case")
+
+    cases = [c for c in benchmark_cases(quick=args.quick) if args.filter in c.name]
+    results = run_benchmarks(cases, repeat=args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare_results(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,504 @@
+"""Module providing vectorized calendar engine to create sequence of trips in bulk."""
+from datetime import datetime, date
+from typing import TYPE_CHECKING, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from holiday_calendar import HolidayCalendar
+from location_index import LocationIndex, SpeedModel, compile_location_index
+from noise import (CounterNoise, DEPARTURE_TIME_STREAM, LATITUDE_STREAM, LONGITUDE_STREAM, OPTION_STREAM,
+                   TRAVEL_TIME_STREAM)
+from profiling import GenerationStats, timed
+from schedule import SchedulePlan, default_schedule
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS, local_timestamps
+from validation import repair_trips
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class Calendar(NamedTuple):
+    """Per-day masks of the simulated time range, one entry per day."""
+    days: np.ndarray            # dates as datetime64[D]
+    weekday: np.ndarray         # day of week, 0 is Monday
+    month: np.ndarray           # month of year, 1 is January
+    months: np.ndarray          # months since 1970-01
+    holiday: np.ndarray         # flag if day is an additional holiday
+
+
+class TripSkeleton(NamedTuple):
+    """Deterministic part of a sequence of trips, one entry per trip ordered by time."""
+    day_index: np.ndarray       # index of trip day in calendar
+    template: np.ndarray        # index of trip template in schedule plan
+
+
+class TripBase(NamedTuple):
+    """Resolved locations and times of a skeleton before random scatter, one entry per trip ordered by time."""
+    template: np.ndarray            # index of trip template in schedule plan
+    day_number: np.ndarray          # day of trip as days since 1970-01-01, key of counter-based noise
+    start_location_id: np.ndarray   # ID of start location in location index
+    end_location_id: np.ndarray     # ID of end location in location index
+    start_lat: np.ndarray           # coordinates of start and end location, without scatter
+    start_lon: np.ndarray
+    end_lat: np.ndarray
+    end_lon: np.ndarray
+    start_timestamp: np.ndarray     # departure as POSIX timestamp in seconds, without scatter
+    travel_time: np.ndarray         # travel time in seconds, without scatter
+    sigma: np.ndarray               # standard deviation of departure time scatter in seconds
+
+
+def build_calendar(start_date: datetime,
+                   end_date: datetime,
+                   additional_holidays: Optional[Union[HolidayCalendar, List[date]]] = None) -> Calendar:
+    """Build all per-day masks of given time range at once.
+
+    As in the day loop of `create_synthetic_data`, the range covers `start_date` up to but excluding `end_date`.
+
+    Args:
+        start_date:             First day of relevant time range
+        end_date:               Day after the last day of relevant time range
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+
+    Returns:
+        Calendar of time range.
+    """
+    first_day = np.datetime64(start_date.date() if isinstance(start_date, datetime) else start_date, "D")
+    days = first_day + np.arange((end_date - start_date).days)
+
+    day_numbers = days.astype(np.int64)
+    # 1970-01-01 was a Thursday
+    weekday = (day_numbers + 3) % 7
+    months = days.astype("datetime64[M]").astype(np.int64)
+    month = months % 12 + 1
+
+    holiday = HolidayCalendar.coerce(additional_holidays).mask(days)
+
+    return Calendar(days=days,
+                    weekday=weekday,
+                    month=month,
+                    months=months,
+                    holiday=holiday)
+
+
+def month_start(start_date: datetime) -> datetime:
+    """First day of month of given date, from which on the month has to be evaluated to resolve the monthly trip."""
+    return start_date.replace(day=1)
+
+
+def month_windows(start_date: datetime,
+                  end_date: datetime,
+                  chunk_months: int) -> Iterator[Tuple[datetime, datetime]]:
+    """Split time range into consecutive windows ending at month boundaries.
+
+    Yields:
+        Tuples of first day and day after last day of each window.
+
+    Raises:
+        ValueError: If `chunk_months` is not positive, as windows would not advance.
+    """
+    if chunk_months < 1:
+        raise ValueError(f"Windows have to span at least one month, got {chunk_months}.")
+    window_start = start_date
+    while window_start < end_date:
+        months = window_start.month - 1 + chunk_months
+        window_end = min(datetime(year=window_start.year + months // 12, month=months % 12 + 1, day=1), end_date)
+        yield window_start, window_end
+        window_start = window_end
+
+
+def _first_in_month(calendar: Calendar,
+                    mask: np.ndarray) -> np.ndarray:
+    """Restrict day mask to the first day of each month."""
+    candidates = np.flatnonzero(mask)
+    # np.unique returns index of first occurrence
+    _, first = np.unique(calendar.months[candidates], return_index=True)
+    first_days = candidates[first]
+    result = np.zeros(len(mask), dtype=bool)
+    result[first_days] = True
+    return result
+
+
+def create_trip_skeleton(calendar: Calendar,
+                         schedule: SchedulePlan,
+                         monthly_trip: bool,
+                         seasonal_trip: bool,
+                         rng: Optional[np.random.Generator] = None,
+                         noise: Optional[CounterNoise] = None,
+                         first_day: int = 0) -> TripSkeleton:
+    """Evaluate schedule plan over the whole calendar at once and order emitted trips by time.
+
+    Trips of each template are emitted as array slices of the days on which the template applies.
+
+    Args:
+        calendar:       Calendar of time range as created by `build_calendar`
+        schedule:       Compiled schedule plan
+        monthly_trip:   Flag to indicate if monthly trips should be included
+        seasonal_trip:  Flag to indicate if seasonal trips should be included
+        rng:            Optional random generator, global NumPy random state if not given
+        noise:          Optional counter-based noise keyed on day and option slot, used instead of `rng` if given
+        first_day:      Index of first calendar day on which trips are emitted, earlier days are only evaluated to
+                        resolve the monthly trip
+
+    Returns:
+        Skeleton of trips ordered by time.
+    """
+    if rng is None:
+        rng = np.random
+
+    n_days = len(calendar.days)
+    day_masks = [(calendar.weekday == w) & ~(calendar.holiday & schedule.skip_holidays[w]) for w in range(7)]
+    condition_masks = {"seasonal": np.isin(calendar.month, schedule.seasonal_months) if seasonal_trip
+                       else np.zeros(n_days, dtype=bool)}
+
+    day_numbers = calendar.days.astype(np.int64)
+
+    # one random draw per day and branch option, evaluated before calendar conditions
+    option_masks = []
+    for branch, slots in zip(schedule.branches, schedule.option_slots):
+        option_masks.append([])
+        for option, slot in zip(branch.options, slots):
+            mask = day_masks[branch.weekday].copy()
+            for condition in option.when:
+                if condition != "monthly":
+                    mask &= condition_masks[condition]
+            if option.probability is not None:
+                draws = rng.random(n_days) if noise is None else noise.uniform(day_numbers, slot, OPTION_STREAM)
+                mask &= draws < option.probability
+            option_masks[-1].append(mask)
+
+    # monthly trip is taken on first day of month on which any monthly option is reached
+    monthly_candidates = np.zeros(n_days, dtype=bool)
+    if monthly_trip:
+        for branch, masks in zip(schedule.branches, option_masks):
+            reached = np.ones(n_days, dtype=bool)
+            for option, mask in zip(branch.options, masks):
+                if "monthly" in option.when:
+                    monthly_candidates |= reached & mask
+                else:
+                    reached &= ~mask
+    monthly_days = _first_in_month(calendar=calendar,
+                                   mask=monthly_candidates)
+
+    day_index = []
+    template = []
+
+    def emit(template_ids, mask):
+        days = np.flatnonzero(mask)
+        for i in template_ids:
+            day_index.append(days)
+            template.append(np.full(len(days), i, dtype=np.int64))
+
+    for i in schedule.unconditional_templates:
+        emit((i,), day_masks[schedule.templates[i].weekday])
+
+    monthly_claimed = np.zeros(n_days, dtype=bool)
+    for branch, masks in zip(schedule.branches, option_masks):
+        reached = np.ones(n_days, dtype=bool)
+        for option, mask in zip(branch.options, masks):
+            taken = reached & mask
+            if "monthly" in option.when:
+                taken &= monthly_days & ~monthly_claimed
+                monthly_claimed |= taken
+            emit(option.templates, taken)
+            reached &= ~taken
+
+    day_index = np.concatenate(day_index) if day_index else np.zeros(0, dtype=np.int64)
+    template = np.concatenate(template) if template else np.zeros(0, dtype=np.int64)
+
+    if first_day:
+        keep = day_index >= first_day
+        day_index = day_index[keep]
+        template = template[keep]
+
+    # order by day, then by scheduled departure, then by order of templates in schedule
+    order = np.lexsort((template, schedule.template_seconds[template], day_index))
+
+    return TripSkeleton(day_index=day_index[order],
+                        template=template[order])
+
+
+def resolve_trip_base(skeleton: TripSkeleton,
+                      calendar: Calendar,
+                      schedule: SchedulePlan,
+                      location_index: LocationIndex,
+                      stats: Optional[GenerationStats] = None) -> TripBase:
+    """Resolve locations and times of all trips of a skeleton at once, i.e. everything but the random scatter.
+
+    Lookups and time stamps are timed as separate stages if `stats` is given.
+
+    Returns:
+        Base of trips, to which scatter is added by `apply_trip_scatter`.
+    """
+    template = skeleton.template
+    n_trips = len(template)
+
+    with timed(stats, "location_lookup", rows=n_trips):
+        # per-template lookup tables, indexed by template index of each trip; locations of templates which are
+        # disabled by flags may be unknown, but such templates are never part of the skeleton
+        start_ids = location_index.location_ids(t.start_location for t in schedule.templates)
+        end_ids = location_index.location_ids(t.end_location for t in schedule.templates)
+        base_travel_time = location_index.travel_time(start_ids, end_ids)
+        sigma = np.array([schedule.departure_time_sigma(start_location=t.start_location,
+                                                        hour=t.seconds // 3600) for t in schedule.templates])
+        start_ids = start_ids[template]
+        end_ids = end_ids[template]
+
+    with timed(stats, "timestamps", rows=n_trips):
+        day_seconds = calendar.days.astype("datetime64[s]").astype(np.int64)
+        start_timestamp = local_timestamps(day_seconds[skeleton.day_index] + schedule.template_seconds[template])
+
+    return TripBase(template=template,
+                    day_number=calendar.days[skeleton.day_index].astype(np.int64),
+                    start_location_id=start_ids,
+                    end_location_id=end_ids,
+                    start_lat=location_index.lat[start_ids],
+                    start_lon=location_index.lon[start_ids],
+                    end_lat=location_index.lat[end_ids],
+                    end_lon=location_index.lon[end_ids],
+                    start_timestamp=start_timestamp,
+                    travel_time=base_travel_time[template],
+                    sigma=sigma[template])
+
+
+def apply_trip_scatter(base: TripBase,
+                       location_scatter: bool,
+                       departure_time_scatter: bool,
+                       travel_time_scatter: bool,
+                       rng: Optional[np.random.Generator] = None,
+                       stats: Optional[GenerationStats] = None,
+                       noise: Optional[CounterNoise] = None,
+                       draws: Optional[dict] = None) -> dict:
+    """Add random scatter to the base of trips, timed as stage "random_draws" if `stats` is given.
+
+    If `noise` is given, scatter is drawn from counter-based noise keyed on day and template of each trip instead of
+    `rng`. Such draws do not depend on the flags, hence they may be kept in `draws`, a dict filled per stream on first
+    use, to share them in between calls on the same base.
+
+    Returns:
+        Dict mapping each of `TRIP_COLUMNS` and `LOCATION_ID_COLUMNS` to an array with one entry per trip.
+    """
+    if rng is None:
+        rng = np.random
+
+    n_trips = len(base.template)
+
+    with timed(stats, "random_draws", rows=n_trips):
+        if noise is None:
+            def standard_normal(stream):
+                return rng.standard_normal(n_trips)
+        else:
+            if draws is None:
+                draws = {}
+
+            def standard_normal(stream):
+                if stream not in draws:
+                    draws[stream] = noise.normal(base.day_number, base.template, stream)
+                return draws[stream]
+
+        if departure_time_scatter:
+            dt_scatter = standard_normal(DEPARTURE_TIME_STREAM) * base.sigma
+        else:
+            dt_scatter = np.zeros(n_trips)
+
+        if location_scatter:
+            lat_scatter = standard_normal(LATITUDE_STREAM) * 5e-4
+            lon_scatter = standard_normal(LONGITUDE_STREAM) * 5e-4
+        else:
+            lat_scatter = lon_scatter = np.zeros(n_trips)
+
+        travel_time = base.travel_time
+        if travel_time_scatter:
+            travel_time = travel_time * (1 + standard_normal(TRAVEL_TIME_STREAM) * 0.05)
+
+    return {"gps_start_lat": base.start_lat + lat_scatter,
+            "gps_start_lon": base.start_lon + lon_scatter,
+            "t_start": (base.start_timestamp + dt_scatter) * 1000,
+            "t_end": (base.start_timestamp + travel_time + dt_scatter) * 1000,
+            "gps_end_lat": base.end_lat + lat_scatter,
+            "gps_end_lon": base.end_lon + lon_scatter,
+            "start_location_id": base.start_location_id,
+            "end_location_id": base.end_location_id}
+
+
+def apply_trip_details(skeleton: TripSkeleton,
+                       calendar: Calendar,
+                       schedule: SchedulePlan,
+                       location_index: LocationIndex,
+                       location_scatter: bool,
+                       departure_time_scatter: bool,
+                       travel_time_scatter: bool,
+                       rng: Optional[np.random.Generator] = None,
+                       stats: Optional[GenerationStats] = None,
+                       noise: Optional[CounterNoise] = None) -> dict:
+    """Resolve locations, times and random scatter for all trips of a skeleton at once.
+
+    Combines `resolve_trip_base` and `apply_trip_scatter`, see there for the stages timed and for `noise`.
+
+    Returns:
+        Dict mapping each of `TRIP_COLUMNS` and `LOCATION_ID_COLUMNS` to an array with one entry per trip.
+    """
+    base = resolve_trip_base(skeleton=skeleton,
+                             calendar=calendar,
+                             schedule=schedule,
+                             location_index=location_index,
+                             stats=stats)
+    return apply_trip_scatter(base=base,
+                              location_scatter=location_scatter,
+                              departure_time_scatter=departure_time_scatter,
+                              travel_time_scatter=travel_time_scatter,
+                              rng=rng,
+                              stats=stats,
+                              noise=noise)
+
+
+def create_trip_columns(known_locations: List[dict],
+                        travel_time_dict: Union[dict, np.ndarray, str],
+                        location_scatter: bool,
+                        departure_time_scatter: bool,
+                        travel_time_scatter: bool,
+                        monthly_trip: bool,
+                        seasonal_trip: bool,
+                        additional_holidays=None,
+                        start_date: datetime = datetime(year=2018, month=1, day=1),
+                        end_date: datetime = datetime(year=2019, month=12, day=31),
+                        rng: Optional[np.random.Generator] = None,
+                        schedule: Optional[SchedulePlan] = None,
+                        speed_model: Optional[SpeedModel] = None,
+                        location_ids: bool = False,
+                        stats: Optional[GenerationStats] = None,
+                        noise: Optional[CounterNoise] = None,
+                        repair: bool = False,
+                        location_index: Optional[LocationIndex] = None) -> dict:
+    """Pandas-free core of `create_synthetic_data_vectorized`, see there for the arguments.
+
+    A location index compiled in advance, e.g. once per worker process, may be given as `location_index`, in which
+    case `known_locations`, `travel_time_dict` and `speed_model` are not used.
+
+    Returns:
+        Dict mapping each of `TRIP_COLUMNS`, followed by `LOCATION_ID_COLUMNS` if requested, to an array with one
+        entry per trip.
+    """
+    if schedule is None:
+        schedule = default_schedule()
+
+    with timed(stats, "location_index"):
+        required_pairs = schedule.required_location_pairs(monthly_trip=monthly_trip,
+                                                         seasonal_trip=seasonal_trip)
+        if location_index is None:
+            location_index = compile_location_index(known_locations=known_locations,
+                                                    travel_time_dict=travel_time_dict,
+                                                    required_pairs=required_pairs,
+                                                    speed_model=speed_model)
+        else:
+            location_index.require_pairs(required_pairs)
+
+    calendar_start = month_start(start_date) if noise is not None else start_date
+
+    with timed(stats, "calendar") as stage:
+        calendar = build_calendar(start_date=calendar_start,
+                                  end_date=end_date,
+                                  additional_holidays=additional_holidays)
+        stage.rows = len(calendar.days)
+
+    with timed(stats, "schedule") as stage:
+        skeleton = create_trip_skeleton(calendar=calendar,
+                                        schedule=schedule,
+                                        monthly_trip=monthly_trip,
+                                        seasonal_trip=seasonal_trip,
+                                        rng=rng,
+                                        noise=noise,
+                                        first_day=(start_date - calendar_start).days)
+        stage.rows = len(skeleton.template)
+
+    columns = apply_trip_details(skeleton=skeleton,
+                                 calendar=calendar,
+                                 schedule=schedule,
+                                 location_index=location_index,
+                                 location_scatter=location_scatter,
+                                 departure_time_scatter=departure_time_scatter,
+                                 travel_time_scatter=travel_time_scatter,
+                                 rng=rng,
+                                 stats=stats,
+                                 noise=noise)
+
+    if repair:
+        with timed(stats, "repair", rows=len(skeleton.template)):
+            columns = repair_trips(columns)
+
+    return {name: columns[name] for name in (TRIP_COLUMNS + LOCATION_ID_COLUMNS if location_ids else TRIP_COLUMNS)}
+
+
+def create_synthetic_data_vectorized(known_locations: List[dict],
+                                     travel_time_dict: Union[dict, np.ndarray, str],
+                                     location_scatter: bool,
+                                     departure_time_scatter: bool,
+                                     travel_time_scatter: bool,
+                                     monthly_trip: bool,
+                                     seasonal_trip: bool,
+                                     additional_holidays=None,
+                                     start_date: datetime = datetime(year=2018, month=1, day=1),
+                                     end_date: datetime = datetime(year=2019, month=12, day=31),
+                                     rng: Optional[np.random.Generator] = None,
+                                     schedule: Optional[SchedulePlan] = None,
+                                     speed_model: Optional[SpeedModel] = None,
+                                     location_ids: bool = False,
+                                     stats: Optional[GenerationStats] = None,
+                                     noise: Optional[CounterNoise] = None,
+                                     repair: bool = False) -> "pd.DataFrame":
+    """Vectorized counterpart of `create_synthetic_data`, evaluating the whole time range at once.
+
+    With counter-based `noise`, every draw only depends on its key, and the month of `start_date` is evaluated from
+    its first day on to resolve the monthly trip; any time range then yields exactly the trips of that range in a
+    run over a longer time range.
+
+    Args:
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        rng:                    Optional random generator, global NumPy random state if not given
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        stats:                  Optional collector of per-stage timings, emitted once the Dataframe is assembled
+        noise:                  Optional counter-based noise, used instead of `rng` if given
+        repair:                 Flag to indicate if overlapping trips and scattered start points of parked cars should
+                                be resolved, see `validation.repair_trips`
+
+    Returns:
+        Dataframe containing sequence of trips, one trip per row, with the same columns as `create_synthetic_data`,
+        followed by `LOCATION_ID_COLUMNS` if requested.
+    """
+    import pandas as pd
+
+    columns = create_trip_columns(known_locations=known_locations,
+                                  travel_time_dict=travel_time_dict,
+                                  location_scatter=location_scatter,
+                                  departure_time_scatter=departure_time_scatter,
+                                  travel_time_scatter=travel_time_scatter,
+                                  monthly_trip=monthly_trip,
+                                  seasonal_trip=seasonal_trip,
+                                  additional_holidays=additional_holidays,
+                                  start_date=start_date,
+                                  end_date=end_date,
+                                  rng=rng,
+                                  schedule=schedule,
+                                  speed_model=speed_model,
+                                  location_ids=location_ids,
+                                  stats=stats,
+                                  noise=noise,
+                                  repair=repair)
+
+    with timed(stats, "assembly", rows=len(columns["t_start"])):
+        df = pd.DataFrame(columns)
+
+    if stats is not None:
+        stats.emit()
+    return df
@@ -0,0 +1,215 @@
+"""Module providing incremental extension of trip data files from checkpointed generator state."""
+import json
+import os
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Union
+
+import numpy as np
+
+from calendar_engine import create_synthetic_data_vectorized, month_start, month_windows
+from fingerprint import file_key, fingerprint
+from holiday_calendar import HolidayCalendar
+from location_index import SpeedModel
+from schedule import SchedulePlan, default_schedule
+from writers import CsvTripWriter
+
+
+class Checkpoint(NamedTuple):
+    """State at the end of a run, from which the sequence of trips is continued."""
+    next_date: datetime         # first day not created yet, i.e. end date of last run
+    resume_date: datetime       # start of last window of last run, which is created again if cut off by `next_date`
+    rng_state: dict             # state of bit generator at `resume_date`
+    config_hash: str            # fingerprint of parameters of run, see `config_hash`
+    rows_written: int           # number of trips in output file
+    file_size: int              # size of output file in bytes
+    resume_rows: int            # number of trips before `resume_date`
+    resume_file_size: int       # size of output file in bytes up to the trips before `resume_date`
+
+
+def config_hash(known_locations: List[dict],
+                travel_time_dict: Union[dict, np.ndarray, str],
+                location_scatter: bool,
+                departure_time_scatter: bool,
+                travel_time_scatter: bool,
+                monthly_trip: bool,
+                seasonal_trip: bool,
+                additional_holidays=None,
+                start_date: Optional[datetime] = None,
+                seed: Optional[int] = None,
+                schedule: Optional[SchedulePlan] = None,
+                speed_model: Optional[SpeedModel] = None) -> str:
+    """Fingerprint of all parameters which determine the sequence of trips, except for its end date.
+
+    Travel time matrices given as path are identified by path, size and modification time.
+
+    Returns:
+        Hex digest of parameters.
+    """
+    if isinstance(travel_time_dict, (str, os.PathLike)):
+        travel_time_dict = file_key(travel_time_dict)
+    return fingerprint(known_locations=known_locations,
+                       travel_time_dict=travel_time_dict,
+                       location_scatter=location_scatter,
+                       departure_time_scatter=departure_time_scatter,
+                       travel_time_scatter=travel_time_scatter,
+                       monthly_trip=monthly_trip,
+                       seasonal_trip=seasonal_trip,
+                       additional_holidays=HolidayCalendar.coerce(additional_holidays),
+                       start_date=start_date,
+                       seed=seed,
+                       schedule=schedule if schedule is not None else default_schedule(),
+                       speed_model=speed_model)
+
+
+def load_checkpoint(path: str) -> Optional[Checkpoint]:
+    """Load checkpoint from JSON file, None if the file does not exist.
+
+    Raises:
+        ValueError: If the checkpoint lacks fields, e.g. as it was saved by an earlier version.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        spec = json.load(f)
+    if set(spec) != set(Checkpoint._fields):
+        raise ValueError(f"Checkpoint '{path}' was saved by another version and cannot be continued.")
+    spec["next_date"] = datetime.fromisoformat(spec["next_date"])
+    spec["resume_date"] = datetime.fromisoformat(spec["resume_date"])
+    return Checkpoint(**spec)
+
+
+def save_checkpoint(path: str,
+                    checkpoint: Checkpoint):
+    """Save checkpoint as JSON file, replacing an existing checkpoint atomically."""
+    spec = checkpoint._asdict()
+    spec["next_date"] = checkpoint.next_date.isoformat()
+    spec["resume_date"] = checkpoint.resume_date.isoformat()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(spec, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def extend_synthetic_data(path: str,
+                          checkpoint_path: str,
+                          known_locations: List[dict],
+                          travel_time_dict: Union[dict, np.ndarray, str],
+                          location_scatter: bool,
+                          departure_time_scatter: bool,
+                          travel_time_scatter: bool,
+                          monthly_trip: bool,
+                          seasonal_trip: bool,
+                          additional_holidays=None,
+                          start_date: datetime = datetime(year=2018, month=1, day=1),
+                          end_date: datetime = datetime(year=2019, month=12, day=31),
+                          seed: Optional[int] = None,
+                          schedule: Optional[SchedulePlan] = None,
+                          speed_model: Optional[SpeedModel] = None) -> Checkpoint:
+    """Create sequence of trips up to `end_date` as CSV file, continuing from the checkpoint of an earlier run.
+
+    Without checkpoint, the file is created from `start_date` on. Otherwise only the days from the end of the last
+    run up to `end_date` are created and appended. Trips are created month by month from `default_rng(seed)` as by
+    `iter_synthetic_data`, so the file is identical to the one of a single run over the whole time range, with or
+    without checkpoint. Since a month is evaluated at once, the checkpoint keeps the state at the start of the last
+    month of a run; a month cut off by the end date is truncated from the file and created again as a whole by the
+    next run. A file which was written further than its checkpoint, e.g. by an interrupted run, is truncated as well.
+
+    Args:
+        path:                   Path of CSV file
+        checkpoint_path:        Path of JSON file of checkpoint
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Day up to which the file is extended, excluded as in `create_synthetic_data`
+        seed:                   Seed of random generator, fresh entropy if None
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+
+    Returns:
+        Checkpoint at the end of the extended time range, as saved to `checkpoint_path`.
+
+    Raises:
+        ValueError: If the checkpoint was created with other parameters or by another version, or the file is
+            shorter than recorded.
+    """
+    config = config_hash(known_locations=known_locations,
+                         travel_time_dict=travel_time_dict,
+                         location_scatter=location_scatter,
+                         departure_time_scatter=departure_time_scatter,
+                         travel_time_scatter=travel_time_scatter,
+                         monthly_trip=monthly_trip,
+                         seasonal_trip=seasonal_trip,
+                         additional_holidays=additional_holidays,
+                         start_date=start_date,
+                         seed=seed,
+                         schedule=schedule,
+                         speed_model=speed_model)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    rng = np.random.default_rng(seed)
+    if checkpoint is None:
+        resume_date = start_date
+        rows_written = 0
+        file_size = 0
+    else:
+        if checkpoint.config_hash != config:
+            raise ValueError(f"Checkpoint '{checkpoint_path}' was created with other parameters.")
+        if end_date <= checkpoint.next_date:
+            return checkpoint
+        if (os.path.getsize(path) if os.path.exists(path) else 0) < checkpoint.file_size:
+            raise ValueError(f"File '{path}' is shorter than recorded in checkpoint '{checkpoint_path}'.")
+        # trips of the month cut off by the last run, or written after its checkpoint, are created again
+        os.truncate(path, checkpoint.resume_file_size)
+        resume_date = checkpoint.resume_date
+        rng.bit_generator.state = checkpoint.rng_state
+        rows_written = checkpoint.resume_rows
+        file_size = checkpoint.resume_file_size
+    rng_state = rng.bit_generator.state
+    resume_rows = rows_written
+    resume_file_size = file_size
+
+    # same windows and random stream as `iter_synthetic_data` of a single run from `start_date`
+    with CsvTripWriter(path, append=file_size > 0) as writer:
+        for window_start, window_end in month_windows(start_date=resume_date,
+                                                      end_date=end_date,
+                                                      chunk_months=1):
+            df = create_synthetic_data_vectorized(known_locations=known_locations,
+                                                  travel_time_dict=travel_time_dict,
+                                                  location_scatter=location_scatter,
+                                                  departure_time_scatter=departure_time_scatter,
+                                                  travel_time_scatter=travel_time_scatter,
+                                                  monthly_trip=monthly_trip,
+                                                  seasonal_trip=seasonal_trip,
+                                                  additional_holidays=additional_holidays,
+                                                  start_date=window_start,
+                                                  end_date=window_end,
+                                                  rng=rng,
+                                                  schedule=schedule,
+                                                  speed_model=speed_model)
+            writer.write(df)
+            rows_written += len(df)
+            file_size = os.path.getsize(path)
+            # the next run continues after the last month if it is complete, otherwise it creates the month again
+            if window_end < end_date or month_start(end_date) == end_date:
+                resume_date = window_end
+                rng_state = rng.bit_generator.state
+                resume_rows = rows_written
+                resume_file_size = file_size
+
+    checkpoint = Checkpoint(next_date=end_date,
+                            resume_date=resume_date,
+                            rng_state=rng_state,
+                            config_hash=config,
+                            rows_written=rows_written,
+                            file_size=file_size,
+                            resume_rows=resume_rows,
+                            resume_file_size=resume_file_size)
+    save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
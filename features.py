@@ -0,0 +1,251 @@
+"""Module providing extraction of parking-duration and dwell-time features from sequences of trips.
+
+A stop is the time in between the end of a trip and the start of the next trip of the same agent. Per stop, the
+parking duration, the location, time-of-day and weekday features of the arrival and statistics of the agent's
+earlier stops at the same location are computed in bulk for whole chunks of trips. State is carried from one chunk
+to the next, so streamed trip data yields the same features as the whole trip data at once.
+"""
+from typing import TYPE_CHECKING, Iterable, Iterator, Mapping, Optional, Union
+
+import numpy as np
+
+from location_index import LocationIndex, haversine_distance
+from utils import local_seconds
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# columns of stop features, in output order; features of population data are preceded by "agent_id"
+FEATURE_COLUMNS = ("trip_id",                   # row of arriving trip in trip data
+                   "stop_location_id",          # location ID of stop, -1 if unknown
+                   "t_arrival",                 # end time of arriving trip as UTC time code in Milliseconds
+                   "t_departure",               # start time of departing trip as UTC time code in Milliseconds
+                   "parking_duration",          # time in between arrival and departure in seconds
+                   "arrival_hour",              # local time of day of arrival in hours
+                   "arrival_weekday",           # weekday of arrival, 0 is Monday
+                   "time_of_day_sin",           # cyclic encoding of local time of day of arrival
+                   "time_of_day_cos",
+                   "location_visits",           # number of earlier stops of agent at location
+                   "location_mean_duration",    # mean parking duration of up to `window` last stops at location
+                   "days_since_last_visit")     # days since departure from last stop at location
+
+# number of rows of distance matrix evaluated at once when snapping points to locations
+SNAP_BLOCK_SIZE = 1 << 22
+
+# 1970-01-01 was a Thursday
+_EPOCH_WEEKDAY = 3
+
+
+def snap_locations(lat: np.ndarray,
+                   lon: np.ndarray,
+                   location_index: LocationIndex,
+                   max_distance: float = 500.0) -> np.ndarray:
+    """IDs of nearest known locations of GPS points.
+
+    Args:
+        lat:            Latitudes of points
+        lon:            Longitudes of points
+        location_index: Compiled catalog of known locations
+        max_distance:   Maximum distance in meters in between point and location
+
+    Returns:
+        Array of location IDs, -1 for points farther than `max_distance` from any location.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    ids = np.full(len(lat), -1, dtype=np.int64)
+    if len(location_index) == 0:
+        return ids
+
+    block = max(SNAP_BLOCK_SIZE // len(location_index), 1)
+    for i in range(0, len(lat), block):
+        distance = haversine_distance(lat_1=lat[i:i + block, None],
+                                      lon_1=lon[i:i + block, None],
+                                      lat_2=location_index.lat[None, :],
+                                      lon_2=location_index.lon[None, :])
+        nearest = np.argmin(distance, axis=1)
+        within = distance[np.arange(len(nearest)), nearest] <= max_distance
+        ids[i:i + block] = np.where(within, nearest, -1)
+    return ids
+
+
+class DwellFeatureExtractor:
+    """Stateful extractor of stop features from consecutive chunks of trips.
+
+    Chunks have to be ordered by agent and time, as created by `iter_synthetic_data` or `iter_population_data`.
+    Stop locations are taken from column "end_location_id" if present, e.g. with `location_ids` set when creating
+    the trips, otherwise GPS end points are snapped to the nearest known location. Locations of agents of population
+    data are shifted individually, hence their trips should be created with `location_ids`.
+
+    Args:
+        location_index:     Compiled catalog of known locations, required if trips lack location IDs
+        window:             Number of last stops at a location to average the parking duration over
+        max_distance:       Maximum distance in meters in between GPS end point and snapped location
+    """
+
+    def __init__(self, location_index: Optional[LocationIndex] = None,
+                 window: int = 10,
+                 max_distance: float = 500.0):
+        self.location_index = location_index
+        self.window = window
+        self.max_distance = max_distance
+        self._n_trips = 0
+        # last trip of previous chunk, whose stop ends with the first trip of the next chunk
+        self._last_trip = None
+        # up to `window` last stops per location of the last agent, with their visit number at the location
+        self._history = None
+
+    def _stop_locations(self, trips: dict) -> np.ndarray:
+        if "end_location_id" in trips:
+            return trips["end_location_id"].astype(np.int64)
+        if self.location_index is None:
+            raise ValueError("Trips without location IDs require a location index to snap end points to.")
+        return snap_locations(lat=trips["gps_end_lat"],
+                              lon=trips["gps_end_lon"],
+                              location_index=self.location_index,
+                              max_distance=self.max_distance)
+
+    def transform(self, trips: Union["pd.DataFrame", Mapping[str, np.ndarray]]) -> dict:
+        """Features of all stops completed by the next chunk of trips.
+
+        Args:
+            trips:  Dataframe of trips or dict mapping column names to arrays, with the columns of
+                    `create_synthetic_data` and optionally "agent_id" and `LOCATION_ID_COLUMNS`
+
+        Returns:
+            Dict mapping each of `FEATURE_COLUMNS`, preceded by "agent_id" if given, to an array with one entry per
+            stop, ordered as the arriving trips.
+        """
+        n = len(trips["t_start"])
+        has_agent = "agent_id" in trips
+        chunk = {"agent_id": np.asarray(trips["agent_id"], dtype=np.int64) if has_agent else np.zeros(n, np.int64),
+                 "trip_id": self._n_trips + np.arange(n, dtype=np.int64),
+                 "t_start": np.asarray(trips["t_start"], dtype=np.float64),
+                 "t_end": np.asarray(trips["t_end"], dtype=np.float64),
+                 "location_id": self._stop_locations({name: np.asarray(trips[name]) for name in trips})}
+        self._n_trips += n
+        if self._last_trip is not None:
+            chunk = {name: np.concatenate([self._last_trip[name], values]) for name, values in chunk.items()}
+        if len(chunk["t_start"]):
+            self._last_trip = {name: values[-1:] for name, values in chunk.items()}
+
+        # stops in between consecutive trips of the same agent
+        arrival = np.flatnonzero(chunk["agent_id"][:-1] == chunk["agent_id"][1:])
+        stops = {"agent_id": chunk["agent_id"][arrival],
+                 "trip_id": chunk["trip_id"][arrival],
+                 "stop_location_id": chunk["location_id"][arrival],
+                 "t_arrival": chunk["t_end"][arrival],
+                 "t_departure": chunk["t_start"][arrival + 1]}
+        stops["parking_duration"] = (stops["t_departure"] - stops["t_arrival"]) / 1000
+
+        naive_seconds = local_seconds(stops["t_arrival"] / 1000)
+        seconds_of_day = naive_seconds % 86400
+        stops["arrival_hour"] = seconds_of_day / 3600
+        stops["arrival_weekday"] = (naive_seconds // 86400 + _EPOCH_WEEKDAY).astype(np.int64) % 7
+        stops["time_of_day_sin"] = np.sin(2 * np.pi * seconds_of_day / 86400)
+        stops["time_of_day_cos"] = np.cos(2 * np.pi * seconds_of_day / 86400)
+
+        stops.update(self._location_statistics(stops))
+
+        names = (("agent_id",) if has_agent else ()) + FEATURE_COLUMNS
+        return {name: stops[name] for name in names}
+
+    def _location_statistics(self, stops: dict) -> dict:
+        """Statistics of earlier stops at the same location per stop, updating the history of stops."""
+        keys = ("agent_id", "stop_location_id", "t_arrival", "t_departure", "parking_duration")
+        history = self._history
+        if history is None:
+            history = {name: stops[name][:0] for name in keys}
+            history["visit"] = np.zeros(0, dtype=np.int64)
+        n_history = len(history["visit"])
+        rows = {name: np.concatenate([history[name], stops[name]]) for name in keys}
+
+        # group stops by agent and location, stable in time
+        order = np.lexsort((rows["stop_location_id"], rows["agent_id"]))
+        rows = {name: values[order] for name, values in rows.items()}
+        m = len(order)
+        position = np.arange(m)
+        new_group = np.zeros(m, dtype=bool)
+        new_group[:1] = True
+        for name in ("agent_id", "stop_location_id"):
+            new_group[1:] |= rows[name][1:] != rows[name][:-1]
+        group = np.cumsum(new_group) - 1
+        group_start = np.flatnonzero(new_group)
+
+        # visit number continues from the first stop of a group taken from history
+        is_history = order < n_history
+        first_visit = np.zeros(len(group_start), dtype=np.int64)
+        from_history = is_history[group_start]
+        first_visit[from_history] = history["visit"][order[group_start[from_history]]]
+        visit = first_visit[group] + position - group_start[group]
+
+        # mean over up to `window` preceding stops of group, summed lag by lag so results do not depend on chunking
+        count = np.minimum(position - group_start[group], self.window)
+        total = np.zeros(m)
+        for lag in range(1, min(self.window, m) + 1):
+            lagged = count >= lag
+            total[lagged] += rows["parking_duration"][position[lagged] - lag]
+        mean_duration = np.divide(total, count, out=np.full(m, np.nan), where=count > 0)
+
+        days_since = np.full(m, np.nan)
+        repeated = ~new_group
+        days_since[repeated] = (rows["t_arrival"][repeated] - rows["t_departure"][position[repeated] - 1]) / 86400e3
+
+        # keep up to `window` last stops, at least the last one, per location of last agent as history of next chunk
+        if m:
+            group_size = np.diff(np.append(group_start, m))
+            keep = rows["agent_id"] == self._last_trip["agent_id"][0]
+            keep &= position >= group_start[group] + group_size[group] - max(self.window, 1)
+            self._history = {name: values[keep] for name, values in rows.items()}
+            self._history["visit"] = visit[keep]
+
+        # restore order of stops, without history
+        inverse = np.empty(m, dtype=np.int64)
+        inverse[order] = position
+        current = inverse[n_history:]
+        return {"location_visits": visit[current],
+                "location_mean_duration": mean_duration[current],
+                "days_since_last_visit": days_since[current]}
+
+
+def iter_dwell_features(trip_chunks: Iterable[Union["pd.DataFrame", Mapping[str, np.ndarray]]],
+                        location_index: Optional[LocationIndex] = None,
+                        window: int = 10,
+                        max_distance: float = 500.0) -> Iterator[dict]:
+    """Extract stop features from chunks of trips in a single pass, see `DwellFeatureExtractor`.
+
+    Args:
+        trip_chunks:    Iterable of Dataframes or dicts of columns ordered by agent and time, e.g. from
+                        `iter_synthetic_data` or `iter_population_data`
+        location_index: Compiled catalog of known locations, required if trips lack location IDs
+        window:         Number of last stops at a location to average the parking duration over
+        max_distance:   Maximum distance in meters in between GPS end point and snapped location
+
+    Yields:
+        Dicts mapping each of `FEATURE_COLUMNS`, preceded by "agent_id" if given, to an array with one entry per
+        stop completed by the chunk.
+    """
+    extractor = DwellFeatureExtractor(location_index=location_index,
+                                      window=window,
+                                      max_distance=max_distance)
+    for trips in trip_chunks:
+        yield extractor.transform(trips)
+
+
+def extract_dwell_features(trips: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                           location_index: Optional[LocationIndex] = None,
+                           window: int = 10,
+                           max_distance: float = 500.0) -> "pd.DataFrame":
+    """Extract stop features from a sequence of trips, e.g. from `create_synthetic_data`.
+
+    See `iter_dwell_features` for the arguments.
+
+    Returns:
+        Dataframe containing features of stops, one stop per row, with `FEATURE_COLUMNS` as columns, preceded by
+        "agent_id" if given.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(DwellFeatureExtractor(location_index=location_index,
+                                              window=window,
+                                              max_distance=max_distance).transform(trips))
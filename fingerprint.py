@@ -0,0 +1,50 @@
+"""Module providing stable fingerprints of the parameters of a creation of synthetic data."""
+import hashlib
+import json
+import os
+from datetime import date
+from typing import Union
+
+import numpy as np
+
+
+def file_key(path: Union[str, os.PathLike]) -> dict:
+    """Identity of a file by absolute path, size and modification time, without reading its content."""
+    stat = os.stat(path)
+    return {"file": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _normalize(value):
+    """Convert value into JSON-serializable form with equal output for equal content."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return {"ndarray": [str(value.dtype), list(value.shape), digest]}
+    if isinstance(value, os.PathLike):
+        return file_key(value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if hasattr(value, "key"):
+        # e.g. holiday calendars, schedule plans and counter-based noise
+        return {type(value).__name__: _normalize(value.key())}
+    raise TypeError(f"Cannot fingerprint value of type {type(value).__name__}.")
+
+
+def fingerprint(**parameters) -> str:
+    """Hash of parameters, equal for equal parameters across processes and sessions.
+
+    Args:
+        parameters: Parameters as keyword arguments; files given as `os.PathLike` are identified by `file_key`
+
+    Returns:
+        Hex digest of SHA-256 hash.
+    """
+    payload = json.dumps(_normalize(parameters), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
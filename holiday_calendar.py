@@ -0,0 +1,125 @@
+"""Module providing calendar of holidays with constant-time lookups and vectorized masks."""
+import json
+from datetime import date, datetime
+from typing import Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+# types accepted as day of a holiday
+DayLike = Union[date, datetime, np.datetime64, str]
+
+
+_EPOCH_ORDINAL = date(year=1970, month=1, day=1).toordinal()
+
+
+def _day_number(day: DayLike) -> int:
+    """Normalize date, datetime, datetime64 or ISO string to days since 1970-01-01."""
+    if isinstance(day, datetime):
+        day = day.date()
+    if isinstance(day, date):
+        return day.toordinal() - _EPOCH_ORDINAL
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+class HolidayCalendar:
+    """Set of holidays given as single days, ranges of days and annually recurring days.
+
+    All inputs are normalized to calendar days, hence dates and datetimes match regardless of their time of day.
+
+    Args:
+        days:       Single holidays
+        ranges:     Tuples of first and last day of holiday periods, both inclusive
+        recurring:  Annually recurring holidays as tuples of month and day
+    """
+
+    def __init__(self, days: Iterable[DayLike] = (),
+                 ranges: Iterable[Tuple[DayLike, DayLike]] = (),
+                 recurring: Iterable[Tuple[int, int]] = ()):
+        self._days = set()
+        self._recurring = set()
+        for day in days:
+            self.add_day(day)
+        for first, last in ranges:
+            self.add_range(first, last)
+        for month, day in recurring:
+            self.add_recurring(month, day)
+
+    def add_day(self, day: DayLike):
+        """Add single holiday."""
+        self._days.add(_day_number(day))
+
+    def add_range(self, first: DayLike,
+                  last: DayLike):
+        """Add all days from first to last day, both inclusive."""
+        self._days.update(range(_day_number(first), _day_number(last) + 1))
+
+    def add_recurring(self, month: int,
+                      day: int):
+        """Add holiday recurring every year on given month and day."""
+        self._recurring.add((int(month), int(day)))
+
+    def __contains__(self, day: DayLike) -> bool:
+        number = _day_number(day)
+        if number in self._days:
+            return True
+        if self._recurring:
+            day = date.fromordinal(number + _EPOCH_ORDINAL)
+            return (day.month, day.day) in self._recurring
+        return False
+
+    def __len__(self) -> int:
+        return len(self._days) + len(self._recurring)
+
+    def key(self) -> Tuple[Tuple[int, ...], Tuple[Tuple[int, int], ...]]:
+        """Normalized content of calendar, equal for calendars of the same holidays."""
+        return tuple(sorted(self._days)), tuple(sorted(self._recurring))
+
+    def mask(self, days: np.ndarray) -> np.ndarray:
+        """Vectorized holiday lookup.
+
+        Args:
+            days:   Array of datetime64[D]
+
+        Returns:
+            Boolean array, True for holidays.
+        """
+        days = np.asarray(days, dtype="datetime64[D]")
+        result = np.isin(days.astype(np.int64), np.fromiter(self._days, dtype=np.int64, count=len(self._days)))
+        if self._recurring:
+            month = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+            day = (days - days.astype("datetime64[M]")).astype(np.int64) + 1
+            keys = np.array([32 * m + d for m, d in self._recurring], dtype=np.int64)
+            result |= np.isin(32 * month + day, keys)
+        return result
+
+    def bitmap(self, start_date: DayLike,
+               n_days: int) -> np.ndarray:
+        """Per-day holiday flags of a time range, to be indexed by number of days since `start_date`."""
+        first_day = np.datetime64(start_date.date() if isinstance(start_date, datetime) else start_date, "D")
+        return self.mask(first_day + np.arange(n_days))
+
+    @classmethod
+    def coerce(cls, holidays: Optional[Union["HolidayCalendar", Iterable[DayLike]]]) -> "HolidayCalendar":
+        """Holiday calendar from a calendar, an iterable of single holidays or None."""
+        if isinstance(holidays, cls):
+            return holidays
+        return cls(days=holidays or ())
+
+    @classmethod
+    def from_file(cls, path: str) -> "HolidayCalendar":
+        """Load holiday calendar from JSON file.
+
+        The file may contain lists of single "days" ("YYYY-MM-DD"), "ranges" (["YYYY-MM-DD", "YYYY-MM-DD"]) and
+        "recurring" days ("MM-DD"), e.g. regional public holidays.
+
+        Args:
+            path:   Path of JSON file
+
+        Returns:
+            Holiday calendar.
+        """
+        with open(path, "r") as f:
+            spec = json.load(f)
+        return cls(days=spec.get("days", ()),
+                   ranges=spec.get("ranges", ()),
+                   recurring=[tuple(int(p) for p in r.split("-")) for r in spec.get("recurring", ())])
@@ -0,0 +1,300 @@
+"""Module providing compiled catalog of locations and travel times with integer location IDs."""
+import os
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+# largest number of locations for which travel times are stored as dense matrix
+DENSE_LIMIT = 4096
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371e3
+
+
+def haversine_distance(lat_1: np.ndarray,
+                       lon_1: np.ndarray,
+                       lat_2: np.ndarray,
+                       lon_2: np.ndarray) -> np.ndarray:
+    """Great-circle distances in meters in between pairs of GPS positions given in degrees."""
+    lat_1, lon_1, lat_2, lon_2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat_1, lon_1, lat_2, lon_2))
+    a = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpeedModel(NamedTuple):
+    """Piecewise constant speed model estimating travel times from great-circle distances."""
+    distance_limits: Tuple[float, ...] = (5e3, 5e4)    # upper limits of route length of all but the last band in meters
+    speeds: Tuple[float, ...] = (6.0, 14.0, 25.0)      # mean speed per band in meters per second
+    detour_factor: float = 1.3                          # ratio of route length to great-circle distance
+    overhead: float = 120.0                             # fixed seconds per trip, e.g. for parking
+
+    def travel_times(self, distances: np.ndarray) -> np.ndarray:
+        """Travel times in seconds of given great-circle distances in meters."""
+        route = np.asarray(distances, dtype=np.float64) * self.detour_factor
+        speed = np.asarray(self.speeds, dtype=np.float64)[np.searchsorted(self.distance_limits, route, side="right")]
+        return self.overhead + route / speed
+
+
+class SparseTravelTimes:
+    """Travel times of a large catalog stored as sorted (start, end) keys and values.
+
+    Args:
+        n_locations:    Number of locations in catalog
+        start_ids:      IDs of start locations
+        end_ids:        IDs of end locations
+        values:         Travel times in seconds
+    """
+
+    def __init__(self, n_locations: int,
+                 start_ids: np.ndarray,
+                 end_ids: np.ndarray,
+                 values: np.ndarray):
+        keys = start_ids.astype(np.int64) * n_locations + end_ids
+        order = np.argsort(keys, kind="stable")
+        self._n = n_locations
+        self._keys = keys[order]
+        self._values = values[order]
+
+    def lookup(self, start_ids: np.ndarray,
+               end_ids: np.ndarray) -> np.ndarray:
+        """Travel times of pairs of valid location IDs, NaN for missing pairs."""
+        keys = np.asarray(start_ids, dtype=np.int64) * self._n + end_ids
+        if len(self._keys) == 0:
+            return np.full(keys.shape, np.nan)
+        i = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        return np.where(self._keys[i] == keys, self._values[i], np.nan)
+
+
+class DenseTravelTimes:
+    """Travel times stored as dense matrix with NaN for missing pairs.
+
+    Args:
+        matrix:     Square matrix of travel times in seconds, indexed by start and end location ID
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def lookup(self, start_ids: np.ndarray,
+               end_ids: np.ndarray) -> np.ndarray:
+        """Travel times of pairs of valid location IDs, NaN for missing pairs."""
+        return self.matrix[start_ids, end_ids]
+
+
+class LocationIndex:
+    """Catalog of locations mapping names to integer IDs, with contiguous coordinate arrays and travel times.
+
+    Args:
+        names:          Names of locations, position in list is location ID
+        lat:            Latitudes of locations
+        lon:            Longitudes of locations
+        travel_times:   Travel times in between locations, dense or sparse
+        speed_model:    Optional speed model estimating travel times of pairs missing in `travel_times`
+        ids:            Optional mapping of names to IDs, derived from `names` if not given
+    """
+
+    def __init__(self, names: List[str],
+                 lat: np.ndarray,
+                 lon: np.ndarray,
+                 travel_times,
+                 speed_model: Optional[SpeedModel] = None,
+                 ids: Optional[dict] = None):
+        self.names = names
+        self.ids = ids if ids is not None else _name_ids(names)
+        self.lat = lat
+        self.lon = lon
+        self.travel_times = travel_times
+        self.speed_model = speed_model
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def location_id(self, name: str) -> int:
+        """ID of location with given name, raises KeyError for unknown locations."""
+        return self.ids[name]
+
+    def location_ids(self, names: Iterable[str]) -> np.ndarray:
+        """IDs of locations with given names, -1 for unknown locations."""
+        return np.array([self.ids.get(name, -1) for name in names], dtype=np.int64)
+
+    def travel_time(self, start_ids: np.ndarray,
+                    end_ids: np.ndarray) -> np.ndarray:
+        """Travel times in seconds in between pairs of locations, NaN for unknown locations.
+
+        Missing pairs are estimated by the speed model in bulk if given, NaN otherwise.
+        """
+        start_ids = np.asarray(start_ids, dtype=np.int64)
+        end_ids = np.asarray(end_ids, dtype=np.int64)
+        valid = (start_ids >= 0) & (end_ids >= 0)
+        result = np.full(start_ids.shape, np.nan)
+        result[valid] = self.travel_times.lookup(start_ids[valid], end_ids[valid])
+        if self.speed_model is not None:
+            missing = valid & np.isnan(result)
+            if missing.any():
+                start, end = start_ids[missing], end_ids[missing]
+                distances = haversine_distance(self.lat[start], self.lon[start], self.lat[end], self.lon[end])
+                result[missing] = self.speed_model.travel_times(distances)
+        return result
+
+    def missing_pairs(self, pairs: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Pairs of location names for which a location or the travel time in between is missing."""
+        pairs = list(dict.fromkeys(pairs))
+        travel_times = self.travel_time(self.location_ids(p[0] for p in pairs),
+                                        self.location_ids(p[1] for p in pairs))
+        return [pair for pair, tt in zip(pairs, travel_times) if np.isnan(tt)]
+
+    def require_pairs(self, pairs: Iterable[Tuple[str, str]]):
+        """Check that all pairs of location names are resolvable.
+
+        Raises:
+            ValueError: If a location or travel time of any of the pairs is missing.
+        """
+        missing = self.missing_pairs(pairs)
+        if missing:
+            raise ValueError("Missing location or travel time for trips: "
+                             + ", ".join(f"{start} -> {end}" for start, end in missing))
+
+    def with_coordinates(self, lat: np.ndarray,
+                         lon: np.ndarray) -> "LocationIndex":
+        """Copy of catalog with other coordinates of the same locations, travel times are shared."""
+        return LocationIndex(names=self.names,
+                             lat=lat,
+                             lon=lon,
+                             travel_times=self.travel_times,
+                             speed_model=self.speed_model,
+                             ids=self.ids)
+
+
+def load_travel_time_matrix(path: Union[str, os.PathLike]) -> np.ndarray:
+    """Load square travel time matrix from `.npy` file, memory-mapped so only looked up pages are read.
+
+    Args:
+        path:   Path of `.npy` file, e.g. as written by `save_travel_time_matrix`
+
+    Returns:
+        Read-only memory-mapped matrix of travel times in seconds, indexed by start and end location ID.
+    """
+    return np.load(path, mmap_mode="r")
+
+
+def save_travel_time_matrix(known_locations: List[dict],
+                            travel_time_dict: dict,
+                            path: Union[str, os.PathLike],
+                            dtype=np.float32):
+    """Convert travel time matrix (as JSON) into a `.npy` file indexed by position of locations in `known_locations`.
+
+    Args:
+        known_locations:    List of JSON representing locations
+        travel_time_dict:   Matrix (as JSON) for travel times in between locations
+        path:               Path of `.npy` file to write
+        dtype:              Type of stored travel times, missing pairs are stored as NaN
+    """
+    names, ids = _location_ids(known_locations)
+    start_ids, end_ids, values = _travel_time_entries(ids=ids,
+                                                      travel_time_dict=travel_time_dict)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(names), len(names)))
+    matrix[:] = np.nan
+    matrix[start_ids, end_ids] = values
+    matrix.flush()
+
+
+def _location_ids(known_locations: List[dict]) -> Tuple[List[str], dict]:
+    """Names of locations and mapping of names to IDs, first entry wins for duplicate names."""
+    names = [e["name"] for e in known_locations]
+    return names, _name_ids(names)
+
+
+def _name_ids(names: List[str]) -> dict:
+    """Mapping of names to their positions in list, first entry wins for duplicate names."""
+    ids = {}
+    for i, name in enumerate(names):
+        ids.setdefault(name, i)
+    return ids
+
+
+def _travel_time_entries(ids: dict,
+                         travel_time_dict: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Start IDs, end IDs and travel times of all entries of travel time matrix (as JSON) in between known locations."""
+    start_ids, end_ids, values = [], [], []
+    for start_location, row in travel_time_dict.items():
+        if start_location not in ids:
+            continue
+        for end_location, seconds in row.items():
+            if end_location in ids:
+                start_ids.append(ids[start_location])
+                end_ids.append(ids[end_location])
+                values.append(seconds)
+    return (np.array(start_ids, dtype=np.int64),
+            np.array(end_ids, dtype=np.int64),
+            np.array(values, dtype=np.float64))
+
+
+def compile_location_index(known_locations: List[dict],
+                           travel_time_dict: Union[dict, np.ndarray, str, os.PathLike],
+                           required_pairs: Optional[Iterable[Tuple[str, str]]] = None,
+                           dense_limit: int = DENSE_LIMIT,
+                           speed_model: Optional[SpeedModel] = None) -> LocationIndex:
+    """Compile known locations and travel time matrix into a location index.
+
+    Args:
+        known_locations:    List of JSON representing locations
+        travel_time_dict:   Matrix (as JSON) for travel times in between locations, or square matrix indexed by
+                            position of locations in `known_locations` with NaN for missing pairs, given as array
+                            or as path of `.npy` file which is memory-mapped
+        required_pairs:     Optional pairs of location names which have to be resolvable
+        dense_limit:        Largest number of locations for which travel times are stored as dense matrix
+        speed_model:        Optional speed model estimating travel times of missing pairs from the distance in between
+
+    Returns:
+        Compiled location index.
+
+    Raises:
+        ValueError: If a location or travel time of any of the required pairs is missing, or if the shape of the
+                    travel time matrix does not match the locations.
+    """
+    names, ids = _location_ids(known_locations)
+    lat = np.array([e["gps_lat"] for e in known_locations], dtype=np.float64)
+    lon = np.array([e["gps_lon"] for e in known_locations], dtype=np.float64)
+
+    if isinstance(travel_time_dict, (str, os.PathLike)):
+        travel_time_dict = load_travel_time_matrix(travel_time_dict)
+
+    if isinstance(travel_time_dict, np.ndarray):
+        if travel_time_dict.shape != (len(names), len(names)):
+            raise ValueError(f"Shape {travel_time_dict.shape} of travel time matrix does not match "
+                             f"{len(names)} known locations.")
+        travel_times = DenseTravelTimes(travel_time_dict)
+    else:
+        travel_times = _compile_travel_times(ids=ids,
+                                             n_locations=len(names),
+                                             travel_time_dict=travel_time_dict,
+                                             dense_limit=dense_limit)
+
+    location_index = LocationIndex(names=names,
+                                   lat=lat,
+                                   lon=lon,
+                                   travel_times=travel_times,
+                                   speed_model=speed_model,
+                                   ids=ids)
+
+    if required_pairs is not None:
+        location_index.require_pairs(required_pairs)
+
+    return location_index
+
+
+def _compile_travel_times(ids: dict,
+                          n_locations: int,
+                          travel_time_dict: dict,
+                          dense_limit: int):
+    """Compile travel time matrix (as JSON) into dense or sparse travel times."""
+    start_ids, end_ids, values = _travel_time_entries(ids=ids,
+                                                      travel_time_dict=travel_time_dict)
+    if n_locations <= dense_limit:
+        matrix = np.full((n_locations, n_locations), np.nan)
+        matrix[start_ids, end_ids] = values
+        return DenseTravelTimes(matrix)
+    return SparseTravelTimes(n_locations=n_locations,
+                             start_ids=start_ids,
+                             end_ids=end_ids,
+                             values=values)
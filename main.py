@@ -1,70 +1,283 @@
-"""Main script to run creation of synthetic trip data."""
+"""Command line entry point to run creation of synthetic trip data.
+
+Parameters are given as arguments or as JSON config file whose keys are the argument names, e.g.
+
+    python main.py --end-date 2018-03-01 --seed 42 --format parquet --output trips.parquet
+    python main.py --config scenario.json --agents 1000 --workers 8
+
+Modules of the generator, and pandas in particular, are only imported once arguments are parsed; with
+`--engine numpy` and NPZ output, trips are created and written without pandas.
+"""
+import argparse
 import json
-from datetime import datetime, date
-from trip_creation import create_synthetic_data
+import sys
+from datetime import datetime
+from typing import List, Optional
+
 # --------------------------------------------------------------------------- #
-# ADJUSTABLE PARAMETERS FOR CREATION OF SYNTHETIC DATA
+# DEFAULT PARAMETERS FOR CREATION OF SYNTHETIC DATA
 # --------------------------------------------------------------------------- #
 # JSON file containing list of known locations and their GPS locations
-with open("data/known_locations.json", "r") as f:
-    KNOWN_LOCATIONS = json.load(f)['data']
+KNOWN_LOCATIONS_PATH = "data/known_locations.json"
+
+# JSON file containing travel time matrix in between known locations; for large catalogs, a square matrix
+# converted by `location_index.save_travel_time_matrix` may be given as path of a `.npy` file instead
+TRAVEL_TIME_PATH = "data/travel_times.json"
 
-# JSON file containing travel time matrix in between known locations
-with open("data/travel_times.json", "r") as f:
-    TRAVEL_TIME = json.load(f)
+# JSON file containing calendar of additional holidays, e.g. from user calendar or regional public holidays
+HOLIDAYS_PATH = "data/holidays.json"
 
 # time range of data to create
-START_DATE = datetime(year=2018, month=1, day=1)
-END_DATE = datetime(year=2019, month=12, day=31)
-
-# put scatter on GPS points
-LOCATION_SCATTER = True
-
-# put scatter on start time of trips
-DEPARTURE_TIME_SCATTER = True
-
-# put scatter on travel time of trips
-TRAVEL_TIME_SCATTER = True
-
-# go to back office once a month
-MONTHLY_TRIP = True
-
-# go to public swimming pool twice a week during summer
-SEASONAL_TRIP = True
-
-# list of additional holidays, e.g. from user calendar
-ADDITIONAL_HOLIDAYS = [date(year=2018, month=1, day=d) for d in range(1, 7, 1)] + \
-                      [date(year=2018, month=2, day=d) for d in range(12, 17, 1)] + \
-                      [date(year=2018, month=3, day=d) for d in range(26, 32, 1)] + \
-                      [date(year=2018, month=4, day=d) for d in range(1, 7, 1)] + \
-                      [date(year=2018, month=5, day=d) for d in range(22, 32, 1)] + \
-                      [date(year=2018, month=6, day=d) for d in range(1, 3, 1)] + \
-                      [date(year=2018, month=7, day=d) for d in range(26, 32, 1)] + \
-                      [date(year=2018, month=8, day=d) for d in range(1, 32, 1)] + \
-                      [date(year=2018, month=9, day=d) for d in range(1, 9, 1)] + \
-                      [date(year=2018, month=10, day=d) for d in range(29, 32, 1)] + \
-                      [date(year=2018, month=11, day=d) for d in range(1, 3, 1)] + \
-                      [date(year=2018, month=12, day=d) for d in range(24, 32, 1)] + \
-                      [date(year=2019, month=1, day=d) for d in range(1, 6, 1)] + \
-                      [date(year=2019, month=4, day=d) for d in range(15, 28, 1)] + \
-                      [date(year=2019, month=6, day=d) for d in range(11, 22, 1)] + \
-                      [date(year=2019, month=7, day=d) for d in range(29, 32, 1)] + \
-                      [date(year=2019, month=8, day=d) for d in range(1, 32, 1)] + \
-                      [date(year=2019, month=9, day=d) for d in range(1, 11, 1)] + \
-                      [date(year=2019, month=10, day=d) for d in range(28, 32, 1)] + \
-                      [date(year=2019, month=12, day=d) for d in range(23, 32, 1)]
+START_DATE = "2018-01-01"
+END_DATE = "2019-12-31"
+
+# output files of a single agent and of a population, extension follows output format
+TRIP_DATA_PATH = "data/synthetic_trip_data"
+POPULATION_DATA_PATH = "data/synthetic_population_data"
+
+# flags of creation, all enabled by default
+FLAGS = {"location_scatter": "put scatter on GPS points",
+         "departure_time_scatter": "put scatter on start time of trips",
+         "travel_time_scatter": "put scatter on travel time of trips",
+         "monthly_trip": "go to back office once a month",
+         "seasonal_trip": "go to public swimming pool twice a week during summer"}
+
+
+def _date(value: str) -> datetime:
+    """Parse ISO date argument."""
+    return datetime.fromisoformat(value)
+
+
+def _positive_int(value: str) -> int:
+    """Parse integer argument which has to be at least one."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"has to be a positive integer, got {value}")
+    return number
+
+
+def _non_negative_int(value: str) -> int:
+    """Parse integer argument which must not be negative."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"has to be a non-negative integer, got {value}")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Argument parser of command line interface."""
+    parser = argparse.ArgumentParser(description="Create synthetic mobility data as sequence of trips.")
+    parser.add_argument("--config", help="JSON file with values of arguments, keyed by argument name")
+    parser.add_argument("--locations", default=KNOWN_LOCATIONS_PATH, help="JSON file of known locations")
+    parser.add_argument("--travel-times", default=TRAVEL_TIME_PATH,
+                        help="JSON file of travel time matrix, or .npy file of square matrix which is memory-mapped")
+    parser.add_argument("--holidays", default=HOLIDAYS_PATH, help="JSON file of additional holidays, empty for none")
+    parser.add_argument("--schedule", help="JSON file of weekly schedule, default schedule if not given")
+    parser.add_argument("--speed-model", action="store_true",
+                        help="estimate missing travel times from distance instead of failing")
+    parser.add_argument("--start-date", type=_date, default=START_DATE, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end-date", type=_date, default=END_DATE, help="day after last day, YYYY-MM-DD")
+    for name, description in FLAGS.items():
+        option = name.replace("_", "-")
+        parser.add_argument(f"--{option}", dest=name, action="store_true", default=True,
+                            help=f"{description} (default), disabled by --no-{option}")
+        parser.add_argument(f"--no-{option}", dest=name, action="store_false", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=_non_negative_int,
+                        help="seed from which random streams are derived, fresh entropy if not given")
+    parser.add_argument("--agents", type=_positive_int, default=1,
+                        help="number of synthetic persons, more than one are created in parallel on a process pool")
+    parser.add_argument("--workers", type=_positive_int,
+                        help="number of worker processes for agents, number of CPUs if not given")
+    parser.add_argument("--chunk-size", type=_positive_int, default=64, help="number of agents per worker task")
+    parser.add_argument("--engine", choices=("streaming", "numpy", "sharded"), default="streaming",
+                        help="numpy creates and writes trips of a single agent without pandas, NPZ output only; "
+                             "sharded creates shards of time of a single agent in parallel from counter-based noise")
+    parser.add_argument("--shard-months", type=_positive_int, default=12,
+                        help="number of months per shard of sharded engine")
+    parser.add_argument("--format", choices=("csv", "parquet", "arrow", "npz"), default="csv", help="output format")
+    parser.add_argument("--output", help="output path, '-' for CSV to stdout; by default in data directory")
+    parser.add_argument("--partition-by", nargs="+", choices=("agent_id", "month"),
+                        help="write dataset partitioned into directories")
+    parser.add_argument("--coordinates", choices=("float64", "float32", "scaled_int"), default="float32",
+                        help="type of coordinate columns of binary formats")
+    parser.add_argument("--repair", action="store_true",
+                        help="resolve overlapping trips and scattered start points of parked cars, see validation.py; "
+                             "trips are repaired within each month, a conflict across the turn of a month remains")
+    parser.add_argument("--checkpoint", help="checkpoint to extend CSV trip data of a single agent up to end date")
+    parser.add_argument("--cache-dir", help="directory of cache of trip data of a single agent with given seed")
+    parser.add_argument("--cache-max-bytes", type=_positive_int, default=1 << 30,
+                        help="budget of total size of cache in bytes")
+    parser.add_argument("--profile", action="store_true", help="print time spent per stage to stderr")
+    return parser
+
+
+def _config_argv(parser: argparse.ArgumentParser,
+                 config: dict) -> List[str]:
+    """Command line arguments equivalent to values of a config file, hence checked by the parser like explicit ones."""
+    actions = {}
+    switches = {}
+    for action in parser._actions:
+        if not action.option_strings or action.dest in ("help", "config"):
+            continue
+        if action.nargs == 0 and isinstance(action.const, bool):
+            switches[action.dest, action.const] = action.option_strings[0]
+        actions.setdefault(action.dest, action)
+
+    argv = []
+    for name, value in config.items():
+        if name not in actions:
+            parser.error(f"unknown key in config file: {name}")
+        action = actions[name]
+        if (name, True) in switches or (name, False) in switches:
+            if not isinstance(value, bool):
+                parser.error(f"value of '{name}' in config file has to be true or false")
+            if (name, value) in switches:
+                argv.append(switches[name, value])
+        elif action.nargs == "+":
+            values = value if isinstance(value, list) else [value]
+            argv.extend([action.option_strings[0]] + [str(v) for v in values])
+        elif value is not None:
+            argv.extend([action.option_strings[0], str(value)])
+    return argv
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse arguments; values of a config file replace defaults and are overridden by explicit arguments."""
+    parser = build_parser()
+    if argv is None:
+        argv = sys.argv[1:]
+    args, _ = parser.parse_known_args(argv)
+    if args.config is not None:
+        with open(args.config, "r") as f:
+            config = json.load(f)
+        # explicit arguments follow the values of the config file, hence override them
+        argv = _config_argv(parser, config) + list(argv)
+    args = parser.parse_args(argv)
+    if args.engine == "numpy" and (args.format != "npz" or args.agents > 1 or args.partition_by):
+        parser.error("--engine numpy requires --format npz, a single agent and no partitioning")
+    if args.checkpoint is not None and (args.format != "csv" or args.agents > 1 or args.engine != "streaming"):
+        parser.error("--checkpoint requires --format csv, a single agent and the streaming engine")
+    if args.cache_dir is not None and (args.agents > 1 or args.engine != "streaming" or args.checkpoint):
+        parser.error("--cache-dir requires a single agent, the streaming engine and no checkpoint")
+    if args.cache_dir is not None and args.seed is None:
+        parser.error("--cache-dir requires --seed, runs from fresh entropy are not cached")
+    if args.partition_by and "agent_id" in args.partition_by and args.agents == 1:
+        parser.error("--partition-by agent_id requires more than one agent")
+    if args.engine == "sharded" and args.agents > 1:
+        parser.error("--engine sharded requires a single agent")
+    if args.repair and (args.engine == "sharded" or args.agents > 1 or args.checkpoint or args.cache_dir):
+        parser.error("--repair is supported by the streaming and numpy engines of a single agent")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run creation of synthetic trip data as specified by command line arguments.
+
+    Returns:
+        Exit code.
+    """
+    args = parse_args(argv)
+
+    import numpy as np
+
+    from holiday_calendar import HolidayCalendar
+    from location_index import SpeedModel
+    from profiling import GenerationStats
+    from schedule import load_schedule
+    from writers import FILE_EXTENSIONS, write_trip_chunks
+
+    with open(args.locations, "r") as f:
+        known_locations = json.load(f)["data"]
+    if args.travel_times.endswith(".json"):
+        with open(args.travel_times, "r") as f:
+            travel_time_dict = json.load(f)
+    else:
+        travel_time_dict = args.travel_times
+
+    parameters = dict(known_locations=known_locations,
+                      travel_time_dict=travel_time_dict,
+                      location_scatter=args.location_scatter,
+                      departure_time_scatter=args.departure_time_scatter,
+                      travel_time_scatter=args.travel_time_scatter,
+                      monthly_trip=args.monthly_trip,
+                      seasonal_trip=args.seasonal_trip,
+                      additional_holidays=HolidayCalendar.from_file(args.holidays) if args.holidays else None,
+                      start_date=args.start_date,
+                      end_date=args.end_date,
+                      schedule=load_schedule(args.schedule) if args.schedule else None,
+                      speed_model=SpeedModel() if args.speed_model else None)
+
+    stats = GenerationStats() if args.profile else None
+    seed = np.random.SeedSequence(args.seed).entropy
+    output = args.output
+    if output is None:
+        output = (POPULATION_DATA_PATH if args.agents > 1 else TRIP_DATA_PATH) + FILE_EXTENSIONS[args.format]
+    writer_options = dict(path=output,
+                          file_format=args.format,
+                          partition_by=args.partition_by,
+                          coordinates=args.coordinates,
+                          stats=stats)
+
+    if args.agents > 1:
+        from population import iter_population_data
+
+        write_trip_chunks(chunks=iter_population_data(n_agents=args.agents,
+                                                      master_seed=seed,
+                                                      n_workers=args.workers,
+                                                      chunk_size=args.chunk_size,
+                                                      stats=stats,
+                                                      **parameters),
+                          **writer_options)
+    elif args.checkpoint is not None:
+        from checkpoint import extend_synthetic_data
+
+        extend_synthetic_data(path=output,
+                              checkpoint_path=args.checkpoint,
+                              seed=args.seed,
+                              **parameters)
+    elif args.cache_dir is not None:
+        from result_cache import ResultCache, cached_synthetic_data
+
+        df_trips = cached_synthetic_data(cache=ResultCache(args.cache_dir, max_bytes=args.cache_max_bytes),
+                                         seed=args.seed,
+                                         **parameters)
+        write_trip_chunks(chunks=[df_trips], **writer_options)
+    elif args.engine == "numpy":
+        from calendar_engine import create_trip_columns, month_windows
+
+        # same windows and random stream as `iter_synthetic_data`, hence the same trips
+        rng = np.random.default_rng(seed)
+        windows = month_windows(start_date=args.start_date,
+                                end_date=args.end_date,
+                                chunk_months=1)
+        chunks = (create_trip_columns(**dict(parameters, start_date=window_start, end_date=window_end),
+                                      rng=rng,
+                                      stats=stats,
+                                      repair=args.repair) for window_start, window_end in windows)
+        write_trip_chunks(chunks=chunks, **writer_options)
+    elif args.engine == "sharded":
+        from noise import CounterNoise
+        from sharding import iter_sharded_data
+
+        write_trip_chunks(chunks=iter_sharded_data(noise=CounterNoise(seed),
+                                                   shard_months=args.shard_months,
+                                                   n_workers=args.workers,
+                                                   stats=stats,
+                                                   **parameters),
+                          **writer_options)
+    else:
+        from trip_creation import iter_synthetic_data
+
+        write_trip_chunks(chunks=iter_synthetic_data(rng=np.random.default_rng(seed),
+                                                     stats=stats,
+                                                     repair=args.repair,
+                                                     **parameters),
+                          **writer_options)
+
+    if stats is not None:
+        print(stats, file=sys.stderr)
+    return 0
+
 
 if __name__ == '__main__':
-    df_trips = create_synthetic_data(known_locations=KNOWN_LOCATIONS,
-                                     travel_time_dict=TRAVEL_TIME,
-                                     location_scatter=LOCATION_SCATTER,
-                                     departure_time_scatter=DEPARTURE_TIME_SCATTER,
-                                     travel_time_scatter=TRAVEL_TIME_SCATTER,
-                                     monthly_trip=MONTHLY_TRIP,
-                                     start_date=START_DATE,
-                                     end_date=END_DATE,
-                                     additional_holidays=ADDITIONAL_HOLIDAYS,
-                                     seasonal_trip=SEASONAL_TRIP)
-
-    df_trips.to_csv("data/synthetic_trip_data.csv",
-                    index=False)
+    sys.exit(main())
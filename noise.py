@@ -0,0 +1,111 @@
+"""Module providing counter-based random noise keyed on seed, agent, day and slot.
+
+Each draw is a pure function of its key, hence any window of days can be regenerated without replaying the draws
+of earlier days, and draws can be evaluated in bulk for whole arrays of keys.
+
+Slots of a day are the trip templates of the schedule plan, followed by its branch options (see
+`SchedulePlan.option_slots`). Streams distinguish the draws of a slot, see the stream constants below.
+"""
+from typing import Tuple, Union
+
+import numpy as np
+
+# streams of standard normal draws of a trip slot
+DEPARTURE_TIME_STREAM = 0
+LATITUDE_STREAM = 1
+LONGITUDE_STREAM = 2
+TRAVEL_TIME_STREAM = 3
+TRIP_STREAMS = np.arange(4)
+
+# stream of uniform draws of a branch option slot
+OPTION_STREAM = 0
+
+_MASK = (1 << 64) - 1
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """Finalizer of SplitMix64, a bijection of uint64 with good avalanche behavior."""
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+def _as_uint64(values) -> np.ndarray:
+    """Reinterpret integers, possibly negative, as uint64 array."""
+    return np.asarray(values, dtype=np.int64).astype(np.uint64)
+
+
+class CounterNoise:
+    """Counter-based noise provider of a single agent.
+
+    Args:
+        seed:       Seed of noise, arbitrarily large non-negative integers are folded into 64 bits
+        agent_id:   ID of agent
+
+    Raises:
+        ValueError: If `seed` is negative.
+    """
+
+    def __init__(self, seed: int,
+                 agent_id: int = 0):
+        seed = int(seed)
+        if seed < 0:
+            raise ValueError(f"Seed of counter-based noise has to be non-negative, got {seed}.")
+        self.seed = seed
+        self.agent_id = agent_id
+
+        folded = 0
+        while seed:
+            folded ^= seed & _MASK
+            seed >>= 64
+        with np.errstate(over="ignore"):
+            self._base = _mix(_mix(np.uint64(folded)) + _as_uint64(agent_id) * _GOLDEN_GAMMA)
+
+    def key(self) -> Tuple[int, int]:
+        """Seed and agent ID, which fully determine all draws."""
+        return int(self.seed), int(self.agent_id)
+
+    def _hash(self, days, slots, streams) -> np.ndarray:
+        """64 bit hash of keys, arguments are broadcast against each other."""
+        with np.errstate(over="ignore"):
+            h = _mix(self._base ^ _as_uint64(days))
+            h = _mix(h + _as_uint64(slots) * _GOLDEN_GAMMA)
+            return _mix(h + _as_uint64(streams) * _GOLDEN_GAMMA)
+
+    def uniform(self, days: Union[int, np.ndarray],
+                slots: Union[int, np.ndarray],
+                streams: Union[int, np.ndarray] = 0) -> np.ndarray:
+        """Uniform draws in [0, 1) of given keys.
+
+        Args:
+            days:       Day numbers since 1970-01-01
+            slots:      Slots of day
+            streams:    Streams of slot
+
+        Returns:
+            Array of draws, shaped as the broadcast keys.
+        """
+        return (self._hash(days, slots, streams) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+    def normal(self, days: Union[int, np.ndarray],
+               slots: Union[int, np.ndarray],
+               streams: Union[int, np.ndarray] = 0) -> np.ndarray:
+        """Standard normal draws of given keys by Box-Muller transform of two uniforms derived from each key.
+
+        Args:
+            days:       Day numbers since 1970-01-01
+            slots:      Slots of day
+            streams:    Streams of slot
+
+        Returns:
+            Array of draws, shaped as the broadcast keys.
+        """
+        h = self._hash(days, slots, streams)
+        with np.errstate(over="ignore"):
+            h_2 = _mix(h + _GOLDEN_GAMMA)
+        u_1 = 1.0 - (h >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+        u_2 = (h_2 >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+        return np.sqrt(-2.0 * np.log(u_1)) * np.cos(2.0 * np.pi * u_2)
@@ -0,0 +1,391 @@
+"""Module providing creation of synthetic trip data for whole populations of agents."""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from calendar_engine import apply_trip_details, build_calendar, create_trip_skeleton, month_start
+from location_index import LocationIndex, SpeedModel, compile_location_index
+from noise import CounterNoise
+from profiling import GenerationStats, timed
+from schedule import SchedulePlan, default_schedule
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS, concat_trip_chunks
+
+# columns of created population data, in output order
+POPULATION_COLUMNS = ("agent_id",) + TRIP_COLUMNS
+
+
+def agent_rng(master_seed: int,
+              agent_id: int) -> np.random.Generator:
+    """Independent random generator of a single agent, derived from the master seed.
+
+    The stream only depends on the master seed and the agent ID, hence results do not depend on how agents are
+    distributed among workers.
+
+    Args:
+        master_seed:    Seed of the whole population
+        agent_id:       ID of agent
+
+    Returns:
+        Random generator of agent.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy=master_seed,
+                                                        spawn_key=(agent_id,)))
+
+
+def agent_location_index(location_index: LocationIndex,
+                         rng: np.random.Generator,
+                         region_offset: float = 5e-2,
+                         location_offset: float = 2e-3) -> LocationIndex:
+    """Derive individual set of locations of an agent from the compiled known locations.
+
+    All locations are shifted by a common random offset of the agent's region plus a random offset per location.
+
+    Args:
+        location_index:     Compiled catalog of known locations and travel times
+        rng:                Random generator of agent
+        region_offset:      Standard deviation of common offset in degrees
+        location_offset:    Standard deviation of offset per location in degrees
+
+    Returns:
+        Compiled catalog of locations of agent, sharing the travel times.
+    """
+    region_lat, region_lon = rng.standard_normal(2) * region_offset
+    offsets = rng.standard_normal((len(location_index), 2)) * location_offset
+
+    return location_index.with_coordinates(lat=location_index.lat + region_lat + offsets[:, 0],
+                                           lon=location_index.lon + region_lon + offsets[:, 1])
+
+
+# state shared by all tasks of a pool worker process, set by `_init_worker_state`, see `iter_task_results`
+_worker_state: Optional[dict] = None
+
+
+def _init_worker_state(initializer: Callable[..., dict],
+                       initargs: Tuple):
+    """Initializer of pool worker processes, keeping the state returned by `initializer` for all tasks."""
+    global _worker_state
+    _worker_state = initializer(*initargs)
+
+
+def _run_with_worker_state(task: Callable[[Any, dict], Any],
+                           item: Any) -> Any:
+    """Run task of pool worker process with the state of the process."""
+    return task(item, _worker_state)
+
+
+def _compile_agent_state(known_locations: List[dict],
+                 travel_time_dict: Union[dict, np.ndarray, str],
+                 monthly_trip: bool,
+                 seasonal_trip: bool,
+                 additional_holidays: Optional[list],
+                 start_date: datetime,
+                 end_date: datetime,
+                 schedule: Optional[SchedulePlan],
+                 speed_model: Optional[SpeedModel] = None,
+                 collect_stats: bool = False,
+                 counter_noise: bool = False):
+    """Compile location index, calendar and schedule shared by all chunks of agents, once per worker process.
+
+    Returns:
+        Dict of compiled state, passed to `_create_agent_chunk`.
+    """
+    if schedule is None:
+        schedule = default_schedule()
+
+    # timings of compilation are added to the first chunk of the worker
+    stats = GenerationStats() if collect_stats else None
+
+    with timed(stats, "location_index"):
+        required_pairs = schedule.required_location_pairs(monthly_trip=monthly_trip,
+                                                         seasonal_trip=seasonal_trip)
+        location_index = compile_location_index(known_locations=known_locations,
+                                                travel_time_dict=travel_time_dict,
+                                                required_pairs=required_pairs,
+                                                speed_model=speed_model)
+    # with counter-based noise, the month of start date is evaluated from its first day on for the monthly trip
+    calendar_start = month_start(start_date) if counter_noise else start_date
+    with timed(stats, "calendar") as stage:
+        calendar = build_calendar(start_date=calendar_start,
+                                  end_date=end_date,
+                                  additional_holidays=additional_holidays)
+        stage.rows = len(calendar.days)
+
+    return dict(location_index=location_index,
+                calendar=calendar,
+                schedule=schedule,
+                first_day=(start_date - calendar_start).days,
+                counter_noise=counter_noise,
+                stats=stats.as_dict() if stats is not None else None)
+
+
+def _create_agent_chunk(agent_ids: np.ndarray,
+                        state: dict,
+                        master_seed: int,
+                        region_offset: float,
+                        location_offset: float,
+                        location_scatter: bool,
+                        departure_time_scatter: bool,
+                        travel_time_scatter: bool,
+                        monthly_trip: bool,
+                        seasonal_trip: bool,
+                        collect_stats: bool = False) -> Tuple[dict, Optional[dict]]:
+    """Worker task creating trips of a chunk of agents from the state of `_compile_agent_state`.
+
+    Returns:
+        Dict mapping each of `POPULATION_COLUMNS` and `LOCATION_ID_COLUMNS` to an array with one entry per trip,
+        and per-stage timings of the chunk as dict if `collect_stats` is set, None otherwise.
+    """
+    location_index = state["location_index"]
+    calendar = state["calendar"]
+    schedule = state["schedule"]
+    counter_noise = state["counter_noise"]
+
+    # timings are collected per chunk and merged by the caller, as workers may run in other processes
+    stats = GenerationStats() if collect_stats else None
+    if stats is not None and state["stats"] is not None:
+        stats.merge(state["stats"])
+        state["stats"] = None
+
+    chunks = []
+    for agent_id in agent_ids:
+        rng = agent_rng(master_seed=master_seed,
+                        agent_id=int(agent_id))
+        noise = CounterNoise(seed=master_seed, agent_id=int(agent_id)) if counter_noise else None
+        with timed(stats, "random_draws"):
+            agent_index = agent_location_index(location_index=location_index,
+                                               rng=rng,
+                                               region_offset=region_offset,
+                                               location_offset=location_offset)
+        with timed(stats, "schedule") as stage:
+            skeleton = create_trip_skeleton(calendar=calendar,
+                                            schedule=schedule,
+                                            monthly_trip=monthly_trip,
+                                            seasonal_trip=seasonal_trip,
+                                            rng=rng,
+                                            noise=noise,
+                                            first_day=state["first_day"])
+            stage.rows = len(skeleton.template)
+        trips = apply_trip_details(skeleton=skeleton,
+                                   calendar=calendar,
+                                   schedule=schedule,
+                                   location_index=agent_index,
+                                   location_scatter=location_scatter,
+                                   departure_time_scatter=departure_time_scatter,
+                                   travel_time_scatter=travel_time_scatter,
+                                   rng=rng,
+                                   stats=stats,
+                                   noise=noise)
+        trips["agent_id"] = np.full(len(skeleton.template), agent_id, dtype=np.int64)
+        chunks.append(trips)
+
+    with timed(stats, "assembly"):
+        columns = {name: np.concatenate([trips[name] for trips in chunks]) for name in chunks[0]}
+
+    return columns, stats.as_dict() if stats is not None else None
+
+
+def iter_task_results(task: Callable[..., Any],
+                      items: List[Any],
+                      n_workers: Optional[int],
+                      initializer: Optional[Callable[..., dict]] = None,
+                      initargs: Tuple = ()) -> Iterator[Any]:
+    """Run task for each item, e.g. a chunk of agents, on a process pool, keeping a bounded number of items in flight.
+
+    Args:
+        task:           Picklable function of a single item, or of an item and the state returned by `initializer`
+        items:          Items to process
+        n_workers:      Number of worker processes, number of CPUs if not given, no pool if 1
+        initializer:    Optional picklable function returning state shared by all tasks, e.g. compiled locations;
+                        called once per worker process, or once per call without pool, so state is never shared in
+                        between calls
+        initargs:       Arguments of `initializer`
+
+    Yields:
+        Results of task in order of items, each as soon as it and all results before it are done.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_workers == 1 or len(items) <= 1:
+        if initializer is not None and items:
+            task = partial(task, state=initializer(*initargs))
+        for item in items:
+            yield task(item)
+        return
+
+    if initializer is not None:
+        task = partial(_run_with_worker_state, task)
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=None if initializer is None else _init_worker_state,
+                             initargs=() if initializer is None else (initializer, initargs)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(task, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_population_data(n_agents: int,
+                         master_seed: int,
+                         known_locations: List[dict],
+                         travel_time_dict: Union[dict, np.ndarray, str],
+                         location_scatter: bool,
+                         departure_time_scatter: bool,
+                         travel_time_scatter: bool,
+                         monthly_trip: bool,
+                         seasonal_trip: bool,
+                         additional_holidays=None,
+                         start_date: datetime = datetime(year=2018, month=1, day=1),
+                         end_date: datetime = datetime(year=2019, month=12, day=31),
+                         region_offset: float = 5e-2,
+                         location_offset: float = 2e-3,
+                         schedule: Optional[SchedulePlan] = None,
+                         speed_model: Optional[SpeedModel] = None,
+                         location_ids: bool = False,
+                         n_workers: Optional[int] = None,
+                         chunk_size: int = 64,
+                         stats: Optional[GenerationStats] = None,
+                         counter_noise: bool = False) -> Iterator[pd.DataFrame]:
+    """Create sequences of trips for a population of agents on a process pool, yielding one chunk of agents at a time.
+
+    Each agent gets an individual set of locations and an independent random stream derived from `master_seed`,
+    so the result is identical for any number of workers. Locations, calendar and schedule are sent to and compiled
+    by each worker process once, tasks only carry their chunk of agents. At most two chunks per worker are in
+    flight, hence memory stays bounded regardless of the population size. Large travel time matrices should be passed as path of
+    a `.npy` file, so each worker maps the file instead of receiving a copy of the matrix.
+
+    Args:
+        n_agents:               Number of agents to create
+        master_seed:            Seed of the whole population
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        region_offset:          Standard deviation of common location offset per agent in degrees
+        location_offset:        Standard deviation of individual location offset per agent in degrees
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        n_workers:              Number of worker processes, number of CPUs if not given, no pool if 1
+        chunk_size:             Number of agents created per worker task
+        stats:                  Optional collector of per-stage timings, summed over all workers and emitted per chunk
+        counter_noise:          Flag to indicate if trip scatter and choices should be drawn from counter-based noise
+                                keyed on `master_seed`, agent, day and slot, so any time range of an agent can be
+                                regenerated directly; locations of agents are drawn from their random generators
+
+    Yields:
+        Dataframes containing sequence of trips of `chunk_size` agents, one trip per row, ordered by agent and time.
+        Columns are "agent_id" followed by the columns of `create_synthetic_data`, and `LOCATION_ID_COLUMNS`
+        if requested.
+    """
+    column_names = list(POPULATION_COLUMNS + LOCATION_ID_COLUMNS if location_ids else POPULATION_COLUMNS)
+    agent_chunks = [np.arange(i, min(i + chunk_size, n_agents)) for i in range(0, n_agents, chunk_size)]
+    task = partial(_create_agent_chunk,
+                   master_seed=master_seed,
+                   region_offset=region_offset,
+                   location_offset=location_offset,
+                   location_scatter=location_scatter,
+                   departure_time_scatter=departure_time_scatter,
+                   travel_time_scatter=travel_time_scatter,
+                   monthly_trip=monthly_trip,
+                   seasonal_trip=seasonal_trip,
+                   collect_stats=stats is not None)
+    initargs = (known_locations,
+                travel_time_dict,
+                monthly_trip,
+                seasonal_trip,
+                additional_holidays,
+                start_date,
+                end_date,
+                schedule,
+                speed_model,
+                stats is not None,
+                counter_noise)
+
+    for columns, chunk_stats in iter_task_results(task=task,
+                                                  items=agent_chunks,
+                                                  n_workers=n_workers,
+                                                  initializer=_compile_agent_state,
+                                                  initargs=initargs):
+        if stats is None:
+            yield pd.DataFrame(columns, columns=column_names)
+            continue
+        with timed(stats, "assembly") as stage:
+            df = pd.DataFrame(columns, columns=column_names)
+            stage.rows = len(df)
+        stats.merge(chunk_stats)
+        stats.emit()
+        yield df
+
+
+def create_population_data(n_agents: int,
+                           master_seed: int,
+                           known_locations: List[dict],
+                           travel_time_dict: Union[dict, np.ndarray, str],
+                           location_scatter: bool,
+                           departure_time_scatter: bool,
+                           travel_time_scatter: bool,
+                           monthly_trip: bool,
+                           seasonal_trip: bool,
+                           additional_holidays=None,
+                           start_date: datetime = datetime(year=2018, month=1, day=1),
+                           end_date: datetime = datetime(year=2019, month=12, day=31),
+                           region_offset: float = 5e-2,
+                           location_offset: float = 2e-3,
+                           schedule: Optional[SchedulePlan] = None,
+                           speed_model: Optional[SpeedModel] = None,
+                           location_ids: bool = False,
+                           n_workers: Optional[int] = None,
+                           chunk_size: int = 64,
+                           stats: Optional[GenerationStats] = None,
+                           counter_noise: bool = False) -> pd.DataFrame:
+    """Create sequences of trips for a population of agents on a process pool.
+
+    See `iter_population_data` for the arguments; all chunks are merged into a single Dataframe.
+
+    Returns:
+        Dataframe containing sequence of trips per agent, one trip per row, ordered by agent and time.
+        Columns are "agent_id" followed by the columns of `create_synthetic_data`, and `LOCATION_ID_COLUMNS`
+        if requested.
+    """
+    chunks = list(iter_population_data(n_agents=n_agents,
+                                       master_seed=master_seed,
+                                       known_locations=known_locations,
+                                       travel_time_dict=travel_time_dict,
+                                       location_scatter=location_scatter,
+                                       departure_time_scatter=departure_time_scatter,
+                                       travel_time_scatter=travel_time_scatter,
+                                       monthly_trip=monthly_trip,
+                                       seasonal_trip=seasonal_trip,
+                                       additional_holidays=additional_holidays,
+                                       start_date=start_date,
+                                       end_date=end_date,
+                                       region_offset=region_offset,
+                                       location_offset=location_offset,
+                                       schedule=schedule,
+                                       speed_model=speed_model,
+                                       location_ids=location_ids,
+                                       n_workers=n_workers,
+                                       chunk_size=chunk_size,
+                                       stats=stats,
+                                       counter_noise=counter_noise))
+
+    column_names = POPULATION_COLUMNS + LOCATION_ID_COLUMNS if location_ids else POPULATION_COLUMNS
+    return concat_trip_chunks(chunks=chunks,
+                              column_names=column_names)
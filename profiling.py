@@ -0,0 +1,147 @@
+"""Module providing opt-in instrumentation of trip generation stages.
+
+Stages are named after the part of the pipeline they measure:
+
+    "location_index"    compiling locations and travel times
+    "calendar"          building per-day masks and holiday bitmaps
+    "schedule"          evaluating the schedule plan into trips, including iteration over days in the day loop
+    "random_draws"      drawing departure time, location and travel time scatter
+    "location_lookup"   resolving coordinates and travel times of trips
+    "timestamps"        converting scheduled local times into time stamps
+    "assembly"          building Dataframes from trip columns
+    "write"             writing chunks of trips to disk
+
+Instrumented functions take an optional `stats` argument; if it is None, stages are not timed at all.
+"""
+from time import perf_counter
+from typing import Callable, Optional
+
+
+class StageStats:
+    """Accumulated wall time, call count and rows produced of a single stage."""
+    __slots__ = ("seconds", "calls", "rows")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+
+
+class GenerationStats:
+    """Collector of per-stage statistics of one or more generation runs.
+
+    Args:
+        callback:   Optional function called with the collector whenever a run, or a chunk of a streamed run,
+                    has been completed
+    """
+
+    def __init__(self, callback: Optional[Callable[["GenerationStats"], None]] = None):
+        self.callback = callback
+        self.stages = {}
+
+    def record(self, stage: str,
+               seconds: float,
+               rows: int = 0,
+               calls: int = 1):
+        """Add measurement to stage."""
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+        stats.seconds += seconds
+        stats.calls += calls
+        stats.rows += rows
+
+    def merge(self, other: dict):
+        """Add statistics given as dict by `as_dict`, e.g. collected in a worker process."""
+        for stage, values in other.items():
+            self.record(stage, values["seconds"], rows=values["rows"], calls=values["calls"])
+
+    def emit(self):
+        """Pass collector to callback, if any."""
+        if self.callback is not None:
+            self.callback(self)
+
+    def total_seconds(self) -> float:
+        """Wall time summed over all stages."""
+        return sum(s.seconds for s in self.stages.values())
+
+    def as_dict(self) -> dict:
+        """Statistics per stage as plain dict."""
+        return {stage: {"seconds": s.seconds, "calls": s.calls, "rows": s.rows} for stage, s in self.stages.items()}
+
+    def __str__(self) -> str:
+        total = self.total_seconds() or 1.0
+        lines = [f"{'stage':16s} {'seconds':>10s} {'share':>7s} {'calls':>10s} {'rows':>12s}"]
+        for stage, s in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            lines.append(f"{stage:16s} {s.seconds:10.4f} {s.seconds / total:7.1%} {s.calls:10d} {s.rows:12d}")
+        return "\n".join(lines)
+
+
+class _Stage:
+    """Context manager timing a stage; `rows` may be set inside the block."""
+    __slots__ = ("_stats", "_name", "_start", "rows")
+
+    def __init__(self, stats: GenerationStats,
+                 name: str,
+                 rows: int):
+        self._stats = stats
+        self._name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stats.record(self._name, perf_counter() - self._start, rows=self.rows)
+
+
+class _ExclusiveStage(_Stage):
+    """Context manager timing a stage without the time of stages nested in it."""
+    __slots__ = ("_nested_start",)
+
+    def __enter__(self):
+        self._nested_start = self._stats.total_seconds()
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = perf_counter() - self._start
+        nested = self._stats.total_seconds() - self._nested_start
+        self._stats.record(self._name, elapsed - nested, rows=self.rows)
+
+
+class _DisabledStage:
+    """Context manager doing nothing, shared by all stages if instrumentation is disabled."""
+    __slots__ = ("rows",)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+def timed(stats: Optional[GenerationStats],
+          name: str,
+          rows: int = 0,
+          exclusive: bool = False):
+    """Context manager timing a stage if `stats` is given.
+
+    Args:
+        stats:      Optional collector, nothing is measured if not given
+        name:       Name of stage
+        rows:       Rows produced by stage, may also be set on the returned object inside the block
+        exclusive:  Flag to indicate if time of stages timed inside the block should be left out, e.g. of a loop
+                    whose body calls instrumented functions, so the stages add up to the time of the block
+
+    Returns:
+        Context manager.
+    """
+    if stats is None:
+        return _DISABLED_STAGE
+    if exclusive:
+        return _ExclusiveStage(stats, name, rows)
+    return _Stage(stats, name, rows)
@@ -0,0 +1,225 @@
+"""Module providing content-addressed on-disk cache of created trip data with size-bounded LRU eviction."""
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from fingerprint import file_key, fingerprint
+from holiday_calendar import HolidayCalendar
+from location_index import SpeedModel
+from schedule import SchedulePlan, default_schedule
+from trip_creation import iter_synthetic_data
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS, concat_trip_chunks
+
+# version of created trip data, part of every cache key; to be incremented whenever a change of schedule, noise or
+# engines changes the trips created from the same parameters, so entries of earlier versions are no longer hit
+CACHE_VERSION = 1
+
+# file extension of cache entries
+ENTRY_EXTENSION = ".npz"
+
+# file extension of entries being written, see `ResultCache.put`
+TMP_EXTENSION = ".tmp"
+
+# age in seconds after which a temporary file is taken to be left behind by a crashed writer
+STALE_TMP_SECONDS = 3600
+
+
+class ResultCache:
+    """Directory of created Dataframes stored as uncompressed NPZ files named by the hash of their parameters.
+
+    Entries are stamped with their last access, the least recently used entries are evicted as soon as the total
+    size exceeds the budget. Entries are written atomically, hence several processes may share a cache.
+
+    Args:
+        root:       Directory of cache, created if missing
+        max_bytes:  Budget of total size of all entries in bytes
+    """
+
+    def __init__(self, root: str,
+                 max_bytes: int = 1 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + ENTRY_EXTENSION)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Dataframe stored under key, None on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                df = pd.DataFrame({name: data[name] for name in data.files})
+        except FileNotFoundError:
+            return None
+        # mark as recently used, unless evicted by another process in the meantime; the data is loaded already
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return df
+
+    def put(self, key: str,
+            df: pd.DataFrame):
+        """Store Dataframe under key and evict least recently used entries beyond the budget."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}{TMP_EXTENSION}"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **{name: df[name].to_numpy() for name in df.columns})
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_or_create(self, key: str,
+                      create: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """Dataframe stored under key, created and stored on a miss."""
+        df = self.get(key)
+        if df is None:
+            df = create()
+            self.put(key, df)
+        return df
+
+    def size(self) -> int:
+        """Total size of all entries in bytes."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the total size is within the budget.
+
+        Temporary files of writers which crashed, i.e. older than `STALE_TMP_SECONDS`, are removed as well; those of
+        running writers count towards the total size.
+        """
+        entries = []
+        total = 0
+        stale_time = time.time() - STALE_TMP_SECONDS
+        for entry in os.scandir(self.root):
+            if not entry.name.endswith(TMP_EXTENSION):
+                continue
+            try:
+                stat = entry.stat()
+                if stat.st_mtime < stale_time:
+                    os.remove(entry.path)
+                else:
+                    total += stat.st_size
+            except FileNotFoundError:
+                # renamed into place or removed by another process
+                pass
+
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total += sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # already evicted by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def _entries(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.root) if entry.name.endswith(ENTRY_EXTENSION)]
+
+
+def cached_synthetic_data(cache: ResultCache,
+                          seed: Optional[int],
+                          known_locations: List[dict],
+                          travel_time_dict: Union[dict, np.ndarray, str],
+                          location_scatter: bool,
+                          departure_time_scatter: bool,
+                          travel_time_scatter: bool,
+                          monthly_trip: bool,
+                          seasonal_trip: bool,
+                          additional_holidays=None,
+                          start_date: datetime = datetime(year=2018, month=1, day=1),
+                          end_date: datetime = datetime(year=2019, month=12, day=31),
+                          schedule: Optional[SchedulePlan] = None,
+                          speed_model: Optional[SpeedModel] = None,
+                          location_ids: bool = False,
+                          chunk_months: int = 1) -> pd.DataFrame:
+    """Cached counterpart of `iter_synthetic_data` with a random generator seeded by `seed`, merging all chunks.
+
+    The cache key covers all parameters, the seed and `CACHE_VERSION`; runs without seed use fresh entropy and are
+    never cached.
+
+    Args:
+        cache:                  Result cache
+        seed:                   Seed of random generator, fresh entropy without caching if None
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        chunk_months:           Number of months evaluated per window
+
+    Returns:
+        Dataframe containing sequence of trips, one trip per row, with the columns of `iter_synthetic_data`.
+    """
+    def create() -> pd.DataFrame:
+        chunks = list(iter_synthetic_data(known_locations=known_locations,
+                                          travel_time_dict=travel_time_dict,
+                                          location_scatter=location_scatter,
+                                          departure_time_scatter=departure_time_scatter,
+                                          travel_time_scatter=travel_time_scatter,
+                                          monthly_trip=monthly_trip,
+                                          seasonal_trip=seasonal_trip,
+                                          additional_holidays=additional_holidays,
+                                          start_date=start_date,
+                                          end_date=end_date,
+                                          rng=np.random.default_rng(seed),
+                                          schedule=schedule,
+                                          speed_model=speed_model,
+                                          location_ids=location_ids,
+                                          chunk_months=chunk_months))
+        # chunks may be missing altogether, e.g. for an empty time range
+        return concat_trip_chunks(chunks=chunks,
+                                  column_names=TRIP_COLUMNS + LOCATION_ID_COLUMNS if location_ids else TRIP_COLUMNS)
+
+    if seed is None:
+        return create()
+
+    key = fingerprint(generator="iter_synthetic_data",
+                      version=CACHE_VERSION,
+                      seed=seed,
+                      known_locations=known_locations,
+                      travel_time_dict=file_key(travel_time_dict) if isinstance(travel_time_dict, (str, os.PathLike))
+                      else travel_time_dict,
+                      location_scatter=location_scatter,
+                      departure_time_scatter=departure_time_scatter,
+                      travel_time_scatter=travel_time_scatter,
+                      monthly_trip=monthly_trip,
+                      seasonal_trip=seasonal_trip,
+                      additional_holidays=HolidayCalendar.coerce(additional_holidays),
+                      start_date=start_date,
+                      end_date=end_date,
+                      schedule=schedule if schedule is not None else default_schedule(),
+                      speed_model=speed_model,
+                      location_ids=location_ids,
+                      chunk_months=chunk_months)
+    return cache.get_or_create(key, create)
@@ -0,0 +1,250 @@
+"""Module providing declarative weekly schedules and their compilation into executable plans."""
+import json
+import os
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+# JSON file containing the default weekly schedule
+DEFAULT_SCHEDULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "schedule.json")
+
+# names of weekdays in schedule spec, position is weekday number
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# calendar conditions a branch option may depend on
+CONDITIONS = ("monthly", "seasonal")
+
+
+class TripTemplate(NamedTuple):
+    """Trip taken on a weekday at a scheduled time."""
+    weekday: int                # day of week, 0 is Monday
+    seconds: int                # scheduled departure in seconds after midnight
+    start_location: str         # name of start location
+    end_location: str           # name of end location
+
+
+class BranchOption(NamedTuple):
+    """Alternative of a branch, taken if all of its conditions hold."""
+    when: Tuple[str, ...]           # calendar conditions out of `CONDITIONS`
+    probability: Optional[float]    # probability to take option if calendar conditions hold
+    templates: Tuple[int, ...]      # indices of trip templates of option
+
+
+class Branch(NamedTuple):
+    """Set of options of which the first one applying on a day is taken."""
+    weekday: int
+    options: Tuple[BranchOption, ...]
+
+
+class SchedulePlan:
+    """Weekly schedule compiled into flat tables of trip templates, branches and departure time sigmas.
+
+    Args:
+        templates:              All trip templates of the schedule
+        steps:                  Per weekday, sequence of steps as ("trip", template index) or ("branch", branch index)
+        branches:               All branches of the schedule
+        skip_holidays:          Per weekday, flag to indicate if no trips are taken on holidays
+        seasonal_months:        Months during which seasonal conditions hold
+        departure_time_sigmas:  Per location, rules as (hour before which rule applies or None, sigma in seconds)
+    """
+
+    def __init__(self, templates: List[TripTemplate],
+                 steps: Tuple[Tuple[Tuple[str, int], ...], ...],
+                 branches: List[Branch],
+                 skip_holidays: Tuple[bool, ...],
+                 seasonal_months: Tuple[int, ...],
+                 departure_time_sigmas: dict):
+        self.templates = templates
+        self.steps = steps
+        self.branches = branches
+        self.skip_holidays = skip_holidays
+        self.seasonal_months = seasonal_months
+        self.departure_time_sigmas = departure_time_sigmas
+
+        # columns of template table for bulk evaluation
+        self.template_seconds = np.array([t.seconds for t in templates], dtype=np.int64)
+        self.unconditional_templates = [i for weekday_steps in steps for kind, i in weekday_steps if kind == "trip"]
+
+        # per branch, slots of counter-based noise of its options, following the slots of the trip templates
+        self.option_slots = []
+        slot = len(templates)
+        for branch in branches:
+            self.option_slots.append(tuple(range(slot, slot + len(branch.options))))
+            slot += len(branch.options)
+
+    def key(self) -> tuple:
+        """Normalized content of plan, equal for plans compiled from equivalent specs."""
+        return (tuple(self.templates),
+                self.steps,
+                tuple(self.branches),
+                self.skip_holidays,
+                self.seasonal_months,
+                tuple(sorted(self.departure_time_sigmas.items())))
+
+    def departure_time_sigma(self, start_location: str,
+                             hour: int) -> float:
+        """Standard deviation of departure time scatter for trips from given location.
+
+        Args:
+            start_location:     Name of start location
+            hour:               Scheduled hour of departure
+
+        Returns:
+            Standard deviation in seconds, zero for locations without departure time scatter.
+        """
+        for before_hour, sigma in self.departure_time_sigmas.get(start_location, ()):
+            if before_hour is None or hour < before_hour:
+                return sigma
+        return 0.0
+
+    def required_location_pairs(self, monthly_trip: bool,
+                                seasonal_trip: bool) -> List[Tuple[str, str]]:
+        """Pairs of start and end locations of all trip templates which may be part of the sequence of trips.
+
+        Args:
+            monthly_trip:   Flag to indicate if monthly trips should be included
+            seasonal_trip:  Flag to indicate if seasonal trips should be included
+
+        Returns:
+            List of tuples of start and end location names.
+        """
+        disabled = set()
+        if not monthly_trip:
+            disabled.add("monthly")
+        if not seasonal_trip:
+            disabled.add("seasonal")
+
+        template_ids = list(self.unconditional_templates)
+        for branch in self.branches:
+            for option in branch.options:
+                if not disabled.intersection(option.when):
+                    template_ids.extend(option.templates)
+        return [(self.templates[i].start_location, self.templates[i].end_location) for i in template_ids]
+
+
+def _parse_time(value: str) -> int:
+    """Parse time of day as "HH:MM" or "HH:MM:SS" into seconds after midnight."""
+    parts = [int(p) for p in value.split(":")]
+    if len(parts) not in (2, 3) or not 0 <= parts[0] < 24 or not all(0 <= p < 60 for p in parts[1:]):
+        raise ValueError(f"Invalid time of day '{value}', expected HH:MM or HH:MM:SS.")
+    return 3600 * parts[0] + 60 * parts[1] + (parts[2] if len(parts) == 3 else 0)
+
+
+def _require_keys(entry: dict,
+                  keys: Tuple[str, ...],
+                  context: str):
+    """Check that an entry of a schedule spec has all required keys, context names the entry in the error."""
+    missing = [key for key in keys if not isinstance(entry, dict) or key not in entry]
+    if missing:
+        raise ValueError(f"Schedule lacks {', '.join(repr(key) for key in missing)} in {context}.")
+
+
+def _parse_sigma_rules(location: str,
+                       value: Union[float, List[dict]]) -> Tuple[Tuple[Optional[int], float], ...]:
+    """Parse departure time sigma of a location, given in minutes, into rules in seconds."""
+    if isinstance(value, (int, float)):
+        return (None, 60.0 * value),
+    for i, rule in enumerate(value):
+        _require_keys(rule, ("sigma",), f"rule {i} of departure time sigma of '{location}'")
+    return tuple((rule.get("before_hour"), 60.0 * rule["sigma"]) for rule in value)
+
+
+def compile_schedule(spec: dict) -> SchedulePlan:
+    """Compile a weekly schedule spec into an executable plan.
+
+    The spec contains the months of seasonal trips, departure time sigmas per location in minutes and, per weekday,
+    a list of steps. A step is either a trip ({"time": "HH:MM", "start": ..., "end": ...}) or a branch
+    ({"branch": [option, ...]}), where the first option whose conditions hold on a day is taken. Options may
+    depend on calendar conditions ("when": ["monthly", "seasonal"]) and on a "probability"; "monthly" holds
+    on the first day of each month on which the option is reached.
+
+    Args:
+        spec:   Schedule spec, e.g. as loaded from JSON
+
+    Returns:
+        Compiled schedule plan.
+
+    Raises:
+        ValueError: If the spec is malformed.
+    """
+    templates = []
+    branches = []
+    steps = []
+    skip_holidays = []
+
+    seasonal_months = tuple(spec.get("seasonal_months", ()))
+    invalid_months = [month for month in seasonal_months if not isinstance(month, int) or not 1 <= month <= 12]
+    if invalid_months:
+        raise ValueError(f"Invalid seasonal months in schedule: {', '.join(map(str, invalid_months))}.")
+
+    unknown_weekdays = set(spec.get("weekdays", {})) - set(WEEKDAYS)
+    if unknown_weekdays:
+        raise ValueError(f"Unknown weekdays in schedule: {', '.join(sorted(unknown_weekdays))}.")
+
+    def add_template(weekday: int, trip: dict, context: str) -> int:
+        _require_keys(trip, ("time", "start", "end"), context)
+        templates.append(TripTemplate(weekday=weekday,
+                                      seconds=_parse_time(trip["time"]),
+                                      start_location=trip["start"],
+                                      end_location=trip["end"]))
+        return len(templates) - 1
+
+    for weekday, name in enumerate(WEEKDAYS):
+        day_spec = spec.get("weekdays", {}).get(name, {})
+        skip_holidays.append(bool(day_spec.get("skip_holidays", weekday < 5)))
+
+        weekday_steps = []
+        for i, step in enumerate(day_spec.get("steps", [])):
+            context = f"step {i} of {name}"
+            if "branch" not in step:
+                weekday_steps.append(("trip", add_template(weekday, step, context)))
+                continue
+
+            options = []
+            for j, option in enumerate(step["branch"]):
+                _require_keys(option, ("trips",), f"option {j} of {context}")
+                when = tuple(option.get("when", ()))
+                unknown_conditions = set(when) - set(CONDITIONS)
+                if unknown_conditions:
+                    raise ValueError(f"Unknown conditions in schedule: {', '.join(sorted(unknown_conditions))}.")
+                probability = option.get("probability")
+                if probability is not None and not 0.0 <= probability <= 1.0:
+                    raise ValueError(f"Invalid probability {probability} in schedule.")
+                option_templates = tuple(add_template(weekday, trip, f"trip {k} of option {j} of {context}")
+                                         for k, trip in enumerate(option["trips"]))
+                options.append(BranchOption(when=when,
+                                            probability=probability,
+                                            templates=option_templates))
+
+            branches.append(Branch(weekday=weekday,
+                                   options=tuple(options)))
+            weekday_steps.append(("branch", len(branches) - 1))
+        steps.append(tuple(weekday_steps))
+
+    return SchedulePlan(templates=templates,
+                        steps=tuple(steps),
+                        branches=branches,
+                        skip_holidays=tuple(skip_holidays),
+                        seasonal_months=seasonal_months,
+                        departure_time_sigmas={location: _parse_sigma_rules(location, value) for location, value
+                                               in spec.get("departure_time_sigma_minutes", {}).items()})
+
+
+def load_schedule(path: str = DEFAULT_SCHEDULE_PATH) -> SchedulePlan:
+    """Load schedule spec from JSON file and compile it.
+
+    Args:
+        path:   Path of JSON file
+
+    Returns:
+        Compiled schedule plan.
+    """
+    with open(path, "r") as f:
+        return compile_schedule(json.load(f))
+
+
+@lru_cache(maxsize=None)
+def default_schedule() -> SchedulePlan:
+    """Compiled default schedule, loaded once per process."""
+    return load_schedule(DEFAULT_SCHEDULE_PATH)
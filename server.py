@@ -0,0 +1,416 @@
+"""Module providing a local HTTP service streaming synthetic trips on demand, built on asyncio streams only.
+
+Trips are requested per agent, seed and time range, e.g.
+
+    GET /trips?seed=7&agent=42&month=2019-03&format=ndjson
+    GET /trips?seed=7&agent=42&start=2019-01-01&end=2020-01-01&format=arrow&monthly_trip=0
+
+and are streamed as chunked response, one month at a time. Draws come from counter-based noise keyed on seed and
+agent, so a time range yields exactly the trips of that range in `create_synthetic_data` with
+`noise=CounterNoise(seed, agent)` over a longer time range, and months requested separately add up to the whole.
+Months are created on a process pool; a semaphore bounds the number of months in flight over all clients, so
+requests are served interleaved instead of one after the other. Run the service with
+
+    python server.py --port 8000 --workers 4
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from calendar_engine import create_trip_columns, month_windows
+from holiday_calendar import HolidayCalendar
+from location_index import SpeedModel, compile_location_index
+from noise import CounterNoise
+from schedule import SchedulePlan, default_schedule, load_schedule
+from writers import compact_columns
+
+# content types per response format
+CONTENT_TYPES = {"csv": "text/csv",
+                 "ndjson": "application/x-ndjson",
+                 "arrow": "application/vnd.apache.arrow.stream"}
+
+# flags of creation which may be disabled per request, all enabled by default
+FLAGS = ("location_scatter", "departure_time_scatter", "travel_time_scatter", "monthly_trip", "seasonal_trip")
+
+# reason phrases of status codes sent by the service
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+logger = logging.getLogger(__name__)
+
+# parameters of creation shared by all tasks of a worker process, set by `_init_worker`
+_worker_parameters: Optional[dict] = None
+
+
+class TripQuery(NamedTuple):
+    """Parameters of a request for trips."""
+    seed: int
+    agent_id: int
+    start_date: datetime
+    end_date: datetime
+    file_format: str
+    flags: dict             # flags of creation, keyed by name as in `FLAGS`
+    location_ids: bool
+    coordinates: str        # type of coordinate columns of Arrow responses, see `compact_columns`
+
+
+def _parse_flag(value: str) -> bool:
+    """Parse boolean query parameter."""
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(f"Invalid flag '{value}'.")
+
+
+def parse_query(query: str) -> TripQuery:
+    """Parse query string of a request for trips.
+
+    The time range is given either as `month` (YYYY-MM) or as `start` and `end` (YYYY-MM-DD, end excluded).
+
+    Args:
+        query:  Query string of URL
+
+    Returns:
+        Parameters of request.
+
+    Raises:
+        ValueError: If a parameter is missing or invalid.
+    """
+    params = {name: values[-1] for name, values in parse_qs(query, keep_blank_values=True).items()}
+    if "seed" not in params:
+        raise ValueError("Parameter 'seed' is required.")
+
+    if "month" in params:
+        start_date = datetime.strptime(params["month"], "%Y-%m")
+        _, end_date = next(month_windows(start_date=start_date,
+                                         end_date=datetime.max,
+                                         chunk_months=1))
+    elif "start" in params and "end" in params:
+        start_date = datetime.fromisoformat(params["start"])
+        end_date = datetime.fromisoformat(params["end"])
+    else:
+        raise ValueError("Either parameter 'month' or parameters 'start' and 'end' are required.")
+    if end_date <= start_date:
+        raise ValueError("Parameter 'end' has to be after 'start'.")
+
+    file_format = params.get("format", "csv")
+    if file_format not in CONTENT_TYPES:
+        raise ValueError(f"Unknown format '{file_format}'.")
+    coordinates = params.get("coordinates", "float32")
+    if coordinates not in ("float64", "float32", "scaled_int"):
+        raise ValueError(f"Unknown coordinate type '{coordinates}'.")
+
+    seed = int(params["seed"])
+    if seed < 0:
+        raise ValueError("Parameter 'seed' has to be non-negative.")
+    agent_id = int(params.get("agent", 0))
+    if agent_id < 0:
+        raise ValueError("Parameter 'agent' has to be non-negative.")
+
+    return TripQuery(seed=seed,
+                     agent_id=agent_id,
+                     start_date=start_date,
+                     end_date=end_date,
+                     file_format=file_format,
+                     flags={name: _parse_flag(params.get(name, "1")) for name in FLAGS},
+                     location_ids=_parse_flag(params.get("location_ids", "0")),
+                     coordinates=coordinates)
+
+
+def encode_csv(columns: dict,
+               header: bool) -> bytes:
+    """Encode trips as CSV rows, floats in shortest round-trip representation as written by `CsvTripWriter`."""
+    lines = [",".join(columns)] if header else []
+    lines.extend(",".join(map(repr, row)) for row in zip(*(columns[name].tolist() for name in columns)))
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def encode_ndjson(columns: dict) -> bytes:
+    """Encode trips as newline delimited JSON, one object per trip."""
+    names = list(columns)
+    rows = zip(*(columns[name].tolist() for name in names))
+    return "".join(json.dumps(dict(zip(names, row))) + "\n" for row in rows).encode()
+
+
+def _init_worker(known_locations: List[dict],
+                 travel_time_dict: Union[dict, np.ndarray, str],
+                 additional_holidays=None,
+                 schedule: Optional[SchedulePlan] = None,
+                 speed_model: Optional[SpeedModel] = None):
+    """Initializer of worker processes, compiling location index, holidays and schedule once per process."""
+    global _worker_parameters
+    _worker_parameters = dict(known_locations=known_locations,
+                              travel_time_dict=travel_time_dict,
+                              additional_holidays=HolidayCalendar.coerce(additional_holidays),
+                              schedule=schedule if schedule is not None else default_schedule(),
+                              speed_model=speed_model,
+                              location_index=compile_location_index(known_locations=known_locations,
+                                                                    travel_time_dict=travel_time_dict,
+                                                                    speed_model=speed_model))
+
+
+def _create_window(window: Tuple[datetime, datetime],
+                   query: TripQuery,
+                   header: bool) -> Union[bytes, dict]:
+    """Worker task creating the trips of a single window of a request, see `_init_worker`.
+
+    Returns:
+        Encoded trips as CSV or NDJSON, or compact columns of Arrow responses, which are encoded as one stream by the
+        service.
+    """
+    window_start, window_end = window
+    columns = create_trip_columns(start_date=window_start,
+                                  end_date=window_end,
+                                  noise=CounterNoise(seed=query.seed, agent_id=query.agent_id),
+                                  location_ids=query.location_ids,
+                                  **query.flags,
+                                  **_worker_parameters)
+    if query.file_format == "csv":
+        return encode_csv(columns, header=header)
+    if query.file_format == "ndjson":
+        return encode_ndjson(columns)
+    return compact_columns(columns, coordinates=query.coordinates)
+
+
+class _ArrowStreamEncoder:
+    """Encoder of record batches as Arrow IPC stream, returning the bytes of each batch as written."""
+
+    def __init__(self):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+        except ImportError as e:
+            raise ImportError("Arrow responses require the optional dependency 'pyarrow'.") from e
+        self._pa = pyarrow
+        self._sink = io.BytesIO()
+        self._writer = None
+
+    def _flush(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def write(self, columns: dict) -> bytes:
+        """Schema with the first batch, then the batch."""
+        batch = self._pa.record_batch(columns)
+        if self._writer is None:
+            self._writer = self._pa.ipc.new_stream(self._sink, batch.schema)
+        self._writer.write_batch(batch)
+        return self._flush()
+
+    def close(self) -> bytes:
+        """End of stream marker."""
+        if self._writer is not None:
+            self._writer.close()
+        return self._flush()
+
+
+class TripService:
+    """HTTP service streaming trips of requested agent, seed and time range, see module docstring.
+
+    Args:
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        n_workers:              Number of worker processes, number of CPUs if not given
+        max_concurrency:        Maximum number of months in flight over all requests, twice the number of workers if
+                                not given
+    """
+
+    def __init__(self, known_locations: List[dict],
+                 travel_time_dict: Union[dict, np.ndarray, str],
+                 additional_holidays=None,
+                 schedule: Optional[SchedulePlan] = None,
+                 speed_model: Optional[SpeedModel] = None,
+                 n_workers: Optional[int] = None,
+                 max_concurrency: Optional[int] = None):
+        n_workers = n_workers or os.cpu_count() or 1
+        # parameters are sent to each worker once, tasks only carry their window and query; workers are spawned, as
+        # forked ones would inherit the sockets of open connections, which then are not closed by `writer.close()`
+        self._executor = ProcessPoolExecutor(max_workers=n_workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker,
+                                             initargs=(known_locations,
+                                                       travel_time_dict,
+                                                       additional_holidays,
+                                                       schedule,
+                                                       speed_model))
+        self._semaphore = asyncio.Semaphore(max_concurrency or 2 * n_workers)
+
+    async def start(self, host: str = "127.0.0.1",
+                    port: int = 8000) -> asyncio.AbstractServer:
+        """Start listening for requests, port 0 picks a free port.
+
+        Returns:
+            Server, e.g. to be closed or to look up its sockets.
+        """
+        return await asyncio.start_server(self.handle, host=host, port=port)
+
+    def close(self):
+        """Shut down worker pool."""
+        self._executor.shutdown(cancel_futures=True)
+
+    async def _create(self, window: Tuple[datetime, datetime],
+                      query: TripQuery,
+                      header: bool) -> Union[bytes, dict]:
+        """Create trips of a single window on the worker pool."""
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(_create_window,
+                                                                                            window,
+                                                                                            query=query,
+                                                                                            header=header))
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        """Serve a single request, the connection is closed afterwards."""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                # headers are not needed
+                pass
+            if len(request_line) != 3:
+                await self._send_text(writer, 400, "Malformed request line.")
+            elif request_line[0] != "GET":
+                await self._send_text(writer, 405, "Only GET is supported.")
+            else:
+                url = urlsplit(request_line[1])
+                if url.path == "/health":
+                    await self._send_text(writer, 200, "ok")
+                elif url.path == "/trips":
+                    await self._send_trips(writer, url.query)
+                else:
+                    await self._send_text(writer, 404, f"Unknown path '{url.path}'.")
+        except ConnectionError:
+            # client went away
+            pass
+        except Exception:
+            # e.g. creation failed after the status was sent, the response is cut off by closing the connection
+            logger.exception("Failed to serve request.")
+        finally:
+            writer.close()
+
+    async def _send_text(self, writer: asyncio.StreamWriter,
+                          status: int,
+                          message: str):
+        """Send complete plain text response, e.g. an error message."""
+        body = (message + "\n").encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: text/plain\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _send_trips(self, writer: asyncio.StreamWriter,
+                          query_string: str):
+        """Stream trips of request as chunked response, the next month is created while the last one is sent."""
+        try:
+            query = parse_query(query_string)
+        except ValueError as e:
+            await self._send_text(writer, 400, str(e))
+            return
+
+        windows = list(month_windows(start_date=query.start_date,
+                                     end_date=query.end_date,
+                                     chunk_months=1))
+        try:
+            # errors are reported as status as long as no data has been sent
+            arrow = _ArrowStreamEncoder() if query.file_format == "arrow" else None
+            payload = await self._create(windows[0], query, header=True)
+        except Exception as e:
+            await self._send_text(writer, 500, f"{type(e).__name__}: {e}")
+            return
+
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPES[query.file_format]}\r\n"
+                     f"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n".encode())
+        pending = None
+        try:
+            for i in range(len(windows)):
+                pending = None
+                if i + 1 < len(windows):
+                    pending = asyncio.ensure_future(self._create(windows[i + 1], query, header=False))
+                data = arrow.write(payload) if arrow is not None else payload
+                if data:
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    await writer.drain()
+                if pending is not None:
+                    payload = await pending
+            if arrow is not None:
+                data = arrow.close()
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            if pending is not None:
+                # client went away or creation failed, the connection is closed without terminating chunk
+                pending.cancel()
+
+
+async def serve(service: TripService,
+                host: str = "127.0.0.1",
+                port: int = 8000):
+    """Serve requests until cancelled."""
+    server = await service.start(host=host, port=port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Serve trips as specified by command line arguments until interrupted.
+
+    Returns:
+        Exit code.
+    """
+    parser = argparse.ArgumentParser(description="Serve synthetic trips on demand over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--locations", default="data/known_locations.json", help="JSON file of known locations")
+    parser.add_argument("--travel-times", default="data/travel_times.json",
+                        help="JSON file of travel time matrix, or .npy file of square matrix which is memory-mapped")
+    parser.add_argument("--holidays", default="data/holidays.json", help="JSON file of additional holidays")
+    parser.add_argument("--schedule", help="JSON file of weekly schedule, default schedule if not given")
+    parser.add_argument("--speed-model", action="store_true",
+                        help="estimate missing travel times from distance instead of failing")
+    parser.add_argument("--workers", type=int, help="number of worker processes, number of CPUs if not given")
+    parser.add_argument("--max-concurrency", type=int, help="maximum number of months in flight over all requests")
+    args = parser.parse_args(argv)
+
+    with open(args.locations, "r") as f:
+        known_locations = json.load(f)["data"]
+    travel_time_dict = args.travel_times
+    if travel_time_dict.endswith(".json"):
+        with open(travel_time_dict, "r") as f:
+            travel_time_dict = json.load(f)
+
+    trip_service = TripService(known_locations=known_locations,
+                               travel_time_dict=travel_time_dict,
+                               additional_holidays=HolidayCalendar.from_file(args.holidays) if args.holidays else None,
+                               schedule=load_schedule(args.schedule) if args.schedule else None,
+                               speed_model=SpeedModel() if args.speed_model else None,
+                               n_workers=args.workers,
+                               max_concurrency=args.max_concurrency)
+    try:
+        asyncio.run(serve(trip_service, host=args.host, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Module providing parallel creation of the trips of a single agent, split into shards of time on a process pool."""
+from datetime import datetime
+from functools import partial
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from calendar_engine import create_trip_columns, month_windows
+from holiday_calendar import HolidayCalendar
+from location_index import SpeedModel, compile_location_index
+from noise import CounterNoise
+from population import iter_task_results
+from profiling import GenerationStats, timed
+from schedule import SchedulePlan, default_schedule
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS, concat_trip_chunks
+
+
+def _compile_shard_state(known_locations: List[dict],
+                         travel_time_dict: Union[dict, np.ndarray, str],
+                         monthly_trip: bool,
+                         seasonal_trip: bool,
+                         additional_holidays=None,
+                         schedule: Optional[SchedulePlan] = None,
+                         speed_model: Optional[SpeedModel] = None,
+                         collect_stats: bool = False) -> dict:
+    """Compile location index, holidays and schedule shared by all shards, once per worker process.
+
+    Returns:
+        Dict of compiled state, passed to `_create_shard`.
+    """
+    if schedule is None:
+        schedule = default_schedule()
+
+    # timings of compilation are added to the first shard of the worker
+    stats = GenerationStats() if collect_stats else None
+    with timed(stats, "location_index"):
+        location_index = compile_location_index(known_locations=known_locations,
+                                                travel_time_dict=travel_time_dict,
+                                                required_pairs=schedule.required_location_pairs(
+                                                    monthly_trip=monthly_trip,
+                                                    seasonal_trip=seasonal_trip),
+                                                speed_model=speed_model)
+    return dict(location_index=location_index,
+                additional_holidays=HolidayCalendar.coerce(additional_holidays),
+                schedule=schedule,
+                stats=stats.as_dict() if stats is not None else None)
+
+
+def _create_shard(window: Tuple[datetime, datetime],
+                  state: dict,
+                  collect_stats: bool = False,
+                  **kwargs) -> Tuple[dict, Optional[dict]]:
+    """Worker task creating trips of a single shard of time from the state of `_compile_shard_state`.
+
+    Returns:
+        Dict mapping each trip column to an array with one entry per trip, and per-stage timings of the shard as dict
+        if `collect_stats` is set, None otherwise.
+    """
+    stats = GenerationStats() if collect_stats else None
+    if stats is not None and state["stats"] is not None:
+        stats.merge(state["stats"])
+        state["stats"] = None
+    shard_start, shard_end = window
+    columns = create_trip_columns(known_locations=None,
+                                  travel_time_dict=None,
+                                  start_date=shard_start,
+                                  end_date=shard_end,
+                                  location_index=state["location_index"],
+                                  additional_holidays=state["additional_holidays"],
+                                  schedule=state["schedule"],
+                                  stats=stats,
+                                  **kwargs)
+    return columns, stats.as_dict() if stats is not None else None
+
+
+def iter_sharded_data(known_locations: List[dict],
+                      travel_time_dict: Union[dict, np.ndarray, str],
+                      location_scatter: bool,
+                      departure_time_scatter: bool,
+                      travel_time_scatter: bool,
+                      monthly_trip: bool,
+                      seasonal_trip: bool,
+                      noise: CounterNoise,
+                      additional_holidays=None,
+                      start_date: datetime = datetime(year=2018, month=1, day=1),
+                      end_date: datetime = datetime(year=2019, month=12, day=31),
+                      schedule: Optional[SchedulePlan] = None,
+                      speed_model: Optional[SpeedModel] = None,
+                      location_ids: bool = False,
+                      shard_months: int = 12,
+                      n_workers: Optional[int] = None,
+                      stats: Optional[GenerationStats] = None) -> Iterator[pd.DataFrame]:
+    """Create sequence of trips of a single agent on a process pool, one shard of `shard_months` months per task.
+
+    Draws come from counter-based noise, so a shard does not depend on the draws of earlier shards. Shards end at
+    month boundaries, where the monthly trip flag is reset, hence no state has to be carried from one shard to the
+    next; a shard starting within a month resolves the monthly trip from the first day of the month. Shards cover
+    consecutive days, so the time-ordered merge of their trips amounts to yielding each shard once it and all shards
+    before it are done, with at most two shards per worker in flight. The concatenated shards equal the trips of
+    `create_synthetic_data` with the same `noise`.
+
+    Args:
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        noise:                  Counter-based noise of agent
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        shard_months:           Number of months per shard
+        n_workers:              Number of worker processes, number of CPUs if not given, no pool if 1
+        stats:                  Optional collector of per-stage timings, summed over all workers and emitted per shard
+
+    Yields:
+        Dataframes containing consecutive parts of the sequence of trips, one per shard, with the columns of
+        `create_synthetic_data`, followed by `LOCATION_ID_COLUMNS` if requested.
+    """
+    shards = list(month_windows(start_date=start_date,
+                                end_date=end_date,
+                                chunk_months=shard_months))
+    # locations, holidays and schedule are sent to and compiled by each worker once, tasks only carry their shard
+    task = partial(_create_shard,
+                   location_scatter=location_scatter,
+                   departure_time_scatter=departure_time_scatter,
+                   travel_time_scatter=travel_time_scatter,
+                   monthly_trip=monthly_trip,
+                   seasonal_trip=seasonal_trip,
+                   noise=noise,
+                   location_ids=location_ids,
+                   collect_stats=stats is not None)
+    initargs = (known_locations,
+                travel_time_dict,
+                monthly_trip,
+                seasonal_trip,
+                additional_holidays,
+                schedule,
+                speed_model,
+                stats is not None)
+
+    for columns, shard_stats in iter_task_results(task=task,
+                                                  items=shards,
+                                                  n_workers=n_workers,
+                                                  initializer=_compile_shard_state,
+                                                  initargs=initargs):
+        if stats is None:
+            yield pd.DataFrame(columns)
+            continue
+        with timed(stats, "assembly", rows=len(columns["t_start"])):
+            df = pd.DataFrame(columns)
+        stats.merge(shard_stats)
+        stats.emit()
+        yield df
+
+
+def create_sharded_data(known_locations: List[dict],
+                        travel_time_dict: Union[dict, np.ndarray, str],
+                        location_scatter: bool,
+                        departure_time_scatter: bool,
+                        travel_time_scatter: bool,
+                        monthly_trip: bool,
+                        seasonal_trip: bool,
+                        noise: CounterNoise,
+                        additional_holidays=None,
+                        start_date: datetime = datetime(year=2018, month=1, day=1),
+                        end_date: datetime = datetime(year=2019, month=12, day=31),
+                        schedule: Optional[SchedulePlan] = None,
+                        speed_model: Optional[SpeedModel] = None,
+                        location_ids: bool = False,
+                        shard_months: int = 12,
+                        n_workers: Optional[int] = None,
+                        stats: Optional[GenerationStats] = None) -> pd.DataFrame:
+    """Create sequence of trips of a single agent on a process pool.
+
+    See `iter_sharded_data` for the arguments; all shards are merged into a single Dataframe.
+
+    Returns:
+        Dataframe containing sequence of trips, one trip per row, with the columns of `create_synthetic_data`,
+        followed by `LOCATION_ID_COLUMNS` if requested.
+    """
+    chunks = list(iter_sharded_data(known_locations=known_locations,
+                                    travel_time_dict=travel_time_dict,
+                                    location_scatter=location_scatter,
+                                    departure_time_scatter=departure_time_scatter,
+                                    travel_time_scatter=travel_time_scatter,
+                                    monthly_trip=monthly_trip,
+                                    seasonal_trip=seasonal_trip,
+                                    noise=noise,
+                                    additional_holidays=additional_holidays,
+                                    start_date=start_date,
+                                    end_date=end_date,
+                                    schedule=schedule,
+                                    speed_model=speed_model,
+                                    location_ids=location_ids,
+                                    shard_months=shard_months,
+                                    n_workers=n_workers,
+                                    stats=stats))
+
+    column_names = TRIP_COLUMNS + LOCATION_ID_COLUMNS if location_ids else TRIP_COLUMNS
+    return concat_trip_chunks(chunks=chunks,
+                              column_names=column_names)
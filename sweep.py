@@ -0,0 +1,234 @@
+"""Module providing parameter sweeps, i.e. trip data of many combinations of flags and seeds over one time range.
+
+All scenarios of a sweep share the compiled location index and the calendar. The skeleton of trips, i.e. which trip
+templates are taken on which day, depends only on the seed and on the flags `monthly_trip` and `seasonal_trip`, hence
+it is created once per seed and trip set, along with the locations and time stamps of its trips. Scenarios differing
+only in scatter flags merely add their scatter layers to these shared base columns; with counter-based noise, each
+layer is even drawn once per seed and trip set. A sweep thus costs about one base run per seed and trip set plus
+the scatter per scenario, see the sweep cases of `benchmark.py`.
+"""
+import itertools
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from calendar_engine import apply_trip_scatter, build_calendar, create_trip_skeleton, month_start, resolve_trip_base
+from location_index import SpeedModel, compile_location_index
+from noise import CounterNoise
+from profiling import GenerationStats, timed
+from schedule import SchedulePlan, default_schedule
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS
+from writers import FILE_EXTENSIONS, write_trip_chunks
+
+# flags of a scenario with their abbreviations in scenario labels
+FLAG_LABELS = {"location_scatter": "ls",
+               "departure_time_scatter": "dt",
+               "travel_time_scatter": "tt",
+               "monthly_trip": "mt",
+               "seasonal_trip": "st"}
+
+# name of file listing the scenarios of a sweep, written next to their datasets
+MANIFEST_FILE = "sweep.json"
+
+
+class Scenario(NamedTuple):
+    """Combination of flags and seed of a single run of a sweep."""
+    location_scatter: bool
+    departure_time_scatter: bool
+    travel_time_scatter: bool
+    monthly_trip: bool
+    seasonal_trip: bool
+    seed: int
+
+    @property
+    def label(self) -> str:
+        """Name of scenario, e.g. "seed7-ls1-dt1-tt0-mt1-st1", used as file name of its dataset."""
+        return "-".join([f"seed{self.seed}"] + [f"{short}{int(getattr(self, name))}"
+                                                for name, short in FLAG_LABELS.items()])
+
+
+def scenario_grid(seeds: Iterable[int] = (0,),
+                  **flag_values: Sequence[bool]) -> List[Scenario]:
+    """Full grid of scenarios over given seeds and values of flags.
+
+    Args:
+        seeds:          Seeds of random draws
+        flag_values:    Values per flag of `FLAG_LABELS`, both True and False for flags not given, e.g.
+                        `monthly_trip=(True,)` to include monthly trips in all scenarios
+
+    Returns:
+        List of scenarios, ordered by seed, then by flags in order of `FLAG_LABELS`.
+    """
+    unknown = set(flag_values) - set(FLAG_LABELS)
+    if unknown:
+        raise ValueError(f"Unknown flags {sorted(unknown)}.")
+    values = [tuple(flag_values.get(name, (True, False))) for name in FLAG_LABELS]
+    return [Scenario(*flags, seed=seed) for seed in seeds for flags in itertools.product(*values)]
+
+
+def iter_sweep(scenarios: Iterable[Scenario],
+               known_locations: List[dict],
+               travel_time_dict: Union[dict, np.ndarray, str],
+               additional_holidays=None,
+               start_date: datetime = datetime(year=2018, month=1, day=1),
+               end_date: datetime = datetime(year=2019, month=12, day=31),
+               schedule: Optional[SchedulePlan] = None,
+               speed_model: Optional[SpeedModel] = None,
+               location_ids: bool = False,
+               counter_noise: bool = False,
+               stats: Optional[GenerationStats] = None) -> Iterator[Tuple[Scenario, dict]]:
+    """Create trips of all scenarios, sharing location index, calendar and skeletons of trips in between them.
+
+    Scenarios are grouped by seed and trip set, i.e. by `monthly_trip` and `seasonal_trip`, and yielded group by
+    group in order of first appearance. Per group, the skeleton and the locations and time stamps of its trips are
+    resolved once, and the state of the random generator after the draws of the skeleton is restored for the scatter
+    of each scenario, so each scenario equals
+    `create_synthetic_data_vectorized` with `rng=np.random.default_rng(seed)`, or with `noise=CounterNoise(seed)` if
+    `counter_noise` is set. With counter-based noise, scatter of a kind is the same in all scenarios of a seed which
+    apply it, so scenarios differ only by the toggled layers.
+
+    Args:
+        scenarios:              Scenarios to create, e.g. from `scenario_grid`
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        counter_noise:          Flag to indicate if draws come from counter-based noise instead of a random generator
+        stats:                  Optional collector of per-stage timings, summed over all scenarios
+
+    Yields:
+        Tuples of scenario and dict mapping each of `TRIP_COLUMNS`, followed by `LOCATION_ID_COLUMNS` if requested,
+        to an array with one entry per trip.
+    """
+    if schedule is None:
+        schedule = default_schedule()
+
+    groups: Dict[Tuple[int, bool, bool], List[Scenario]] = {}
+    for scenario in scenarios:
+        groups.setdefault((scenario.seed, scenario.monthly_trip, scenario.seasonal_trip), []).append(scenario)
+
+    # location index covering the locations of all trip sets of the sweep
+    with timed(stats, "location_index"):
+        required_pairs = set()
+        for _, monthly_trip, seasonal_trip in groups:
+            required_pairs.update(schedule.required_location_pairs(monthly_trip=monthly_trip,
+                                                                   seasonal_trip=seasonal_trip))
+        location_index = compile_location_index(known_locations=known_locations,
+                                                travel_time_dict=travel_time_dict,
+                                                required_pairs=required_pairs,
+                                                speed_model=speed_model)
+
+    calendar_start = month_start(start_date) if counter_noise else start_date
+
+    with timed(stats, "calendar") as stage:
+        calendar = build_calendar(start_date=calendar_start,
+                                  end_date=end_date,
+                                  additional_holidays=additional_holidays)
+        stage.rows = len(calendar.days)
+
+    column_names = TRIP_COLUMNS + LOCATION_ID_COLUMNS if location_ids else TRIP_COLUMNS
+    for (seed, monthly_trip, seasonal_trip), group in groups.items():
+        rng = np.random.default_rng(seed)
+        noise = CounterNoise(seed) if counter_noise else None
+
+        with timed(stats, "schedule") as stage:
+            skeleton = create_trip_skeleton(calendar=calendar,
+                                            schedule=schedule,
+                                            monthly_trip=monthly_trip,
+                                            seasonal_trip=seasonal_trip,
+                                            rng=rng,
+                                            noise=noise,
+                                            first_day=(start_date - calendar_start).days)
+            stage.rows = len(skeleton.template)
+        rng_state = rng.bit_generator.state
+        base = resolve_trip_base(skeleton=skeleton,
+                                 calendar=calendar,
+                                 schedule=schedule,
+                                 location_index=location_index,
+                                 stats=stats)
+        # draws of counter-based noise per stream, shared by all scenarios of group
+        draws = {}
+
+        for scenario in group:
+            rng.bit_generator.state = rng_state
+            columns = apply_trip_scatter(base=base,
+                                         location_scatter=scenario.location_scatter,
+                                         departure_time_scatter=scenario.departure_time_scatter,
+                                         travel_time_scatter=scenario.travel_time_scatter,
+                                         rng=rng,
+                                         stats=stats,
+                                         noise=noise,
+                                         draws=draws)
+            yield scenario, {name: columns[name] for name in column_names}
+
+
+def run_sweep(scenarios: Iterable[Scenario],
+              output_dir: str,
+              known_locations: List[dict],
+              travel_time_dict: Union[dict, np.ndarray, str],
+              additional_holidays=None,
+              start_date: datetime = datetime(year=2018, month=1, day=1),
+              end_date: datetime = datetime(year=2019, month=12, day=31),
+              schedule: Optional[SchedulePlan] = None,
+              speed_model: Optional[SpeedModel] = None,
+              location_ids: bool = False,
+              counter_noise: bool = False,
+              file_format: str = "parquet",
+              coordinates: str = "float32",
+              stats: Optional[GenerationStats] = None) -> List[dict]:
+    """Create trips of all scenarios and write each as a dataset named by its label, see `iter_sweep`.
+
+    Besides the datasets, `MANIFEST_FILE` lists the scenarios with their flags, seed, file name and number of trips.
+
+    Args:
+        output_dir:     Directory of datasets, created if missing
+        file_format:    Format of datasets, one of "csv", "parquet", "arrow" or "npz"
+        coordinates:    Type of coordinate columns of binary formats, see `compact_columns`
+
+    Returns:
+        Entries of manifest, one per scenario in order of creation.
+    """
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Unknown file format '{file_format}'.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = []
+    for scenario, columns in iter_sweep(scenarios=scenarios,
+                                        known_locations=known_locations,
+                                        travel_time_dict=travel_time_dict,
+                                        additional_holidays=additional_holidays,
+                                        start_date=start_date,
+                                        end_date=end_date,
+                                        schedule=schedule,
+                                        speed_model=speed_model,
+                                        location_ids=location_ids,
+                                        counter_noise=counter_noise,
+                                        stats=stats):
+        if file_format == "csv":
+            import pandas as pd
+
+            columns = pd.DataFrame(columns)
+        file_name = scenario.label + FILE_EXTENSIONS[file_format]
+        rows = write_trip_chunks(chunks=[columns],
+                                 path=os.path.join(output_dir, file_name),
+                                 file_format=file_format,
+                                 coordinates=coordinates,
+                                 stats=stats)
+        manifest.append(dict(scenario._asdict(), label=scenario.label, file=file_name, rows=rows))
+        if stats is not None:
+            stats.emit()
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"start_date": start_date.isoformat(),
+                   "end_date": end_date.isoformat(),
+                   "counter_noise": counter_noise,
+                   "scenarios": manifest}, f, indent=2)
+    return manifest
@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules of the repository are flat, import them from its root
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture(scope="session")
+def data_dir() -> str:
+    """Directory of example data of the repository."""
+    return os.path.join(ROOT_DIR, "data")
+
+
+@pytest.fixture(scope="session")
+def locations(data_dir) -> dict:
+    """Known locations and travel times of the example data, as keyword arguments of the creation functions."""
+    with open(os.path.join(data_dir, "known_locations.json"), "r") as f:
+        known_locations = json.load(f)["data"]
+    with open(os.path.join(data_dir, "travel_times.json"), "r") as f:
+        travel_time_dict = json.load(f)
+    return dict(known_locations=known_locations,
+                travel_time_dict=travel_time_dict)
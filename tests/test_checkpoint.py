@@ -0,0 +1,93 @@
+"""Regression tests of incremental extension of trip data from checkpoints."""
+import os
+import shutil
+from datetime import datetime
+
+import pytest
+
+import main
+from checkpoint import extend_synthetic_data
+
+
+@pytest.fixture(scope="module")
+def parameters(locations):
+    return dict(locations,
+                location_scatter=True,
+                departure_time_scatter=True,
+                travel_time_scatter=True,
+                monthly_trip=True,
+                seasonal_trip=True,
+                start_date=datetime(year=2018, month=1, day=1),
+                seed=7)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("intermediate_date", [datetime(year=2018, month=3, day=13),
+                                               datetime(year=2018, month=4, day=1)])
+def test_two_steps_equal_single_run(tmp_path, parameters, intermediate_date):
+    single = str(tmp_path / "single.csv")
+    extend_synthetic_data(path=single,
+                          checkpoint_path=str(tmp_path / "single.json"),
+                          end_date=datetime(year=2018, month=7, day=2),
+                          **parameters)
+
+    extended = str(tmp_path / "extended.csv")
+    for end_date in (intermediate_date, datetime(year=2018, month=7, day=2)):
+        extend_synthetic_data(path=extended,
+                              checkpoint_path=str(tmp_path / "extended.json"),
+                              end_date=end_date,
+                              **parameters)
+
+    assert _read(extended) == _read(single)
+
+
+def test_file_written_past_checkpoint_is_truncated(tmp_path, parameters):
+    single = str(tmp_path / "single.csv")
+    extend_synthetic_data(path=single,
+                          checkpoint_path=str(tmp_path / "single.json"),
+                          end_date=datetime(year=2018, month=7, day=2),
+                          **parameters)
+
+    path = str(tmp_path / "trips.csv")
+    checkpoint_path = str(tmp_path / "trips.json")
+    extend_synthetic_data(path=path,
+                          checkpoint_path=checkpoint_path,
+                          end_date=datetime(year=2018, month=3, day=13),
+                          **parameters)
+    # run which wrote its trips but was interrupted before saving its checkpoint
+    shutil.copy(checkpoint_path, checkpoint_path + ".bak")
+    extend_synthetic_data(path=path,
+                          checkpoint_path=checkpoint_path,
+                          end_date=datetime(year=2018, month=5, day=20),
+                          **parameters)
+    os.replace(checkpoint_path + ".bak", checkpoint_path)
+
+    checkpoint = extend_synthetic_data(path=path,
+                                       checkpoint_path=checkpoint_path,
+                                       end_date=datetime(year=2018, month=7, day=2),
+                                       **parameters)
+
+    assert _read(path) == _read(single)
+    assert checkpoint.file_size == os.path.getsize(single)
+
+
+def test_checkpoint_run_equals_run_without_checkpoint(tmp_path, data_dir):
+    arguments = ["--locations", os.path.join(data_dir, "known_locations.json"),
+                 "--travel-times", os.path.join(data_dir, "travel_times.json"),
+                 "--holidays", os.path.join(data_dir, "holidays.json"),
+                 "--start-date", "2018-01-17",
+                 "--seed", "1"]
+    plain = str(tmp_path / "plain.csv")
+    assert main.main(arguments + ["--end-date", "2018-05-09", "--output", plain]) == 0
+
+    extended = str(tmp_path / "extended.csv")
+    for end_date in ("2018-03-13", "2018-05-09"):
+        assert main.main(arguments + ["--end-date", end_date,
+                                      "--output", extended,
+                                      "--checkpoint", str(tmp_path / "extended.json")]) == 0
+
+    assert _read(extended) == _read(plain)
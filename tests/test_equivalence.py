@@ -0,0 +1,173 @@
+"""Regression tests of the claims that alternative engines create exactly the same trips as the reference ones."""
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import main
+from calendar_engine import create_synthetic_data_vectorized, month_windows
+from noise import CounterNoise
+from population import create_population_data, iter_population_data
+from sharding import create_sharded_data
+from sweep import iter_sweep, scenario_grid
+from trip_creation import create_synthetic_data
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FLAGS = dict(location_scatter=True,
+             departure_time_scatter=True,
+             travel_time_scatter=True,
+             monthly_trip=True,
+             seasonal_trip=True)
+
+
+@pytest.mark.parametrize("shard_months, n_workers", [(1, 1), (5, 1), (2, 3)])
+def test_sharded_equals_unsharded(locations, shard_months, n_workers):
+    parameters = dict(**locations,
+                      start_date=datetime(year=2018, month=1, day=17),
+                      end_date=datetime(year=2019, month=3, day=9),
+                      **FLAGS)
+
+    df_reference = create_synthetic_data(noise=CounterNoise(7), **parameters)
+    df_sharded = create_sharded_data(noise=CounterNoise(7),
+                                     shard_months=shard_months,
+                                     n_workers=n_workers,
+                                     **parameters)
+
+    assert list(df_sharded.columns) == list(df_reference.columns)
+    for name in df_reference.columns:
+        np.testing.assert_array_equal(df_sharded[name].to_numpy(), df_reference[name].to_numpy())
+
+
+@pytest.mark.parametrize("counter_noise", [False, True])
+def test_population_equal_for_any_number_of_workers(locations, counter_noise):
+    frames = [create_population_data(n_agents=10,
+                                     master_seed=5,
+                                     **locations,
+                                     start_date=datetime(year=2018, month=1, day=17),
+                                     end_date=datetime(year=2018, month=9, day=1),
+                                     n_workers=n_workers,
+                                     chunk_size=3,
+                                     counter_noise=counter_noise,
+                                     **FLAGS) for n_workers in (1, 3)]
+
+    assert frames[0]["agent_id"].nunique() == 10
+    assert list(frames[0].columns) == list(frames[1].columns)
+    for name in frames[0].columns:
+        np.testing.assert_array_equal(frames[0][name].to_numpy(), frames[1][name].to_numpy())
+
+
+@pytest.mark.parametrize("counter_noise", [False, True])
+def test_sweep_scenarios_equal_single_runs(locations, counter_noise):
+    parameters = dict(**locations,
+                      start_date=datetime(year=2018, month=1, day=17),
+                      end_date=datetime(year=2018, month=9, day=1),
+                      location_ids=True)
+
+    n_scenarios = 0
+    for scenario, columns in iter_sweep(scenarios=scenario_grid(seeds=(3, 7)),
+                                        counter_noise=counter_noise,
+                                        **parameters):
+        flags = scenario._asdict()
+        seed = flags.pop("seed")
+        random = dict(noise=CounterNoise(seed)) if counter_noise else dict(rng=np.random.default_rng(seed))
+        df_reference = create_synthetic_data_vectorized(**random, **flags, **parameters)
+
+        assert list(columns) == list(df_reference.columns)
+        for name in df_reference.columns:
+            np.testing.assert_array_equal(columns[name], df_reference[name].to_numpy(), err_msg=scenario.label)
+        n_scenarios += 1
+    assert n_scenarios == 64
+
+
+def test_interleaved_populations_do_not_share_state(locations):
+    ranges = [(datetime(year=2018, month=1, day=1), datetime(year=2018, month=3, day=1)),
+              (datetime(year=2019, month=5, day=17), datetime(year=2019, month=8, day=1))]
+    parameters = [dict(n_agents=4,
+                       master_seed=5,
+                       **locations,
+                       start_date=start_date,
+                       end_date=end_date,
+                       n_workers=1,
+                       chunk_size=1,
+                       **FLAGS) for start_date, end_date in ranges]
+
+    interleaved = zip(*[iter_population_data(**p) for p in parameters])
+    for chunks, p in zip(zip(*interleaved), parameters):
+        df_reference = create_population_data(**p)
+        for name in df_reference.columns:
+            np.testing.assert_array_equal(np.concatenate([chunk[name].to_numpy() for chunk in chunks]),
+                                          df_reference[name].to_numpy())
+
+
+def test_month_windows_reject_empty_windows():
+    with pytest.raises(ValueError):
+        list(month_windows(start_date=datetime(year=2018, month=1, day=1),
+                           end_date=datetime(year=2018, month=3, day=1),
+                           chunk_months=0))
+
+
+def test_numpy_engine_equals_streaming_engine(tmp_path, data_dir):
+    paths = {}
+    for engine in ("streaming", "numpy"):
+        paths[engine] = str(tmp_path / f"{engine}.npz")
+        assert main.main(["--locations", os.path.join(data_dir, "known_locations.json"),
+                          "--travel-times", os.path.join(data_dir, "travel_times.json"),
+                          "--holidays", os.path.join(data_dir, "holidays.json"),
+                          "--start-date", "2018-01-17",
+                          "--end-date", "2019-03-09",
+                          "--seed", "7",
+                          "--engine", engine,
+                          "--format", "npz",
+                          "--output", paths[engine]]) == 0
+
+    with np.load(paths["streaming"]) as streaming, np.load(paths["numpy"]) as numpy_engine:
+        assert streaming.files == numpy_engine.files
+        for name in streaming.files:
+            assert streaming[name].dtype == numpy_engine[name].dtype
+            assert streaming[name].tobytes() == numpy_engine[name].tobytes()
+
+
+# compares day loop and vectorized engine with the same counter-based noise, run in a fresh process per time zone
+# since UTC offsets are cached per process
+LOOP_EQUALS_VECTORIZED = """
+import json
+from datetime import datetime
+
+from noise import CounterNoise
+from population import create_population_data, iter_population_data
+from trip_creation import create_synthetic_data
+
+with open("data/known_locations.json", "r") as f:
+    known_locations = json.load(f)["data"]
+with open("data/travel_times.json", "r") as f:
+    travel_time_dict = json.load(f)
+frames = [create_synthetic_data(known_locations=known_locations,
+                                travel_time_dict=travel_time_dict,
+                                location_scatter=True,
+                                departure_time_scatter=True,
+                                travel_time_scatter=True,
+                                monthly_trip=True,
+                                seasonal_trip=True,
+                                start_date=datetime(year=2018, month=1, day=17),
+                                end_date=datetime(year=2019, month=11, day=9),
+                                vectorized=vectorized,
+                                noise=CounterNoise(7)) for vectorized in (False, True)]
+assert len(frames[0]) > 0
+assert list(frames[0].columns) == list(frames[1].columns)
+for name in frames[0].columns:
+    assert frames[0][name].to_numpy().tobytes() == frames[1][name].to_numpy().tobytes(), name
+"""
+
+
+@pytest.mark.parametrize("time_zone", ["Europe/Berlin", "America/New_York", "Australia/Lord_Howe"])
+def test_loop_equals_vectorized_with_counter_noise(time_zone):
+    result = subprocess.run([sys.executable, "-c", LOOP_EQUALS_VECTORIZED],
+                            cwd=ROOT_DIR,
+                            env=dict(os.environ, TZ=time_zone),
+                            capture_output=True,
+                            text=True)
+    assert result.returncode == 0, result.stderr
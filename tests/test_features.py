@@ -0,0 +1,60 @@
+"""Regression tests of the claim that stop features of chunked trips equal those of the whole trip data."""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from features import DwellFeatureExtractor, iter_dwell_features
+from population import create_population_data
+
+
+@pytest.fixture(scope="module")
+def trips(locations):
+    df = create_population_data(n_agents=4,
+                                master_seed=5,
+                                **locations,
+                                location_scatter=True,
+                                departure_time_scatter=True,
+                                travel_time_scatter=True,
+                                monthly_trip=True,
+                                seasonal_trip=True,
+                                start_date=datetime(year=2018, month=1, day=1),
+                                end_date=datetime(year=2018, month=5, day=1),
+                                location_ids=True)
+    return {name: df[name].to_numpy() for name in df.columns}
+
+
+def assert_features_equal(chunks, reference):
+    assert all(list(chunk) == list(reference) for chunk in chunks)
+    for name in reference:
+        np.testing.assert_array_equal(np.concatenate([chunk[name] for chunk in chunks]), reference[name], err_msg=name)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 333])
+def test_chunked_equals_whole(trips, chunk_size):
+    reference = DwellFeatureExtractor(window=3).transform(trips)
+    assert len(reference["trip_id"]) > 0
+
+    n = len(trips["t_start"])
+    chunks = list(iter_dwell_features(({name: values[i:i + chunk_size] for name, values in trips.items()}
+                                       for i in range(0, n, chunk_size)),
+                                      window=3))
+    assert_features_equal(chunks, reference)
+
+
+def test_stay_spanning_chunk_boundary(trips):
+    reference = DwellFeatureExtractor().transform(trips)
+
+    # split right after the arriving trip of a stay, so its departure is the first trip of the second chunk
+    stop = 5
+    split = reference["trip_id"][stop] + 1
+    assert trips["agent_id"][split - 1] == trips["agent_id"][split]
+    extractor = DwellFeatureExtractor()
+    first = extractor.transform({name: values[:split] for name, values in trips.items()})
+    second = extractor.transform({name: values[split:] for name, values in trips.items()})
+
+    assert split - 1 not in first["trip_id"]
+    assert second["trip_id"][0] == split - 1
+    assert second["t_departure"][0] == trips["t_start"][split]
+    assert second["parking_duration"][0] == (trips["t_start"][split] - trips["t_end"][split - 1]) / 1000
+    assert_features_equal([first, second], reference)
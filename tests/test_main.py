@@ -0,0 +1,28 @@
+"""Regression tests of checks of command line arguments and config files."""
+import json
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("argv", [["--seed", "-1"],
+                                  ["--agents", "0"],
+                                  ["--agents", "-2"],
+                                  ["--workers", "0"],
+                                  ["--chunk-size", "0"],
+                                  ["--engine", "sharded", "--shard-months", "0"]])
+def test_invalid_values_are_rejected(tmp_path, argv):
+    with pytest.raises(SystemExit):
+        main.parse_args(argv)
+
+    config_path = str(tmp_path / "config.json")
+    with open(config_path, "w") as f:
+        json.dump({argv[-2].lstrip("-").replace("-", "_"): int(argv[-1])}, f)
+    with pytest.raises(SystemExit):
+        main.parse_args(["--config", config_path])
+
+
+def test_valid_values_are_accepted():
+    args = main.parse_args(["--seed", "0", "--agents", "2", "--workers", "1", "--chunk-size", "1"])
+    assert (args.seed, args.agents, args.workers, args.chunk_size) == (0, 2, 1, 1)
@@ -0,0 +1,16 @@
+"""Regression tests of counter-based noise."""
+import numpy as np
+import pytest
+
+from noise import CounterNoise
+
+
+def test_negative_seed_is_rejected():
+    with pytest.raises(ValueError):
+        CounterNoise(-1)
+
+
+def test_large_seed_is_folded():
+    days = np.arange(10)
+    assert CounterNoise(2 ** 70 + 5).normal(days, 0, 0).shape == (10,)
+    assert not np.array_equal(CounterNoise(2 ** 70 + 5).normal(days, 0, 0), CounterNoise(5).normal(days, 0, 0))
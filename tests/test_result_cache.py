@@ -0,0 +1,56 @@
+"""Regression tests of the result cache of trip data."""
+import os
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import result_cache
+from result_cache import ResultCache, cached_synthetic_data
+
+
+@pytest.fixture(scope="module")
+def parameters(locations):
+    return dict(locations,
+                location_scatter=True,
+                departure_time_scatter=True,
+                travel_time_scatter=True,
+                monthly_trip=True,
+                seasonal_trip=True,
+                start_date=datetime(year=2018, month=1, day=1),
+                end_date=datetime(year=2018, month=3, day=1))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    df = pd.DataFrame({"t_start": range(1000)})
+    cache = ResultCache(str(tmp_path))
+    for i, key in enumerate("abc"):
+        cache.put(key, df)
+        # distinct access times regardless of the resolution of the file system
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    entry_size = cache.size() // 3
+
+    assert cache.get("a") is not None
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.size() <= cache.max_bytes
+
+
+def test_hits_and_misses(tmp_path, parameters, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    df_trips = cached_synthetic_data(cache=cache, seed=7, **parameters)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # hit returns stored trips without creating them again
+    monkeypatch.setattr(result_cache, "iter_synthetic_data", None)
+    pd.testing.assert_frame_equal(cached_synthetic_data(cache=cache, seed=7, **parameters), df_trips)
+    monkeypatch.undo()
+
+    # other seed and other version of generated data miss
+    cached_synthetic_data(cache=cache, seed=8, **parameters)
+    assert len(os.listdir(tmp_path)) == 2
+    monkeypatch.setattr(result_cache, "CACHE_VERSION", result_cache.CACHE_VERSION + 1)
+    cached_synthetic_data(cache=cache, seed=7, **parameters)
+    assert len(os.listdir(tmp_path)) == 3
@@ -0,0 +1,81 @@
+"""Tests of the trip service with a local HTTP client."""
+import asyncio
+import io
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from holiday_calendar import HolidayCalendar
+from noise import CounterNoise
+from server import TripService
+from trip_creation import create_synthetic_data
+
+
+@pytest.fixture(scope="module")
+def parameters(locations, data_dir):
+    return dict(locations,
+                additional_holidays=HolidayCalendar.from_file(os.path.join(data_dir, "holidays.json")))
+
+
+@pytest.fixture(scope="module")
+def base_url(parameters):
+    service = TripService(n_workers=1, **parameters)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(service.start(port=0))
+    port = server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{port}"
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    service.close()
+
+
+def _get(url: str) -> bytes:
+    with urllib.request.urlopen(url, timeout=60) as response:
+        assert response.status == 200
+        return response.read()
+
+
+def _reference(parameters: dict) -> pd.DataFrame:
+    return create_synthetic_data(location_scatter=True,
+                                 departure_time_scatter=True,
+                                 travel_time_scatter=True,
+                                 monthly_trip=True,
+                                 seasonal_trip=True,
+                                 start_date=datetime(year=2018, month=11, day=10),
+                                 end_date=datetime(year=2019, month=3, day=1),
+                                 noise=CounterNoise(seed=7, agent_id=42),
+                                 **parameters)
+
+
+def test_csv_equals_create_synthetic_data(base_url, parameters):
+    body = _get(f"{base_url}/trips?seed=7&agent=42&start=2018-11-10&end=2019-03-01&format=csv")
+    expected = io.StringIO()
+    _reference(parameters).to_csv(expected, index=False)
+    assert body == expected.getvalue().encode()
+
+
+def test_ndjson_equals_create_synthetic_data(base_url, parameters):
+    body = _get(f"{base_url}/trips?seed=7&agent=42&start=2018-11-10&end=2019-03-01&format=ndjson")
+    df = pd.DataFrame([json.loads(line) for line in body.decode().splitlines()])
+    pd.testing.assert_frame_equal(df, _reference(parameters), check_exact=True)
+
+
+@pytest.mark.parametrize("path, status", [("/trips?month=2019-03", 400),
+                                          ("/trips?seed=-1&month=2019-03", 400),
+                                          ("/trips?seed=1&agent=-1&month=2019-03", 400),
+                                          ("/trips?seed=1&month=2019-13", 400),
+                                          ("/trips?seed=1&month=2019-03&format=xlsx", 400),
+                                          ("/unknown", 404)])
+def test_errors(base_url, path, status):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        _get(base_url + path)
+    assert error.value.code == status
@@ -0,0 +1,76 @@
+"""Regression tests of densification of trips into GPS traces."""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from traces import iter_trace_chunks, trace_point_counts, write_trace_chunks, write_trace_memmap
+from trip_creation import create_synthetic_data
+from writers import compact_columns
+
+
+@pytest.fixture(scope="module")
+def df_trips(locations):
+    return create_synthetic_data(**locations,
+                                 location_scatter=True,
+                                 departure_time_scatter=True,
+                                 travel_time_scatter=True,
+                                 monthly_trip=True,
+                                 seasonal_trip=True,
+                                 start_date=datetime(year=2018, month=1, day=1),
+                                 end_date=datetime(year=2018, month=2, day=1),
+                                 rng=np.random.default_rng(7))
+
+
+def test_points_span_trips(df_trips):
+    interval = 6e4
+    chunks = list(iter_trace_chunks(trip_chunks=[df_trips.iloc[:20], df_trips.iloc[20:]],
+                                    interval=interval,
+                                    rng=np.random.default_rng(3),
+                                    max_points=100))
+    assert all(len(chunk["t"]) <= 100 for chunk in chunks)
+    trip_id = np.concatenate([chunk["trip_id"] for chunk in chunks])
+    t = np.concatenate([chunk["t"] for chunk in chunks])
+
+    counts = trace_point_counts(t_start=df_trips["t_start"].to_numpy(),
+                                t_end=df_trips["t_end"].to_numpy(),
+                                interval=interval)
+    np.testing.assert_array_equal(np.bincount(trip_id, minlength=len(df_trips)), counts)
+    first = np.cumsum(counts) - counts
+    np.testing.assert_array_equal(t[first], df_trips["t_start"].to_numpy())
+    np.testing.assert_array_equal(t[first + counts - 1], df_trips["t_end"].to_numpy())
+    assert (np.diff(t)[np.diff(trip_id) == 0] > 0).all()
+
+
+def test_memmap_equals_chunks(tmp_path, df_trips):
+    n_points = write_trace_memmap(trips=df_trips,
+                                  directory=str(tmp_path / "traces"),
+                                  coordinates="float64",
+                                  rng=np.random.default_rng(3),
+                                  max_points=100)
+    chunks = [compact_columns(chunk, coordinates="float64") for chunk in iter_trace_chunks(
+        trip_chunks=[df_trips], rng=np.random.default_rng(3), max_points=100)]
+
+    for name in chunks[0]:
+        array = np.load(str(tmp_path / "traces" / f"{name}.npy"), mmap_mode="r")
+        assert len(array) == n_points
+        np.testing.assert_array_equal(array, np.concatenate([chunk[name] for chunk in chunks]))
+
+
+def test_unsupported_format_keeps_file(tmp_path, df_trips):
+    path = tmp_path / "traces.csv"
+    path.write_text("existing")
+    with pytest.raises(ValueError):
+        write_trace_chunks(trip_chunks=[df_trips], path=str(path))
+    assert path.read_text() == "existing"
+
+
+@pytest.mark.parametrize("interval", [0.0, -6e4])
+def test_non_positive_interval_rejected(tmp_path, df_trips, interval):
+    with pytest.raises(ValueError):
+        trace_point_counts(t_start=df_trips["t_start"].to_numpy(),
+                           t_end=df_trips["t_end"].to_numpy(),
+                           interval=interval)
+    with pytest.raises(ValueError):
+        write_trace_memmap(trips=df_trips, directory=str(tmp_path / "traces"), interval=interval)
+    assert not (tmp_path / "traces").exists()
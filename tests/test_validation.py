@@ -0,0 +1,71 @@
+"""Regression tests of validation of trip data files written in compact formats."""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from population import create_population_data
+from trip_creation import create_synthetic_data
+from validation import iter_trip_file, repair_trips, validate_trip_chunks, validate_trips
+from writers import write_trip_chunks
+
+
+@pytest.fixture(scope="module")
+def df_trips(locations):
+    return create_synthetic_data(**locations,
+                                 location_scatter=True,
+                                 departure_time_scatter=True,
+                                 travel_time_scatter=True,
+                                 monthly_trip=True,
+                                 seasonal_trip=True,
+                                 start_date=datetime(year=2018, month=1, day=1),
+                                 end_date=datetime(year=2018, month=3, day=1),
+                                 rng=np.random.default_rng(7),
+                                 repair=True)
+
+
+@pytest.mark.parametrize("file_format", ["npz", "parquet"])
+def test_scaled_int_coordinates_validate_like_csv(tmp_path, df_trips, file_format):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+    csv_path = str(tmp_path / "trips.csv")
+    write_trip_chunks(chunks=[df_trips], path=csv_path)
+    report_csv = validate_trip_chunks(iter_trip_file(csv_path))
+    assert report_csv.ok
+
+    path = str(tmp_path / f"trips.{file_format}")
+    write_trip_chunks(chunks=[df_trips], path=path, file_format=file_format, coordinates="scaled_int")
+    chunks = list(iter_trip_file(path))
+    np.testing.assert_allclose(np.concatenate([chunk["gps_start_lat"] for chunk in chunks]),
+                               df_trips["gps_start_lat"].to_numpy(), atol=1e-6)
+
+    report = validate_trip_chunks(chunks)
+    assert report.n_rows == len(df_trips)
+    assert report.counts() == report_csv.counts()
+
+
+def test_repair_of_agents_at_once_equals_repair_per_agent(locations):
+    df = create_population_data(n_agents=4,
+                                master_seed=5,
+                                **locations,
+                                location_scatter=True,
+                                departure_time_scatter=True,
+                                travel_time_scatter=True,
+                                monthly_trip=True,
+                                seasonal_trip=True,
+                                start_date=datetime(year=2018, month=1, day=1),
+                                end_date=datetime(year=2018, month=3, day=1),
+                                location_ids=True)
+    trips = {name: df[name].to_numpy(copy=True) for name in df.columns}
+    # stretch every fifth trip into the next ones, including the last trips of agents
+    trips["t_end"][::5] += 2 * 86400e3
+    assert validate_trips(trips).counts()["overlap"] > 0
+
+    repaired = repair_trips(trips, min_gap=6e4)
+    assert validate_trips(repaired).counts()["overlap"] == 0
+    for agent_id in np.unique(trips["agent_id"]):
+        rows = trips["agent_id"] == agent_id
+        reference = repair_trips({name: values[rows] for name, values in trips.items()}, min_gap=6e4)
+        assert reference["t_start"][0] == trips["t_start"][rows][0]
+        for name in reference:
+            np.testing.assert_allclose(repaired[name][rows], reference[name], rtol=0, atol=1e-3, err_msg=name)
@@ -0,0 +1,33 @@
+"""Regression tests of incremental writers of trip data."""
+import numpy as np
+
+from writers import NpzTripWriter, compact_columns
+
+
+def test_npz_chunks_equal_concatenated_columns(tmp_path):
+    rng = np.random.default_rng(3)
+    chunks = [{"t_start": rng.uniform(0, 1e12, n), "gps_start_lat": rng.uniform(-90, 90, n)} for n in (5, 0, 17)]
+    path = str(tmp_path / "trips.npz")
+    with NpzTripWriter(path, coordinates="scaled_int") as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    expected = compact_columns({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]},
+                               coordinates="scaled_int")
+    with np.load(path) as data:
+        assert data.files == list(expected)
+        for name, values in expected.items():
+            assert data[name].dtype == values.dtype
+            np.testing.assert_array_equal(data[name], values)
+    assert writer.rows_written == 22
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["trips.npz"]
+
+
+def test_npz_without_chunks_has_empty_typed_columns(tmp_path):
+    path = str(tmp_path / "trips.npz")
+    NpzTripWriter(path).close()
+
+    with np.load(path) as data:
+        assert len(data["t_start"]) == 0
+        assert data["t_start"].dtype == np.int64
+        assert data["gps_start_lat"].dtype == np.float32
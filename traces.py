@@ -0,0 +1,267 @@
+"""Module providing densification of trips into GPS traces, i.e. timestamped points along the path of each trip.
+
+Points are sampled at a fixed interval from start to end of a trip, along a path which bows to one side of the
+straight line by a random amount per trip, mimicking the detour of roads, and get scatter per point like GPS fixes.
+Trips are densified in batches of bounded numbers of points, which are written one by one to a chunked columnar
+file or into preallocated memory-mapped arrays, so traces of any size are created in bounded memory.
+"""
+import os
+from typing import TYPE_CHECKING, Iterable, Iterator, Mapping, Optional, Union
+
+import numpy as np
+
+from location_index import EARTH_RADIUS
+from profiling import GenerationStats, timed
+from writers import compact_columns, infer_file_format, open_trip_writer
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# columns of GPS traces, in output order; traces of population data are preceded by "agent_id"
+TRACE_COLUMNS = ("trip_id",
+                 "t",
+                 "gps_lat",
+                 "gps_lon")
+
+# distance of one degree of latitude in meters
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+def trace_point_counts(t_start: np.ndarray,
+                       t_end: np.ndarray,
+                       interval: float) -> np.ndarray:
+    """Number of points per trip, one per started sampling interval plus the end point.
+
+    Args:
+        t_start:    Start times of trips in milliseconds
+        t_end:      End times of trips in milliseconds
+        interval:   Sampling interval in milliseconds
+
+    Returns:
+        Array of number of points per trip.
+
+    Raises:
+        ValueError: If `interval` is not positive, as points would not advance along a trip.
+    """
+    if not interval > 0:
+        raise ValueError(f"Sampling interval has to be positive, got {interval}.")
+    duration = np.maximum(np.asarray(t_end, dtype=np.float64) - np.asarray(t_start, dtype=np.float64), 0.0)
+    return np.ceil(duration / interval).astype(np.int64) + 1
+
+
+def densify_trips(trips: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                  interval: float = 1e4,
+                  gps_sigma: float = 5.0,
+                  path_bow: float = 0.1,
+                  rng: Optional[np.random.Generator] = None,
+                  first_trip_id: int = 0) -> dict:
+    """Expand trips into GPS traces, evaluated for all trips at once.
+
+    Args:
+        trips:          Dataframe of trips or dict mapping column names to arrays, with the columns of
+                        `create_synthetic_data` and optionally "agent_id"
+        interval:       Sampling interval in milliseconds
+        gps_sigma:      Standard deviation of scatter per point in meters
+        path_bow:       Standard deviation of maximum deviation of path from straight line, relative to its length
+        rng:            Optional random generator, global NumPy random state if not given
+        first_trip_id:  ID of first trip, e.g. its row in the whole trip data
+
+    Returns:
+        Dict mapping each of `TRACE_COLUMNS`, preceded by "agent_id" if given, to an array with one entry per point.
+        Points are ordered by trip and time, the first and last point of a trip are at its start and end time.
+    """
+    if rng is None:
+        rng = np.random
+
+    t_start = np.asarray(trips["t_start"], dtype=np.float64)
+    t_end = np.asarray(trips["t_end"], dtype=np.float64)
+    start_lat = np.asarray(trips["gps_start_lat"], dtype=np.float64)
+    start_lon = np.asarray(trips["gps_start_lon"], dtype=np.float64)
+    delta_lat = np.asarray(trips["gps_end_lat"], dtype=np.float64) - start_lat
+    delta_lon = np.asarray(trips["gps_end_lon"], dtype=np.float64) - start_lon
+
+    # index of trip and of sampling interval within trip per point
+    counts = trace_point_counts(t_start=t_start,
+                                t_end=t_end,
+                                interval=interval)
+    trip = np.repeat(np.arange(len(counts)), counts)
+    step = np.arange(len(trip)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    t = np.minimum(t_start[trip] + step * interval, t_end[trip])
+    duration = (t_end - t_start)[trip]
+    fraction = np.divide(t - t_start[trip], duration, out=np.zeros(len(trip)), where=duration > 0)
+
+    # path bows along parabola, perpendicular to straight line in local metric coordinates
+    cos_lat = np.cos(np.radians(start_lat + delta_lat / 2))
+    bow = (rng.standard_normal(len(counts)) * path_bow)[trip] * 4 * fraction * (1 - fraction)
+    lat = start_lat[trip] + fraction * delta_lat[trip] + bow * delta_lon[trip] * cos_lat[trip]
+    lon = start_lon[trip] + fraction * delta_lon[trip] - bow * delta_lat[trip] / cos_lat[trip]
+
+    if gps_sigma:
+        scatter = rng.standard_normal((2, len(trip))) * gps_sigma / METERS_PER_DEGREE
+        lat += scatter[0]
+        lon += scatter[1] / cos_lat[trip]
+
+    columns = {}
+    if "agent_id" in trips:
+        columns["agent_id"] = np.asarray(trips["agent_id"])[trip]
+    columns.update(trip_id=trip + first_trip_id,
+                   t=t,
+                   gps_lat=lat,
+                   gps_lon=lon)
+    return columns
+
+
+def iter_trace_chunks(trip_chunks: Iterable[Union["pd.DataFrame", Mapping[str, np.ndarray]]],
+                      interval: float = 1e4,
+                      gps_sigma: float = 5.0,
+                      path_bow: float = 0.1,
+                      rng: Optional[np.random.Generator] = None,
+                      max_points: int = 1 << 20,
+                      stats: Optional[GenerationStats] = None) -> Iterator[dict]:
+    """Expand chunks of trips into GPS traces, yielding batches of at most `max_points` points.
+
+    Trips are numbered consecutively over all chunks, so trip IDs are the rows of the whole trip data.
+
+    Args:
+        trip_chunks:    Iterable of Dataframes or dicts of columns, e.g. from `iter_synthetic_data`
+        interval:       Sampling interval in milliseconds
+        gps_sigma:      Standard deviation of scatter per point in meters
+        path_bow:       Standard deviation of maximum deviation of path from straight line, relative to its length
+        rng:            Optional random generator, global NumPy random state if not given
+        max_points:     Number of points per batch, exceeded only by single trips with more points
+        stats:          Optional collector of per-stage timings, densification is timed as stage "densify"
+
+    Yields:
+        Dicts of columns as returned by `densify_trips`.
+    """
+    first_trip_id = 0
+    for chunk in trip_chunks:
+        trips = {name: np.asarray(chunk[name]) for name in chunk}
+        counts = trace_point_counts(t_start=trips["t_start"],
+                                    t_end=trips["t_end"],
+                                    interval=interval)
+        cumulative = np.cumsum(counts)
+        start = 0
+        while start < len(counts):
+            # largest batch of trips within `max_points`, at least one trip
+            offset = cumulative[start - 1] if start else 0
+            end = max(int(np.searchsorted(cumulative, offset + max_points, side="right")), start + 1)
+            with timed(stats, "densify", rows=int(cumulative[end - 1] - offset)):
+                columns = densify_trips(trips={name: values[start:end] for name, values in trips.items()},
+                                        interval=interval,
+                                        gps_sigma=gps_sigma,
+                                        path_bow=path_bow,
+                                        rng=rng,
+                                        first_trip_id=first_trip_id + start)
+            yield columns
+            start = end
+        first_trip_id += len(counts)
+
+
+def write_trace_chunks(trip_chunks: Iterable[Union["pd.DataFrame", Mapping[str, np.ndarray]]],
+                       path: str,
+                       file_format: Optional[str] = None,
+                       coordinates: str = "float32",
+                       interval: float = 1e4,
+                       gps_sigma: float = 5.0,
+                       path_bow: float = 0.1,
+                       rng: Optional[np.random.Generator] = None,
+                       max_points: int = 1 << 20,
+                       stats: Optional[GenerationStats] = None) -> int:
+    """Expand chunks of trips into GPS traces, written batch by batch to a Parquet or Arrow file in compact schema.
+
+    Args:
+        trip_chunks:    Iterable of Dataframes or dicts of columns, e.g. from `iter_synthetic_data`
+        path:           Path of output file
+        file_format:    Optional format, "parquet" or "arrow", inferred from file extension if not given
+        coordinates:    Type of coordinate columns, see `compact_columns`
+        interval:       Sampling interval in milliseconds
+        gps_sigma:      Standard deviation of scatter per point in meters
+        path_bow:       Standard deviation of maximum deviation of path from straight line, relative to its length
+        rng:            Optional random generator, global NumPy random state if not given
+        max_points:     Number of points per batch, i.e. per row group or record batch
+        stats:          Optional collector of per-stage timings, writing is timed as stage "write"
+
+    Returns:
+        Number of points written.
+
+    Raises:
+        ValueError: If the format is neither Parquet nor Arrow, checked before the file is opened.
+    """
+    if file_format is None:
+        file_format = infer_file_format(path)
+    if file_format not in ("parquet", "arrow"):
+        raise ValueError("GPS traces are written as Parquet or Arrow files, or as memory-mapped arrays.")
+
+    with open_trip_writer(path=path,
+                          file_format=file_format,
+                          coordinates=coordinates) as writer:
+        for columns in iter_trace_chunks(trip_chunks=trip_chunks,
+                                         interval=interval,
+                                         gps_sigma=gps_sigma,
+                                         path_bow=path_bow,
+                                         rng=rng,
+                                         max_points=max_points,
+                                         stats=stats):
+            with timed(stats, "write", rows=len(columns["t"])):
+                writer.write(columns)
+    return writer.rows_written
+
+
+def write_trace_memmap(trips: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                       directory: str,
+                       coordinates: str = "float32",
+                       interval: float = 1e4,
+                       gps_sigma: float = 5.0,
+                       path_bow: float = 0.1,
+                       rng: Optional[np.random.Generator] = None,
+                       max_points: int = 1 << 20,
+                       stats: Optional[GenerationStats] = None) -> int:
+    """Expand trips into GPS traces, written batch by batch into memory-mapped `.npy` files, one per column.
+
+    The number of points is known from the trips in advance, hence all files are preallocated at their final size
+    and can be loaded with `np.load(path, mmap_mode="r")`.
+
+    Args:
+        trips:          Dataframe of trips or dict mapping column names to arrays, e.g. from `create_synthetic_data`
+        directory:      Directory of column files, created if missing
+        coordinates:    Type of coordinate columns, see `compact_columns`
+        interval:       Sampling interval in milliseconds
+        gps_sigma:      Standard deviation of scatter per point in meters
+        path_bow:       Standard deviation of maximum deviation of path from straight line, relative to its length
+        rng:            Optional random generator, global NumPy random state if not given
+        max_points:     Number of points per batch
+        stats:          Optional collector of per-stage timings, writing is timed as stage "write"
+
+    Returns:
+        Number of points written.
+    """
+    n_points = int(trace_point_counts(t_start=trips["t_start"],
+                                      t_end=trips["t_end"],
+                                      interval=interval).sum())
+    names = (("agent_id",) if "agent_id" in trips else ()) + TRACE_COLUMNS
+    dtypes = compact_columns({name: np.empty(0) for name in names}, coordinates=coordinates)
+
+    os.makedirs(directory, exist_ok=True)
+    arrays = {name: np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"),
+                                              mode="w+",
+                                              dtype=empty.dtype,
+                                              shape=(n_points,)) for name, empty in dtypes.items()}
+    offset = 0
+    for columns in iter_trace_chunks(trip_chunks=[trips],
+                                     interval=interval,
+                                     gps_sigma=gps_sigma,
+                                     path_bow=path_bow,
+                                     rng=rng,
+                                     max_points=max_points,
+                                     stats=stats):
+        n = len(columns["t"])
+        with timed(stats, "write", rows=n):
+            for name, values in compact_columns(columns, coordinates=coordinates).items():
+                arrays[name][offset:offset + n] = values
+        offset += n
+
+    for array in arrays.values():
+        array.flush()
+    return n_points
@@ -1,15 +1,24 @@
 """Module containing main logic to create sequence of trips."""
 from datetime import datetime, timedelta
-from typing import List
+from typing import Iterator, List, Optional, Union
 
 import numpy as np
 import pandas as pd
 
-from utils import append_trip
+from calendar_engine import create_synthetic_data_vectorized, month_start, month_windows
+from holiday_calendar import HolidayCalendar
+from location_index import SpeedModel, compile_location_index
+from noise import CounterNoise, OPTION_STREAM, TRIP_STREAMS
+from profiling import GenerationStats, timed
+from schedule import SchedulePlan, default_schedule
+from utils import TripBuffer, append_trip
+from validation import repair_trips
+
+_EPOCH = datetime(year=1970, month=1, day=1)
 
 
 def create_synthetic_data(known_locations: List[dict],
-                          travel_time_dict: dict,
+                          travel_time_dict: Union[dict, np.ndarray, str],
                           location_scatter: bool,
                           departure_time_scatter: bool,
                           travel_time_scatter: bool,
@@ -17,20 +26,37 @@ def create_synthetic_data(known_locations: List[dict],
                           seasonal_trip: bool,
                           additional_holidays=None,
                           start_date: datetime = datetime(year=2018, month=1, day=1),
-                          end_date: datetime = datetime(year=2019, month=12, day=31)) -> pd.DataFrame:
+                          end_date: datetime = datetime(year=2019, month=12, day=31),
+                          vectorized: bool = False,
+                          rng: Optional[np.random.Generator] = None,
+                          schedule: Optional[SchedulePlan] = None,
+                          speed_model: Optional[SpeedModel] = None,
+                          stats: Optional[GenerationStats] = None,
+                          noise: Optional[CounterNoise] = None,
+                          repair: bool = False) -> pd.DataFrame:
     """Main logic to create sequence of trips given the passed parameters.
 
     Args:
         known_locations:        List of JSON representing locations
-        travel_time_dict:       Matrix (as JSON) for travel times in between locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
         location_scatter:       Flag to indicate if location scatter should be applied
         departure_time_scatter: Flag to indicate if departure time scatter should be applied
         travel_time_scatter:    Flag to indicate if travel time scatter should be applied
         monthly_trip:           Flag to indicate if monthly trips should be included
         seasonal_trip:          Flag to indicate if seasonal trips should be included
-        additional_holidays:    Optional list of holidays, e.g. from user's calendar etc.
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
         start_date:             First day of relevant time range
         end_date:               Last day of relevant time range
+        vectorized:             Flag to indicate if whole time range should be evaluated at once instead of day by day
+        rng:                    Optional random generator, global NumPy random state if not given
+        schedule:               Optional compiled schedule plan, default schedule from `data/schedule.json` if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        stats:                  Optional collector of per-stage timings, emitted once the Dataframe is assembled
+        noise:                  Optional counter-based noise keyed on day and slot, used instead of `rng` if given;
+                                any time range then yields exactly the trips of that range in a longer run
+        repair:                 Flag to indicate if overlapping trips and scattered start points of parked cars should
+                                be resolved, see `validation.repair_trips`
 
     Returns:
         Dataframe containing sequence of trips, one trip per row.
@@ -42,323 +68,204 @@ def create_synthetic_data(known_locations: List[dict],
             "gps_end_lat":      Latitude of GPS position at end of trip
             "gps_end_lon":      Longitude of GPS position at end of trip
     """
-    if additional_holidays is None:
-        additional_holidays = []
-
-    # initialize dataframe
-    df_trips = pd.DataFrame(columns=["gps_start_lat",
-                                     "gps_start_lon",
-                                     "t_start",
-                                     "t_end",
-                                     "gps_end_lat",
-                                     "gps_end_lon"])
+    if vectorized:
+        return create_synthetic_data_vectorized(known_locations=known_locations,
+                                                travel_time_dict=travel_time_dict,
+                                                location_scatter=location_scatter,
+                                                departure_time_scatter=departure_time_scatter,
+                                                travel_time_scatter=travel_time_scatter,
+                                                monthly_trip=monthly_trip,
+                                                seasonal_trip=seasonal_trip,
+                                                additional_holidays=additional_holidays,
+                                                start_date=start_date,
+                                                end_date=end_date,
+                                                rng=rng,
+                                                schedule=schedule,
+                                                speed_model=speed_model,
+                                                stats=stats,
+                                                noise=noise,
+                                                repair=repair)
+
+    if rng is None:
+        rng = np.random
+
+    if schedule is None:
+        schedule = default_schedule()
+
+    # with counter-based noise, days of month of start date before start date are evaluated without taking trips,
+    # so the monthly trip is taken on the same day as in a run starting earlier
+    loop_start = month_start(start_date) if noise is not None else start_date
+    n_lead_days = (start_date - loop_start).days
+    n_days = (end_date - loop_start).days
+
+    # holiday flag per day of time range, looked up by day index
+    with timed(stats, "calendar", rows=n_days):
+        holiday = HolidayCalendar.coerce(additional_holidays).bitmap(start_date=loop_start,
+                                                                     n_days=n_days)
+
+    # resolve locations and travel times of all trips once, reporting missing ones before any trip is created
+    with timed(stats, "location_index"):
+        required_pairs = schedule.required_location_pairs(monthly_trip=monthly_trip,
+                                                         seasonal_trip=seasonal_trip)
+        location_index = compile_location_index(known_locations=known_locations,
+                                                travel_time_dict=travel_time_dict,
+                                                required_pairs=required_pairs,
+                                                speed_model=speed_model)
+
+    # initialize columnar trip buffer
+    trip_buffer = TripBuffer(capacity=2 * len(schedule.templates) * max(n_days, 1) // 7 + 1)
 
     # initialize flag to indicate if monthly trip has been taken
     monthly_trip_taken = False
 
-    # loop over each day in given time range
-    for day in [start_date + timedelta(days=d) for d in range((end_date - start_date).days)]:
-
-        if day.month != (day - timedelta(days=1)).month:
-            # reset monthly trip flag
-            monthly_trip_taken = False
-
-        if day.weekday() == 0 and day not in additional_holidays:  # Monday
-            # take monthly trip on first Monday of month
-            if not monthly_trip_taken and monthly_trip:
-                df_trips = append_trip(start_location='home',
-                                       start_time=day.replace(hour=8, minute=0),
-                                       end_location='back_office',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict
-                                       )
-
-                df_trips = append_trip(start_location='back_office',
-                                       start_time=day.replace(hour=15, minute=45),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-                # set monthly trip flag
-                monthly_trip_taken = True
-            else:
-                df_trips = append_trip(start_location='home',
-                                       start_time=day.replace(hour=6, minute=0),
-                                       end_location='work',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=16, minute=30),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 1 and day not in additional_holidays:  # Tuesday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=6, minute=0),
-                                   end_location='work',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            if seasonal_trip and day.month in [5, 6, 7, 8, 9]:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=14, minute=45),
-                                       end_location='swimming',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict
-                                       )
-                df_trips = append_trip(start_location='swimming',
-                                       start_time=day.replace(hour=16, minute=20),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict
-                                       )
-            else:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=16, minute=30),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 2 and day not in additional_holidays:  # Wednesday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=6, minute=0),
-                                   end_location='work',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-            if int(np.random.randint(2)) == 1:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=16, minute=30),
-                                       end_location='grocery',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-                df_trips = append_trip(start_location='grocery',
-                                       start_time=day.replace(hour=17, minute=15),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-            else:
-
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=16, minute=30),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=18, minute=24),
-                                   end_location='workout',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='workout',
-                                   start_time=day.replace(hour=20, minute=49),
-                                   end_location='home',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 3 and day not in additional_holidays:  # Thursday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=6, minute=15),
-                                   end_location='work',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            if seasonal_trip and day.month in [5, 6, 7, 8, 9]:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=15, minute=20),
-                                       end_location='swimming',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-                df_trips = append_trip(start_location='swimming',
-                                       start_time=day.replace(hour=17, minute=0),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-            else:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=16, minute=30),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 4 and day not in additional_holidays:  # Friday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=6, minute=0),
-                                   end_location='work',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            if int(np.random.randint(2)) == 1:
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=15, minute=30),
-                                       end_location='grocery',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
+    # iteration over days and evaluation of branches is timed as schedule stage, without the stages of `append_trip`
+    with timed(stats, "schedule", exclusive=True) as stage:
+        # loop over each day in given time range
+        for d in range(n_days):
+            day = loop_start + timedelta(days=d)
+            day_number = (day - _EPOCH).days
+
+            if day.month != (day - timedelta(days=1)).month:
+                # reset monthly trip flag
+                monthly_trip_taken = False
+
+            weekday = day.weekday()
+            if schedule.skip_holidays[weekday] and holiday[d]:
+                continue
+
+            template_ids = []
+            for kind, i in schedule.steps[weekday]:
+                if kind == "trip":
+                    template_ids.append(i)
+                    continue
+
+                # take first option of branch whose conditions hold
+                for option, slot in zip(schedule.branches[i].options, schedule.option_slots[i]):
+                    if "monthly" in option.when and (not monthly_trip or monthly_trip_taken):
+                        continue
+                    if "seasonal" in option.when and (not seasonal_trip or day.month not in schedule.seasonal_months):
+                        continue
+                    if option.probability is not None:
+                        draw = rng.random() if noise is None else noise.uniform(day_number, slot, OPTION_STREAM)
+                        if not draw < option.probability:
+                            continue
+                    if "monthly" in option.when:
+                        # set monthly trip flag
+                        monthly_trip_taken = True
+                    template_ids.extend(option.templates)
+                    break
+
+            if d < n_lead_days:
+                continue
+
+            # trips of a day are taken in order of scheduled departure
+            template_ids = sorted(template_ids, key=lambda k: schedule.templates[k].seconds)
+
+            # draws of all trips of the day at once, one row per trip
+            draws = None if noise is None else noise.normal(day_number, np.array(template_ids)[:, None], TRIP_STREAMS)
+
+            for k, i in enumerate(template_ids):
+                template = schedule.templates[i]
+                start_time = (day.replace(hour=0, minute=0, second=0, microsecond=0)
+                              + timedelta(seconds=template.seconds))
+                append_trip(start_location=template.start_location,
+                            start_time=start_time,
+                            end_location=template.end_location,
+                            departure_time_sigma=schedule.departure_time_sigma(start_location=template.start_location,
+                                                                               hour=start_time.hour),
+                            trip_buffer=trip_buffer,
+                            location_scatter=location_scatter,
+                            departure_time_scatter=departure_time_scatter,
+                            travel_time_scatter=travel_time_scatter,
+                            location_index=location_index,
+                            rng=rng,
+                            stats=stats,
+                            draws=None if draws is None else draws[k])
+        stage.rows = len(trip_buffer)
+
+    with timed(stats, "assembly"):
+        df = trip_buffer.to_dataframe()
+    if repair:
+        with timed(stats, "repair", rows=len(df)):
+            df = pd.DataFrame(repair_trips(df))
+
+    if stats is not None:
+        stats.emit()
+    return df
+
+
+def iter_synthetic_data(known_locations: List[dict],
+                        travel_time_dict: Union[dict, np.ndarray, str],
+                        location_scatter: bool,
+                        departure_time_scatter: bool,
+                        travel_time_scatter: bool,
+                        monthly_trip: bool,
+                        seasonal_trip: bool,
+                        additional_holidays=None,
+                        start_date: datetime = datetime(year=2018, month=1, day=1),
+                        end_date: datetime = datetime(year=2019, month=12, day=31),
+                        rng: Optional[np.random.Generator] = None,
+                        schedule: Optional[SchedulePlan] = None,
+                        speed_model: Optional[SpeedModel] = None,
+                        location_ids: bool = False,
+                        chunk_months: int = 1,
+                        max_rows: Optional[int] = None,
+                        stats: Optional[GenerationStats] = None,
+                        noise: Optional[CounterNoise] = None,
+                        repair: bool = False) -> Iterator[pd.DataFrame]:
+    """Streaming counterpart of `create_synthetic_data`, yielding the sequence of trips in bounded chunks.
+
+    The time range is evaluated window by window with the vectorized calendar engine; windows end at month
+    boundaries, hence no state has to be carried over from one window to the next.
 
-                df_trips = append_trip(start_location='grocery',
-                                       start_time=day.replace(hour=16, minute=15),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-            else:
-
-                df_trips = append_trip(start_location='work',
-                                       start_time=day.replace(hour=15, minute=30),
-                                       end_location='home',
-                                       df=df_trips,
-                                       location_scatter=location_scatter,
-                                       departure_time_scatter=departure_time_scatter,
-                                       travel_time_scatter=travel_time_scatter,
-                                       known_locations=known_locations,
-                                       travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=19, minute=27),
-                                   end_location='orchestra',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='orchestra',
-                                   start_time=day.replace(hour=22, minute=15),
-                                   end_location='home',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 5:  # Saturday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=10, minute=0),
-                                   end_location='grocery',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='grocery',
-                                   start_time=day.replace(hour=11, minute=5),
-                                   end_location='home',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-        if day.weekday() == 6:  # Sunday
-            df_trips = append_trip(start_location='home',
-                                   start_time=day.replace(hour=11, minute=55),
-                                   end_location='parents',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-            df_trips = append_trip(start_location='parents',
-                                   start_time=day.replace(hour=15, minute=0),
-                                   end_location='home',
-                                   df=df_trips,
-                                   location_scatter=location_scatter,
-                                   departure_time_scatter=departure_time_scatter,
-                                   travel_time_scatter=travel_time_scatter,
-                                   known_locations=known_locations,
-                                   travel_time_dict=travel_time_dict)
-
-    return df_trips
+    Args:
+        known_locations:        List of JSON representing locations
+        travel_time_dict:       Matrix (as JSON) for travel times in between locations, or square matrix (path of `.npy`
+                                file) indexed by position in `known_locations`, see `compile_location_index`
+        location_scatter:       Flag to indicate if location scatter should be applied
+        departure_time_scatter: Flag to indicate if departure time scatter should be applied
+        travel_time_scatter:    Flag to indicate if travel time scatter should be applied
+        monthly_trip:           Flag to indicate if monthly trips should be included
+        seasonal_trip:          Flag to indicate if seasonal trips should be included
+        additional_holidays:    Optional holiday calendar or list of holidays, e.g. from user's calendar etc.
+        start_date:             First day of relevant time range
+        end_date:               Last day of relevant time range
+        rng:                    Optional random generator, global NumPy random state if not given
+        schedule:               Optional compiled schedule plan, default schedule if not given
+        speed_model:            Optional speed model estimating travel times of pairs missing in `travel_time_dict`
+        location_ids:           Flag to indicate if IDs of start and end location should be included as columns
+        chunk_months:           Number of months evaluated per window
+        max_rows:               Optional maximum number of trips per yielded chunk
+        stats:                  Optional collector of per-stage timings, emitted once per window
+        noise:                  Optional counter-based noise keyed on day and slot, used instead of `rng` if given
+        repair:                 Flag to indicate if conflicting trips should be resolved, within each window; a conflict
+                                across the boundary of two windows remains
+
+    Yields:
+        Dataframes containing consecutive parts of the sequence of trips, with the columns of `create_synthetic_data`.
+    """
+    for window_start, window_end in month_windows(start_date=start_date,
+                                                  end_date=end_date,
+                                                  chunk_months=chunk_months):
+        df_window = create_synthetic_data_vectorized(known_locations=known_locations,
+                                                     travel_time_dict=travel_time_dict,
+                                                     location_scatter=location_scatter,
+                                                     departure_time_scatter=departure_time_scatter,
+                                                     travel_time_scatter=travel_time_scatter,
+                                                     monthly_trip=monthly_trip,
+                                                     seasonal_trip=seasonal_trip,
+                                                     additional_holidays=additional_holidays,
+                                                     start_date=window_start,
+                                                     end_date=window_end,
+                                                     rng=rng,
+                                                     schedule=schedule,
+                                                     speed_model=speed_model,
+                                                     location_ids=location_ids,
+                                                     stats=stats,
+                                                     noise=noise,
+                                                     repair=repair)
+        if max_rows is None:
+            yield df_window
+        else:
+            for i in range(0, len(df_window), max_rows):
+                yield df_window.iloc[i:i + max_rows].reset_index(drop=True)
@@ -1,113 +1,394 @@
 """Module providing utility functions for creating synthetic mobility data."""
-from datetime import datetime
-from typing import List, Tuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from math import isnan
+from typing import TYPE_CHECKING, List, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy as np
-import pandas as pd
 
+from location_index import LocationIndex
+from noise import DEPARTURE_TIME_STREAM, LATITUDE_STREAM, LONGITUDE_STREAM, TRAVEL_TIME_STREAM
+from profiling import GenerationStats, timed
 
-def travel_time(travel_time_dict: dict,
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# columns of created trip data, in output order
+TRIP_COLUMNS = ("gps_start_lat",
+                "gps_start_lon",
+                "t_start",
+                "t_end",
+                "gps_end_lat",
+                "gps_end_lon")
+
+# optional columns with IDs of start and end location in compiled location index
+LOCATION_ID_COLUMNS = ("start_location_id",
+                       "end_location_id")
+
+
+class TripBuffer:
+    """Columnar accumulator for trips backed by preallocated, growable NumPy arrays.
+
+    Trips are pushed one by one into one float64 array per column; capacity is doubled whenever
+    the buffer runs full, so appending is amortized O(1). The Dataframe is only built once at the very end.
+
+    Args:
+        capacity:   Number of trips to preallocate memory for
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = max(int(capacity), 1)
+        self._size = 0
+        self._columns = {name: np.empty(self._capacity, dtype=np.float64) for name in TRIP_COLUMNS}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int):
+        """Grow all column arrays such that at least `size` trips fit into the buffer."""
+        if size <= self._capacity:
+            return
+        capacity = max(size, 2 * self._capacity)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        self._capacity = capacity
+
+    def push(self,
+             gps_start_lat: float,
+             gps_start_lon: float,
+             t_start: float,
+             t_end: float,
+             gps_end_lat: float,
+             gps_end_lon: float):
+        """Append a single trip to the buffer."""
+        if self._size == self._capacity:
+            self._reserve(self._size + 1)
+        i = self._size
+        columns = self._columns
+        columns["gps_start_lat"][i] = gps_start_lat
+        columns["gps_start_lon"][i] = gps_start_lon
+        columns["t_start"][i] = t_start
+        columns["t_end"][i] = t_end
+        columns["gps_end_lat"][i] = gps_end_lat
+        columns["gps_end_lon"][i] = gps_end_lon
+        self._size += 1
+
+    def to_dataframe(self) -> "pd.DataFrame":
+        """Build Dataframe with one trip per row from the buffered trips."""
+        import pandas as pd
+
+        return pd.DataFrame({name: self._columns[name][:self._size].copy() for name in TRIP_COLUMNS},
+                            columns=list(TRIP_COLUMNS))
+
+
+def concat_trip_chunks(chunks: List[Union["pd.DataFrame", Mapping[str, np.ndarray]]],
+                       column_names: Sequence[str]) -> "pd.DataFrame":
+    """Merge chunks of trips by copying each once into preallocated columns.
+
+    Args:
+        chunks:         Dataframes or dicts of columns, in output order
+        column_names:   Names of columns to merge; columns of `TRIP_COLUMNS` are float64, all others int64
+
+    Returns:
+        Dataframe containing all trips of all chunks, with `column_names` as columns.
+    """
+    import pandas as pd
+
+    n_trips = sum(len(chunk[column_names[0]]) for chunk in chunks)
+    columns = {name: np.empty(n_trips, dtype=np.float64 if name in TRIP_COLUMNS else np.int64)
+               for name in column_names}
+    offset = 0
+    for chunk in chunks:
+        n = len(chunk[column_names[0]])
+        for name in column_names:
+            columns[name][offset:offset + n] = np.asarray(chunk[name])
+        offset += n
+
+    return pd.DataFrame(columns, columns=list(column_names))
+
+
+def travel_time(location_index: LocationIndex,
                 start_location: str,
                 end_location: str,
-                travel_time_scatter: bool) -> float:
+                travel_time_scatter: bool,
+                rng: Optional[np.random.Generator] = None,
+                draw: Optional[float] = None) -> float:
     """Wrapper to fetch/calculate travel times with/without random scatter.
 
     Args:
-        travel_time_dict:       Travel time matrix as dict
+        location_index:         Compiled catalog of locations and travel times
         start_location:         Name of start location
         end_location:           Name of end location
         travel_time_scatter:    Flag to indicate if travel time should be multiplied by random factor
+        rng:                    Optional random generator, global NumPy random state if not given
+        draw:                   Optional pre-drawn standard normal value of scatter, drawn from `rng` if not given
 
     Returns:
         Travel time in seconds.
     """
     if travel_time_scatter:
-        tt_scatter = np.random.randn() * 0.05
+        tt_scatter = ((np.random if rng is None else rng).standard_normal() if draw is None else draw) * 0.05
     else:
         tt_scatter = 0.0
 
+    start_id = location_index.location_id(start_location)
+    end_id = location_index.location_id(end_location)
+    seconds = float(location_index.travel_times.lookup(start_id, end_id))
+    if isnan(seconds):
+        # estimated by speed model of location index, if any
+        seconds = float(location_index.travel_time(start_id, end_id))
+
     # seconds
-    return travel_time_dict[start_location][end_location] * (1 + tt_scatter)
+    return seconds * (1 + tt_scatter)
 
 
-def _departure_time_scatter(start_location: str,
-                            start_time: datetime) -> float:
+def _departure_time_scatter(sigma: float,
+                            rng: Optional[np.random.Generator] = None) -> float:
     """Wrapper to simulate departure time scatter.
 
+    Args:
+        sigma:  Standard deviation of departure time in seconds, see `SchedulePlan.departure_time_sigma`
+        rng:    Optional random generator, global NumPy random state if not given
+
     Returns:
         Random float to offset departure time.
     """
+    if sigma == 0.0:
+        return 0.0
     # seconds
-    if start_location == 'home':
-        if start_time.hour < 12:
-            return np.random.randn() * 5 * 60
-        else:
-            return np.random.randn() * 30 * 60
-    elif start_location == 'work':
-        return np.random.randn() * 45 * 60
-    elif start_location == 'orchestra':
-        return np.random.randn() * 5 * 60
-    elif start_location == 'workout':
-        return np.random.randn() * 10 * 60
-    elif start_location == 'parents':
-        return np.random.randn() * 60 * 60
-    elif start_location == 'grocery':
-        return np.random.randn() * 5 * 60
-    elif start_location == 'swimming':
-        return np.random.randn() * 20 * 60
-    elif start_location == 'back_office':
-        return np.random.randn() * 45 * 60
-    return 0.0
-
-
-def _location_scatter() -> Tuple[float, float]:
+    return (np.random if rng is None else rng).standard_normal() * sigma
+
+
+_EPOCH = datetime(year=1970, month=1, day=1)
+
+
+@lru_cache(maxsize=None)
+def _midnight_shift(day: int) -> float:
+    """Difference of POSIX and naive local seconds at midnight of given day since 1970-01-01."""
+    return (_EPOCH + timedelta(days=day)).timestamp() - day * 86400
+
+
+def local_timestamps(naive_seconds: np.ndarray) -> np.ndarray:
+    """Vectorized counterpart of `datetime.timestamp()` for naive datetimes in local time.
+
+    UTC offsets are only looked up once per distinct day; trips on days with a change of the offset, e.g. due to
+    daylight saving time, are converted one by one.
+
+    Args:
+        naive_seconds:  Seconds since 1970-01-01 00:00 of naive local datetimes
+
+    Returns:
+        POSIX timestamps in seconds.
+    """
+    naive_seconds = np.asarray(naive_seconds)
+    if len(naive_seconds) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    # day index is integer for float input as well, e.g. milliseconds divided by 1000
+    day = np.floor_divide(naive_seconds, 86400).astype(np.int64)
+    first_day = int(day.min())
+    # shift from naive to POSIX seconds at midnight of each day, including the following day
+    shift = np.array([_midnight_shift(d) for d in range(first_day, int(day.max()) + 2)])
+
+    i = day - first_day
+    timestamps = naive_seconds + shift[i]
+
+    for k in np.flatnonzero(shift[i] != shift[i + 1]):
+        timestamps[k] = (_EPOCH + timedelta(seconds=float(naive_seconds[k]))).timestamp()
+
+    return timestamps
+
+
+@lru_cache(maxsize=None)
+def _utc_offset(day: int) -> float:
+    """Difference of naive local and POSIX seconds at 00:00 UTC of given day since 1970-01-01."""
+    return (datetime.fromtimestamp(day * 86400) - _EPOCH).total_seconds() - day * 86400
+
+
+def local_seconds(timestamps: np.ndarray) -> np.ndarray:
+    """Inverse of `local_timestamps`, converting POSIX timestamps into seconds since 1970-01-01 00:00 local time.
+
+    UTC offsets are only looked up once per distinct day; timestamps on days with a change of the offset are
+    converted one by one.
+
+    Args:
+        timestamps: POSIX timestamps in seconds
+
+    Returns:
+        Seconds since 1970-01-01 00:00 of naive local datetimes.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    day = (timestamps // 86400).astype(np.int64)
+    first_day = int(day.min())
+    offset = np.array([_utc_offset(d) for d in range(first_day, int(day.max()) + 2)])
+
+    i = day - first_day
+    naive_seconds = timestamps + offset[i]
+
+    for k in np.flatnonzero(offset[i] != offset[i + 1]):
+        naive_seconds[k] = (datetime.fromtimestamp(timestamps[k]) - _EPOCH).total_seconds()
+
+    return naive_seconds
+
+
+def _location_scatter(rng: Optional[np.random.Generator] = None) -> Tuple[float, float]:
     """Wrapper to simulate measurement scatter of GPS locations.
 
     Returns:
         Tuple of random scatter values.
     """
-    return float(np.random.randn() * 5e-4), float(np.random.randn() * 5e-4)
+    rng = np.random if rng is None else rng
+    return float(rng.standard_normal() * 5e-4), float(rng.standard_normal() * 5e-4)
+
+
+def _trip_scatter(departure_time_sigma: float,
+                  location_scatter: bool,
+                  departure_time_scatter: bool,
+                  rng: Optional[np.random.Generator] = None,
+                  draws: Optional[np.ndarray] = None) -> Tuple[float, float, float]:
+    """Scatter of departure time in seconds and of latitude and longitude of a single trip, see `append_trip`."""
+    if draws is None:
+        dt_scatter = _departure_time_scatter(sigma=departure_time_sigma,
+                                             rng=rng) if departure_time_scatter else 0.0
+
+        lat_scatter, lon_scatter = _location_scatter(rng=rng) if location_scatter else (0.0, 0.0)
+    else:
+        dt_scatter = draws[DEPARTURE_TIME_STREAM] * departure_time_sigma if departure_time_scatter else 0.0
+
+        if location_scatter:
+            lat_scatter, lon_scatter = draws[LATITUDE_STREAM] * 5e-4, draws[LONGITUDE_STREAM] * 5e-4
+        else:
+            lat_scatter, lon_scatter = 0.0, 0.0
+    return dt_scatter, lat_scatter, lon_scatter
+
 
+def _trip_route(location_index: LocationIndex,
+                start_location: str,
+                end_location: str,
+                travel_time_scatter: bool,
+                rng: Optional[np.random.Generator] = None,
+                draws: Optional[np.ndarray] = None) -> Tuple[int, int, float]:
+    """IDs of start and end location and travel time in seconds of a single trip, see `append_trip`."""
+    start_id = location_index.location_id(start_location)
+    end_id = location_index.location_id(end_location)
+    trip_travel_time = travel_time(start_location=start_location,
+                                   end_location=end_location,
+                                   location_index=location_index,
+                                   travel_time_scatter=travel_time_scatter,
+                                   rng=rng,
+                                   draw=None if draws is None else draws[TRAVEL_TIME_STREAM])
+    return start_id, end_id, trip_travel_time
+
+
+def _push_trip(location_index: LocationIndex,
+               start_id: int,
+               end_id: int,
+               start_timestamp: float,
+               trip_travel_time: float,
+               dt_scatter: float,
+               lat_scatter: float,
+               lon_scatter: float,
+               trip_buffer: TripBuffer):
+    """Push a single trip with resolved locations, times and scatter into trip buffer."""
+    trip_buffer.push(
+        gps_start_lat=location_index.lat[start_id] + lat_scatter,
+        gps_start_lon=location_index.lon[start_id] + lon_scatter,
+        t_start=(start_timestamp + dt_scatter) * 1000,
+        t_end=(start_timestamp + trip_travel_time + dt_scatter) * 1000,
+        gps_end_lat=location_index.lat[end_id] + lat_scatter,
+        gps_end_lon=location_index.lon[end_id] + lon_scatter)
 
-def append_trip(known_locations: List[dict],
-                travel_time_dict: dict,
+
+def append_trip(location_index: LocationIndex,
                 start_location: str,
                 start_time: datetime,
                 end_location: str,
+                departure_time_sigma: float,
                 location_scatter: bool,
                 departure_time_scatter: bool,
                 travel_time_scatter: bool,
-                df: pd.DataFrame) -> pd.DataFrame:
-    """Utility to insert trip in Dataframe given the parameters passed.
+                trip_buffer: TripBuffer,
+                rng: Optional[np.random.Generator] = None,
+                stats: Optional[GenerationStats] = None,
+                draws: Optional[np.ndarray] = None) -> TripBuffer:
+    """Utility to insert trip in trip buffer given the parameters passed.
 
     Args:
-        known_locations:        List of JSON representing locations
-        travel_time_dict:       Matrix (as JSON) for travel times in between locations
+        location_index:         Compiled catalog of locations and travel times
         start_location:         Name of trip start location
         start_time:             Start time of trip as datetime object
         end_location:           Name of trip end location
+        departure_time_sigma:   Standard deviation of departure time scatter in seconds
         location_scatter:       Flag to indicate if location scatter should be applied
         departure_time_scatter: Flag to indicate if departure time scatter should be applied
         travel_time_scatter:    Flag to indicate if travel time scatter should be applied
-        df:                     Dataframe to append to
+        trip_buffer:            Trip buffer to append to
+        rng:                    Optional random generator, global NumPy random state if not given
+        stats:                  Optional collector of per-stage timings
+        draws:                  Optional pre-drawn standard normal values of trip, indexed by the trip streams of
+                                `noise`, e.g. from counter-based noise; drawn from `rng` if not given
 
     Returns:
-        Dataframe with appended trip as specified.
+        Trip buffer with appended trip as specified.
     """
-    dt_scatter = _departure_time_scatter(start_location=start_location,
-                                         start_time=start_time) if departure_time_scatter else 0.0
-
-    lat_scatter, lon_scatter = _location_scatter() if location_scatter else (0.0, 0.0)
-
-    return df.append({
-        "gps_start_lat": [e["gps_lat"] for e in known_locations if e["name"] == start_location][0] + lat_scatter,
-        "gps_start_lon": [e["gps_lon"] for e in known_locations if e["name"] == start_location][0] + lon_scatter,
-        "t_start": (start_time.timestamp() + dt_scatter) * 1000,
-        "t_end": (start_time.timestamp() + travel_time(start_location=start_location,
-                                                       end_location=end_location,
-                                                       travel_time_dict=travel_time_dict,
-                                                       travel_time_scatter=travel_time_scatter) + dt_scatter) * 1000,
-        "gps_end_lat": [e["gps_lat"] for e in known_locations if e["name"] == end_location][0] + lat_scatter,
-        "gps_end_lon": [e["gps_lon"] for e in known_locations if e["name"] == end_location][0] + lon_scatter
-    },
-        ignore_index=True)
+    if stats is None:
+        # fast path without per-trip timing, so disabled profiling costs nothing per trip
+        dt_scatter, lat_scatter, lon_scatter = _trip_scatter(departure_time_sigma=departure_time_sigma,
+                                                             location_scatter=location_scatter,
+                                                             departure_time_scatter=departure_time_scatter,
+                                                             rng=rng,
+                                                             draws=draws)
+        start_timestamp = start_time.timestamp()
+        start_id, end_id, trip_travel_time = _trip_route(location_index=location_index,
+                                                         start_location=start_location,
+                                                         end_location=end_location,
+                                                         travel_time_scatter=travel_time_scatter,
+                                                         rng=rng,
+                                                         draws=draws)
+        _push_trip(location_index=location_index,
+                   start_id=start_id,
+                   end_id=end_id,
+                   start_timestamp=start_timestamp,
+                   trip_travel_time=trip_travel_time,
+                   dt_scatter=dt_scatter,
+                   lat_scatter=lat_scatter,
+                   lon_scatter=lon_scatter,
+                   trip_buffer=trip_buffer)
+        return trip_buffer
+
+    with timed(stats, "random_draws"):
+        dt_scatter, lat_scatter, lon_scatter = _trip_scatter(departure_time_sigma=departure_time_sigma,
+                                                             location_scatter=location_scatter,
+                                                             departure_time_scatter=departure_time_scatter,
+                                                             rng=rng,
+                                                             draws=draws)
+
+    with timed(stats, "timestamps"):
+        start_timestamp = start_time.timestamp()
+
+    # travel time scatter is drawn along with the lookup
+    with timed(stats, "location_lookup"):
+        start_id, end_id, trip_travel_time = _trip_route(location_index=location_index,
+                                                         start_location=start_location,
+                                                         end_location=end_location,
+                                                         travel_time_scatter=travel_time_scatter,
+                                                         rng=rng,
+                                                         draws=draws)
+
+    with timed(stats, "assembly", rows=1):
+        _push_trip(location_index=location_index,
+                   start_id=start_id,
+                   end_id=end_id,
+                   start_timestamp=start_timestamp,
+                   trip_travel_time=trip_travel_time,
+                   dt_scatter=dt_scatter,
+                   lat_scatter=lat_scatter,
+                   lon_scatter=lon_scatter,
+                   trip_buffer=trip_buffer)
+    return trip_buffer
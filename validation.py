@@ -0,0 +1,298 @@
+"""Module providing validation of trip data for temporal and spatial consistency, and repair of conflicts.
+
+Each trip is checked on its own and against the previous trip of the same agent, over whole columns at once:
+
+    "missing":              Time stamp or coordinate is NaN
+    "duration":             Trip ends before it starts
+    "ordering":             Trip starts before the previous trip
+    "overlap":              Trip starts before the previous trip ends
+    "speed":                Straight-line speed in between start and end exceeds `max_speed`
+    "location_mismatch":    Trip does not start where the previous trip ended, by location ID if given, otherwise
+                            by a distance of more than `max_gap`
+
+Chunks are validated one after the other with the last trip carried over, so files of any size are checked in
+bounded memory, e.g. to gate a release of a dataset by
+
+    python validation.py data/synthetic_trip_data.csv
+"""
+import argparse
+import os
+import sys
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+import numpy as np
+
+from location_index import haversine_distance
+from utils import TRIP_COLUMNS
+from writers import COORDINATE_COLUMNS, COORDINATE_SCALE
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# names of checks, in order of report
+CHECKS = ("missing", "duration", "ordering", "overlap", "speed", "location_mismatch")
+
+
+class ValidationReport:
+    """Offending rows per check, as row numbers in the whole trip data."""
+
+    def __init__(self):
+        self.n_rows = 0
+        self._rows = {check: [] for check in CHECKS}
+
+    def add(self, check: str,
+            rows: np.ndarray):
+        """Record offending rows of a check."""
+        if len(rows):
+            self._rows[check].append(np.asarray(rows, dtype=np.int64))
+
+    def rows(self, check: str) -> np.ndarray:
+        """Offending rows of a check, in ascending order."""
+        return np.concatenate(self._rows[check]) if self._rows[check] else np.zeros(0, dtype=np.int64)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of offending rows per check."""
+        return {check: sum(len(rows) for rows in self._rows[check]) for check in CHECKS}
+
+    @property
+    def ok(self) -> bool:
+        """Flag to indicate if no check failed."""
+        return not any(self._rows.values())
+
+    def __str__(self) -> str:
+        lines = [f"{'check':<20}{'rows':>10}  first offending rows"]
+        for check, count in self.counts().items():
+            lines.append(f"{check:<20}{count:>10}  {', '.join(str(row) for row in self.rows(check)[:5])}")
+        lines.append(f"{'checked':<20}{self.n_rows:>10}")
+        return "\n".join(lines)
+
+
+class TripValidator:
+    """Stateful validator of consecutive chunks of trips, ordered by agent and time.
+
+    Args:
+        max_speed:  Maximum straight-line speed in between start and end of a trip in m/s
+        max_gap:    Maximum distance in meters in between end of a trip and start of the next one, used if trips
+                    lack location IDs
+    """
+
+    def __init__(self, max_speed: float = 70.0,
+                 max_gap: float = 500.0):
+        self.max_speed = max_speed
+        self.max_gap = max_gap
+        self.report = ValidationReport()
+        # last trip of previous chunk, checked against first trip of next chunk
+        self._last_trip = None
+
+    def check(self, trips: Union["pd.DataFrame", Mapping[str, np.ndarray]]) -> ValidationReport:
+        """Validate next chunk of trips, offending rows are added to `report`.
+
+        Args:
+            trips:  Dataframe of trips or dict mapping column names to arrays, with the columns of
+                    `create_synthetic_data` and optionally "agent_id" and `LOCATION_ID_COLUMNS`
+
+        Returns:
+            Report of all chunks checked so far.
+        """
+        n = len(trips["t_start"])
+        first_row = self.report.n_rows
+        self.report.n_rows += n
+
+        chunk = {name: np.asarray(trips[name], dtype=np.float64) for name in TRIP_COLUMNS}
+        chunk["agent_id"] = np.zeros(n, dtype=np.int64)
+        if "agent_id" in trips:
+            chunk["agent_id"] = np.asarray(trips["agent_id"], dtype=np.int64)
+        has_ids = "start_location_id" in trips and "end_location_id" in trips
+        if has_ids:
+            for name in ("start_location_id", "end_location_id"):
+                chunk[name] = np.asarray(trips[name], dtype=np.int64)
+
+        # checks of single trips
+        self.report.add("missing", first_row + np.flatnonzero(np.isnan(np.column_stack(
+            [chunk[name] for name in TRIP_COLUMNS])).any(axis=1)))
+        duration = (chunk["t_end"] - chunk["t_start"]) / 1000
+        self.report.add("duration", first_row + np.flatnonzero(duration < 0))
+        distance = haversine_distance(lat_1=chunk["gps_start_lat"],
+                                      lon_1=chunk["gps_start_lon"],
+                                      lat_2=chunk["gps_end_lat"],
+                                      lon_2=chunk["gps_end_lon"])
+        too_fast = (distance > self.max_speed * np.maximum(duration, 0)) & (distance > 0)
+        self.report.add("speed", first_row + np.flatnonzero(too_fast))
+
+        # checks of consecutive trips of the same agent, including last trip of previous chunk
+        if self._last_trip is not None and self._last_trip.keys() == chunk.keys():
+            previous = {name: np.concatenate([self._last_trip[name], chunk[name]]) for name in chunk}
+            offset = first_row - 1
+        else:
+            previous = chunk
+            offset = first_row
+        if n:
+            self._last_trip = {name: values[-1:] for name, values in chunk.items()}
+
+        same_agent = previous["agent_id"][1:] == previous["agent_id"][:-1]
+        self.report.add("ordering", offset + 1 + np.flatnonzero(
+            same_agent & (previous["t_start"][1:] < previous["t_start"][:-1])))
+        self.report.add("overlap", offset + 1 + np.flatnonzero(
+            same_agent & (previous["t_start"][1:] < previous["t_end"][:-1])))
+        if has_ids:
+            mismatch = previous["start_location_id"][1:] != previous["end_location_id"][:-1]
+        else:
+            mismatch = haversine_distance(lat_1=previous["gps_end_lat"][:-1],
+                                          lon_1=previous["gps_end_lon"][:-1],
+                                          lat_2=previous["gps_start_lat"][1:],
+                                          lon_2=previous["gps_start_lon"][1:]) > self.max_gap
+        self.report.add("location_mismatch", offset + 1 + np.flatnonzero(same_agent & mismatch))
+        return self.report
+
+
+def validate_trips(trips: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                   max_speed: float = 70.0,
+                   max_gap: float = 500.0) -> ValidationReport:
+    """Validate sequence of trips, e.g. from `create_synthetic_data`, see `TripValidator` for the arguments.
+
+    Returns:
+        Report of offending rows per check.
+    """
+    return TripValidator(max_speed=max_speed, max_gap=max_gap).check(trips)
+
+
+def validate_trip_chunks(chunks: Iterable[Union["pd.DataFrame", Mapping[str, np.ndarray]]],
+                         max_speed: float = 70.0,
+                         max_gap: float = 500.0) -> ValidationReport:
+    """Validate chunks of trips in a single pass, e.g. from `iter_synthetic_data` or `iter_trip_file`.
+
+    See `TripValidator` for the arguments.
+
+    Returns:
+        Report of offending rows per check.
+    """
+    validator = TripValidator(max_speed=max_speed, max_gap=max_gap)
+    for trips in chunks:
+        validator.check(trips)
+    return validator.report
+
+
+def repair_trips(trips: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                 min_gap: float = 0.0,
+                 max_gap: float = 500.0) -> dict:
+    """Resolve overlaps and location mismatches in between consecutive trips of the same agent.
+
+    A trip starting before the previous trip ended, or before it started, is postponed together with all later
+    trips it would overlap, keeping all travel times. A trip starting at the location where the previous trip ended,
+    by location ID if given, otherwise within `max_gap`, starts at the exact GPS end point of the previous trip.
+
+    Args:
+        trips:      Dataframe of trips or dict mapping column names to arrays, ordered by agent and time
+        min_gap:    Minimum time in between end of a trip and start of the next one in milliseconds
+        max_gap:    Maximum distance in meters in between end of a trip and start of the next one at the same
+                    location, used if trips lack location IDs
+
+    Returns:
+        Dict mapping column names of `trips` to repaired arrays.
+    """
+    columns = {name: np.array(trips[name]) for name in trips}
+    n = len(columns["t_start"])
+    agent_id = columns["agent_id"] if "agent_id" in columns else np.zeros(n, dtype=np.int64)
+
+    # per agent, start is postponed to end of previous trip plus gap, which is a running maximum of the start
+    # relative to the cumulative durations and gaps of earlier trips of the agent
+    duration = columns["t_end"] - columns["t_start"]
+    if n:
+        new_run = np.concatenate([[True], agent_id[1:] != agent_id[:-1]])
+        run = np.cumsum(new_run) - 1
+        run_start = np.flatnonzero(new_run)
+        elapsed = np.concatenate([[0.0], np.cumsum(duration[:-1] + min_gap)])
+        elapsed -= elapsed[run_start][run]
+        relative = columns["t_start"] - elapsed
+
+        # running maximum restarting per agent, taken over ranks of relative starts offset by run, so the rank of
+        # any trip exceeds those of all earlier agents
+        order = np.argsort(relative, kind="stable")
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        rank = np.maximum.accumulate(rank + run * n) - run * n
+        columns["t_start"][:] = elapsed + relative[order[rank]]
+        columns["t_end"][:] = columns["t_start"] + duration
+
+    same_agent = agent_id[1:] == agent_id[:-1]
+    if "start_location_id" in columns and "end_location_id" in columns:
+        same_location = columns["start_location_id"][1:] == columns["end_location_id"][:-1]
+    else:
+        same_location = haversine_distance(lat_1=columns["gps_end_lat"][:-1],
+                                           lon_1=columns["gps_end_lon"][:-1],
+                                           lat_2=columns["gps_start_lat"][1:],
+                                           lon_2=columns["gps_start_lon"][1:]) <= max_gap
+    rows = np.flatnonzero(same_agent & same_location) + 1
+    columns["gps_start_lat"][rows] = columns["gps_end_lat"][rows - 1]
+    columns["gps_start_lon"][rows] = columns["gps_end_lon"][rows - 1]
+    return columns
+
+
+def _decode_coordinates(columns: dict) -> dict:
+    """Convert coordinates stored as scaled integers, see `writers.compact_columns`, back into degrees."""
+    for name in COORDINATE_COLUMNS:
+        if name in columns and np.issubdtype(columns[name].dtype, np.integer):
+            columns[name] = columns[name] / COORDINATE_SCALE
+    return columns
+
+
+def iter_trip_file(path: str,
+                   chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """Read trip data written by `write_trip_chunks` in chunks, format is inferred from file extension.
+
+    Args:
+        path:       Path of CSV, Parquet, Arrow or NPZ file
+        chunk_size: Number of trips per chunk of CSV and Parquet files; Arrow files are read per record batch
+
+    Yields:
+        Dicts mapping column names to arrays, coordinates in degrees regardless of their type in the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        import pyarrow.parquet
+
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield _decode_coordinates({name: column.to_numpy() for name, column in zip(batch.schema.names,
+                                                                                       batch.columns)})
+    elif extension in (".arrow", ".feather", ".ipc"):
+        import pyarrow
+        import pyarrow.ipc
+
+        with pyarrow.memory_map(path) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield _decode_coordinates({name: column.to_numpy() for name, column in zip(batch.schema.names,
+                                                                                       batch.columns)})
+    elif extension == ".npz":
+        with np.load(path) as data:
+            yield _decode_coordinates({name: data[name] for name in data.files})
+    else:
+        import pandas as pd
+
+        for df in pd.read_csv(path, chunksize=chunk_size):
+            yield _decode_coordinates({name: df[name].to_numpy() for name in df.columns})
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Validate trip data files, exit code is 1 if any check failed."""
+    parser = argparse.ArgumentParser(description="Validate trip data for temporal and spatial consistency.")
+    parser.add_argument("paths", nargs="+", help="CSV, Parquet, Arrow or NPZ files of trip data")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20, help="number of trips read at once")
+    parser.add_argument("--max-speed", type=float, default=70.0, help="maximum straight-line speed in m/s")
+    parser.add_argument("--max-gap", type=float, default=500.0,
+                        help="maximum distance in meters in between end of a trip and start of the next one")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for path in args.paths:
+        report = validate_trip_chunks(chunks=iter_trip_file(path, chunk_size=args.chunk_size),
+                                      max_speed=args.max_speed,
+                                      max_gap=args.max_gap)
+        print(f"{path}:\n{report}\n")
+        ok &= report.ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,396 @@
+"""Module providing writers to append chunks of trip data to disk as they arrive."""
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Iterable, Mapping, Optional, Sequence, TextIO, Union
+
+import numpy as np
+
+from profiling import GenerationStats, timed
+from utils import LOCATION_ID_COLUMNS, TRIP_COLUMNS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# columns of trip data and of GPS traces (see `traces`) by kind, for conversion into compact schema
+TIME_COLUMNS = ("t_start", "t_end", "t")
+COORDINATE_COLUMNS = ("gps_start_lat", "gps_start_lon", "gps_end_lat", "gps_end_lon", "gps_lat", "gps_lon")
+ID_COLUMNS = ("agent_id", "trip_id")
+
+# coordinates stored as scaled integers are given in units of 1e-7 degrees, i.e. about 1 cm
+COORDINATE_SCALE = 1e7
+
+# file extensions per output format
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow", "npz": ".npz"}
+
+
+def _n_rows(df: Union["pd.DataFrame", Mapping[str, np.ndarray]]) -> int:
+    """Number of trips of a chunk given as Dataframe or as dict of columns."""
+    if isinstance(df, Mapping):
+        return len(next(iter(df.values()))) if df else 0
+    return len(df)
+
+
+def _empty_trips() -> dict:
+    """Columns of trip data without trips, written by binary writers closed without any chunk."""
+    return {name: np.zeros(0) for name in TRIP_COLUMNS}
+
+
+def compact_columns(df: Union["pd.DataFrame", Mapping[str, np.ndarray]],
+                    coordinates: str = "float32") -> dict:
+    """Convert trip data into compact schema.
+
+    Time stamps become int64 milliseconds, coordinates float32 or scaled int32 (see `COORDINATE_SCALE`),
+    agent and trip IDs int64 and location IDs int32; other columns are kept as they are.
+
+    Args:
+        df:             Dataframe of trips, or dict mapping column names to arrays
+        coordinates:    Type of coordinate columns, one of "float64", "float32" or "scaled_int"
+
+    Returns:
+        Dict mapping column names to arrays.
+    """
+    if coordinates not in ("float64", "float32", "scaled_int"):
+        raise ValueError(f"Unknown coordinate type '{coordinates}'.")
+
+    columns = {}
+    for name in df:
+        values = np.asarray(df[name])
+        if name in TIME_COLUMNS:
+            values = np.rint(values).astype(np.int64)
+        elif name in COORDINATE_COLUMNS and coordinates == "float32":
+            values = values.astype(np.float32)
+        elif name in COORDINATE_COLUMNS and coordinates == "scaled_int":
+            values = np.rint(values * COORDINATE_SCALE).astype(np.int32)
+        elif name in ID_COLUMNS:
+            values = values.astype(np.int64)
+        elif name in LOCATION_ID_COLUMNS:
+            values = values.astype(np.int32)
+        columns[name] = values
+    return columns
+
+
+class _TripWriter(ABC):
+    """Base of incremental writers, usable as context manager."""
+    rows_written = 0
+
+    @abstractmethod
+    def write(self, df: "pd.DataFrame"):
+        """Append chunk of trips."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CsvTripWriter(_TripWriter):
+    """Incremental CSV writer, the header is written with the first chunk.
+
+    Args:
+        path:       Path of CSV file, "-" or a text stream to write to a pipe
+        append:     Flag to indicate if chunks should be appended to an existing file, without repeating the header
+    """
+
+    def __init__(self, path: Union[str, TextIO],
+                 append: bool = False):
+        if path == "-":
+            self._file = sys.stdout
+            self._owns_file = False
+        elif isinstance(path, str):
+            append = append and os.path.exists(path) and os.path.getsize(path) > 0
+            self._file = open(path, "a" if append else "w", newline="")
+            self._owns_file = True
+        else:
+            self._file = path
+            self._owns_file = False
+        self._header = not append
+        self.rows_written = 0
+
+    def write(self, df: "pd.DataFrame"):
+        """Append chunk of trips to file."""
+        df.to_csv(self._file,
+                  header=self._header,
+                  index=False)
+        self._file.flush()
+        self._header = False
+        self.rows_written += len(df)
+
+    def close(self):
+        """Close underlying file unless it was passed in."""
+        if self._owns_file:
+            self._file.close()
+
+
+def _import_pyarrow():
+    """Import optional dependency `pyarrow` on first use."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Writing Parquet or Arrow files requires the optional dependency 'pyarrow'.") from e
+    return pyarrow
+
+
+class ParquetTripWriter(_TripWriter):
+    """Incremental Parquet writer in compact schema, each chunk is written as a row group; requires `pyarrow`.
+
+    Args:
+        path:           Path of Parquet file
+        coordinates:    Type of coordinate columns, see `compact_columns`
+        compression:    Compression codec of column chunks
+    """
+
+    def __init__(self, path: str,
+                 coordinates: str = "float32",
+                 compression: str = "zstd"):
+        self._pa = _import_pyarrow()
+        self._path = path
+        self._coordinates = coordinates
+        self._compression = compression
+        self._writer = None
+        self.rows_written = 0
+
+    def write(self, df: Union["pd.DataFrame", Mapping[str, np.ndarray]]):
+        """Append chunk of trips to file as new row group, given as Dataframe or as dict of columns."""
+        table = self._pa.table(compact_columns(df, coordinates=self._coordinates))
+        if self._writer is None:
+            self._writer = self._pa.parquet.ParquetWriter(self._path,
+                                                          schema=table.schema,
+                                                          compression=self._compression)
+        self._writer.write_table(table)
+        self.rows_written += _n_rows(df)
+
+    def close(self):
+        """Finalize file, writing the footer; the file has empty columns of trip data if nothing was written."""
+        if self._writer is None:
+            self.write(_empty_trips())
+        self._writer.close()
+
+
+class ArrowTripWriter(_TripWriter):
+    """Incremental writer of Arrow IPC files in compact schema, each chunk is written as a record batch;
+    requires `pyarrow`. Files can be memory-mapped when reading, e.g. by `pyarrow.ipc.open_file`.
+
+    Args:
+        path:           Path of Arrow file
+        coordinates:    Type of coordinate columns, see `compact_columns`
+    """
+
+    def __init__(self, path: str,
+                 coordinates: str = "float32"):
+        self._pa = _import_pyarrow()
+        self._path = path
+        self._coordinates = coordinates
+        self._sink = None
+        self._writer = None
+        self.rows_written = 0
+
+    def write(self, df: Union["pd.DataFrame", Mapping[str, np.ndarray]]):
+        """Append chunk of trips to file as new record batch, given as Dataframe or as dict of columns."""
+        batch = self._pa.record_batch(compact_columns(df, coordinates=self._coordinates))
+        if self._writer is None:
+            self._sink = self._pa.OSFile(self._path, "wb")
+            self._writer = self._pa.ipc.new_file(self._sink, batch.schema)
+        self._writer.write_batch(batch)
+        self.rows_written += _n_rows(df)
+
+    def close(self):
+        """Finalize file, writing the footer; the file has empty columns of trip data if nothing was written."""
+        if self._writer is None:
+            self.write(_empty_trips())
+        self._writer.close()
+        self._sink.close()
+
+
+class NpzTripWriter(_TripWriter):
+    """Writer of compressed NumPy archives in compact schema, one array per column.
+
+    NPZ archives cannot be appended to, hence each column is spooled to a temporary file next to the archive as
+    chunks arrive, and the spooled columns are compressed into the archive when the writer is closed; memory stays
+    bounded by the size of a chunk.
+
+    Args:
+        path:           Path of NPZ file
+        coordinates:    Type of coordinate columns, see `compact_columns`
+    """
+
+    def __init__(self, path: str,
+                 coordinates: str = "float32"):
+        self._path = path
+        self._coordinates = coordinates
+        self._spool_dir = None
+        self._spools = {}
+        self.rows_written = 0
+
+    def write(self, df: Union["pd.DataFrame", Mapping[str, np.ndarray]]):
+        """Append chunk of trips in compact schema to spooled columns, given as Dataframe or as dict of columns."""
+        columns = compact_columns(df, coordinates=self._coordinates)
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix=".npz-", dir=os.path.dirname(os.path.abspath(self._path)))
+            self._spools = {name: (open(os.path.join(self._spool_dir, f"{i}.bin"), "w+b"), values.dtype)
+                            for i, (name, values) in enumerate(columns.items())}
+        for name, (spool, dtype) in self._spools.items():
+            spool.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self.rows_written += _n_rows(df)
+
+    def close(self):
+        """Compress spooled columns into archive, which has empty columns of trip data if nothing was written."""
+        if self._spool_dir is None:
+            self.write(_empty_trips())
+        try:
+            with zipfile.ZipFile(self._path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                for name, (spool, dtype) in self._spools.items():
+                    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array_header_1_0(member, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                                      "fortran_order": False,
+                                                                      "shape": (self.rows_written,)})
+                        spool.seek(0)
+                        shutil.copyfileobj(spool, member, 1 << 20)
+        finally:
+            for spool, _ in self._spools.values():
+                spool.close()
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+            self._spool_dir = None
+            self._spools = {}
+
+
+class PartitionedTripWriter(_TripWriter):
+    """Writer of datasets partitioned by agent and/or month, in directories named like `agent_id=3/month=2019-03`.
+
+    Each written chunk is split by partition and appended as new part file to each of its partitions; the month
+    is the UTC month of the trip's start time. As usual for such datasets, the agent ID is only encoded in the
+    directory name and not stored in the part files.
+
+    Args:
+        root:           Root directory of dataset
+        partition_by:   Partition keys, out of "agent_id" and "month"
+        file_format:    Format of part files, one of "csv", "parquet", "arrow" or "npz"
+        coordinates:    Type of coordinate columns of binary formats, see `compact_columns`
+    """
+
+    def __init__(self, root: str,
+                 partition_by: Sequence[str] = ("month",),
+                 file_format: str = "parquet",
+                 coordinates: str = "float32"):
+        unknown_keys = set(partition_by) - {"agent_id", "month"}
+        if unknown_keys:
+            raise ValueError(f"Unknown partition keys: {', '.join(sorted(unknown_keys))}.")
+        self._root = root
+        self._partition_by = tuple(partition_by)
+        self._file_format = file_format
+        self._coordinates = coordinates
+        self._part = 0
+        self.rows_written = 0
+
+    def _partition_keys(self, df: "pd.DataFrame") -> dict:
+        """Partition values of each trip, as arrays per key."""
+        keys = {}
+        for key in self._partition_by:
+            if key == "agent_id":
+                keys[key] = df["agent_id"].to_numpy()
+            else:
+                keys[key] = df["t_start"].to_numpy().astype("datetime64[ms]").astype("datetime64[M]")
+        return keys
+
+    def write(self, df: "pd.DataFrame"):
+        """Append chunk of trips to its partitions."""
+        if len(df) == 0:
+            return
+        keys = self._partition_keys(df)
+        order = np.lexsort([keys[k] for k in reversed(self._partition_by)])
+        sorted_keys = [keys[k][order] for k in self._partition_by]
+        boundaries = np.flatnonzero(np.any([k[1:] != k[:-1] for k in sorted_keys], axis=0)) + 1
+        for rows in np.split(order, boundaries):
+            first = rows[0]
+            directory = os.path.join(self._root, *(f"{k}={keys[k][first]}" for k in self._partition_by))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self._part:05d}{FILE_EXTENSIONS[self._file_format]}")
+            with open_trip_writer(path=path,
+                                  file_format=self._file_format,
+                                  coordinates=self._coordinates) as writer:
+                writer.write(df.iloc[np.sort(rows)].drop(columns=[k for k in self._partition_by if k in df.columns])
+                             .reset_index(drop=True))
+        self._part += 1
+        self.rows_written += len(df)
+
+
+def infer_file_format(path: Union[str, TextIO]) -> str:
+    """Output format from file extension of path, CSV if unknown or if a stream is given."""
+    extension = os.path.splitext(path)[1].lower() if isinstance(path, str) else ""
+    return {".parquet": "parquet", ".pq": "parquet",
+            ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow",
+            ".npz": "npz"}.get(extension, "csv")
+
+
+def open_trip_writer(path: Union[str, TextIO],
+                     file_format: Optional[str] = None,
+                     partition_by: Optional[Sequence[str]] = None,
+                     coordinates: str = "float32") -> _TripWriter:
+    """Open incremental writer for given path, format is inferred from file extension if not given.
+
+    Args:
+        path:           Path of output file, "-" or a text stream to write CSV to a pipe; root directory if partitioned
+        file_format:    Optional format, one of "csv", "parquet", "arrow" or "npz"
+        partition_by:   Optional partition keys, out of "agent_id" and "month"
+        coordinates:    Type of coordinate columns of binary formats, see `compact_columns`
+
+    Returns:
+        Writer with `write(df)` and `close()` methods, usable as context manager.
+    """
+    if partition_by:
+        return PartitionedTripWriter(root=path,
+                                     partition_by=partition_by,
+                                     file_format=file_format or "parquet",
+                                     coordinates=coordinates)
+
+    if file_format is None:
+        file_format = infer_file_format(path)
+
+    if file_format == "csv":
+        return CsvTripWriter(path)
+    elif file_format == "parquet":
+        return ParquetTripWriter(path, coordinates=coordinates)
+    elif file_format == "arrow":
+        return ArrowTripWriter(path, coordinates=coordinates)
+    elif file_format == "npz":
+        return NpzTripWriter(path, coordinates=coordinates)
+    raise ValueError(f"Unknown file format '{file_format}'.")
+
+
+def write_trip_chunks(chunks: Iterable["pd.DataFrame"],
+                      path: Union[str, TextIO],
+                      file_format: Optional[str] = None,
+                      partition_by: Optional[Sequence[str]] = None,
+                      coordinates: str = "float32",
+                      stats: Optional[GenerationStats] = None) -> int:
+    """Write chunks of trips to disk one by one as they are created.
+
+    Args:
+        chunks:         Iterable of Dataframes, e.g. from `iter_synthetic_data` or `iter_population_data`
+        path:           Path of output file, "-" or a text stream to write CSV to a pipe; root directory if partitioned
+        file_format:    Optional format, one of "csv", "parquet", "arrow" or "npz"
+        partition_by:   Optional partition keys, out of "agent_id" and "month"
+        coordinates:    Type of coordinate columns of binary formats, see `compact_columns`
+        stats:          Optional collector of per-stage timings, writing is timed as stage "write"
+
+    Returns:
+        Number of trips written.
+    """
+    # chunks may also be dicts of columns, e.g. from `create_trip_columns`, if written to unpartitioned binary files
+    with open_trip_writer(path=path,
+                          file_format=file_format,
+                          partition_by=partition_by,
+                          coordinates=coordinates) as writer:
+        for df in chunks:
+            with timed(stats, "write", rows=_n_rows(df)):
+                writer.write(df)
+    return writer.rows_written